@@ -26,9 +26,12 @@ urlpatterns = [
     url(r'^simulator_home$', translator_views.home, name='home'),
     url(r'^demo/(?P<sim_code>[\w-]+)/(?P<step>[\w-]+)/(?P<play_speed>[\w-]+)/$', translator_views.demo, name='demo'),
     url(r'^replay/(?P<sim_code>[\w-]+)/(?P<step>[\w-]+)/$', translator_views.replay, name='replay'),
+    url(r'^replay_movement/(?P<sim_code>[\w-]+)/$', translator_views.replay_movement, name='replay_movement'),
     url(r'^replay_persona_state/(?P<sim_code>[\w-]+)/(?P<step>[\w-]+)/(?P<persona_name>[\w-]+)/$', translator_views.replay_persona_state, name='replay_persona_state'),
+    url(r'^persona_memory/(?P<sim_code>[\w-]+)/(?P<persona_name>[\w-]+)/$', translator_views.persona_memory, name='persona_memory'),
     url(r'^process_environment/$', translator_views.process_environment, name='process_environment'),
     url(r'^update_environment/$', translator_views.update_environment, name='update_environment'),
+    url(r'^update_stream/$', translator_views.update_stream, name='update_stream'),
     url(r'^path_tester/$', translator_views.path_tester, name='path_tester'),
     url(r'^path_tester_update/$', translator_views.path_tester_update, name='path_tester_update'),
     path('admin/', admin.site.urls),
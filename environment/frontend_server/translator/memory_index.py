@@ -0,0 +1,144 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+File: memory_index.py
+Description: Defines the MemoryIndex class, an index over the associative
+memory (nodes.json) of a persona that the persona state inspector pages
+through. The nodes file is only parsed again when it changes on disk, and the
+nodes of each type are kept sorted by their node count.
+
+A page is returned newest first, i.e., by descending node count, as the
+inspector has always listed the nodes. A persona creates its nodes in the
+order of the simulation's time, so their creation times are in order too
+and a page of a time range is a slice found by binary search. (If they are
+not, e.g., in a hand-edited memory, we filter the nodes one by one.) The
+cursor of a page is the node count of its last node, so the next page
+starts right after that node even if the memory has grown in the meantime.
+"""
+import bisect
+import json
+import os
+import threading
+
+node_types = ["event", "chat", "thought"]
+
+
+class MemoryIndex:
+  def __init__(self, nodes_file):
+    self.nodes_file = nodes_file
+
+    # <file_stamp> is the (mtime, size) of the nodes file we have indexed.
+    self.file_stamp = None
+
+    # <nodes> maps a node type to its nodes sorted by node count, <counts>
+    # to their node counts and <created> to their creation times. The
+    # created time is a "%Y-%m-%d %H:%M:%S" string, so it sorts the same as
+    # the time. <created_in_order> tells whether the creation times of a
+    # type are sorted as well.
+    self.nodes = {node_type: [] for node_type in node_types}
+    self.counts = {node_type: [] for node_type in node_types}
+    self.created = {node_type: [] for node_type in node_types}
+    self.created_in_order = {node_type: True for node_type in node_types}
+    self.lock = threading.Lock()
+
+
+  def refresh(self):
+    """
+    Reads the nodes file again if it has changed since we indexed it.
+    """
+    stat = os.stat(self.nodes_file)
+    file_stamp = (stat.st_mtime_ns, stat.st_size)
+    with self.lock:
+      if file_stamp == self.file_stamp:
+        return
+      with open(self.nodes_file) as json_file:
+        associative = json.load(json_file)
+
+      nodes = {node_type: [] for node_type in node_types}
+      for node_details in associative.values():
+        if node_details["type"] in nodes:
+          nodes[node_details["type"]] += [node_details]
+      for node_type, type_nodes in nodes.items():
+        type_nodes.sort(key=lambda i: i["node_count"])
+        created = [i["created"] for i in type_nodes]
+        self.nodes[node_type] = type_nodes
+        self.counts[node_type] = [i["node_count"] for i in type_nodes]
+        self.created[node_type] = created
+        self.created_in_order[node_type] = all(
+          created[i] <= created[i + 1] for i in range(len(created) - 1))
+      self.file_stamp = file_stamp
+
+
+  def get_page(self, node_type, limit, cursor=None, since=None, until=None):
+    """
+    Returns a page of the nodes of a type, newest first.
+
+    INPUT
+      node_type: "event", "chat" or "thought".
+      limit: The maximum number of nodes in the page.
+      cursor: The cursor of the previous page, or None for the first page.
+      since, until: Only nodes created in [since, until] are returned. Both
+                    are "%Y-%m-%d %H:%M:%S" strings (or a prefix of one, e.g.
+                    "2023-02-13") or None.
+    OUTPUT
+      A tuple of the list of node dictionaries, the cursor of the next page
+      (None if this is the last page) and the number of nodes of the type in
+      the time range.
+    EXAMPLE
+      get_page("thought", 20, since="2023-02-13 09:00:00")
+    """
+    self.refresh()
+    with self.lock:
+      type_nodes = self.nodes[node_type]
+      counts = self.counts[node_type]
+      created = self.created[node_type]
+      created_in_order = self.created_in_order[node_type]
+
+    # A prefix such as "2023-02-13" covers the whole day.
+    until_key = until + "\uffff" if until else None
+    if created_in_order:
+      start = bisect.bisect_left(created, since) if since else 0
+      end = len(created)
+      if until:
+        end = bisect.bisect_right(created, until_key)
+      # <selected> holds the positions of the nodes in the time range.
+      selected = range(start, max(start, end))
+    else:
+      selected = [i for i, i_created in enumerate(created)
+                  if (not since or i_created >= since)
+                  and (not until or i_created <= until_key)]
+    total = len(selected)
+
+    if cursor:
+      end = bisect.bisect_left(counts, parse_cursor(cursor))
+      selected = selected[:bisect.bisect_left(selected, end)]
+    page = [type_nodes[i] for i in selected[-limit:]][::-1]
+
+    next_cursor = None
+    if len(selected) > limit:
+      next_cursor = make_cursor(counts[selected[-limit]])
+    return page, next_cursor, total
+
+
+def make_cursor(node_count):
+  return str(node_count)
+
+
+def parse_cursor(cursor):
+  return int(cursor)
+
+
+# <memory_indexes> keeps the index of each nodes file we have opened.
+memory_indexes = dict()
+memory_indexes_lock = threading.Lock()
+
+
+def get_memory_index(memory_folder):
+  """
+  Returns the MemoryIndex of a persona's memory folder (the folder that
+  contains associative_memory/nodes.json).
+  """
+  nodes_file = f"{memory_folder}/associative_memory/nodes.json"
+  with memory_indexes_lock:
+    if nodes_file not in memory_indexes:
+      memory_indexes[nodes_file] = MemoryIndex(nodes_file)
+    return memory_indexes[nodes_file]
@@ -0,0 +1,74 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+File: step_channel.py
+Description: The frontend end of the backend's step channel (see
+reverie/backend_server/step_channel.py). The backend writes the address and
+authkey of its channel to temp_storage/step_channel.json; these functions
+use it to hand over the environment of a step and to wait for the movement.
+They return None (or False) whenever the channel is not available, in which
+case the callers fall back to the step files.
+"""
+import json
+from multiprocessing.connection import Client
+
+from global_methods import *
+
+channel_info_file = "temp_storage/step_channel.json"
+
+
+def get_channel_info(sim_code):
+  """
+  Returns the info of the backend's step channel for the simulation, or None
+  if the backend is not serving that simulation through a channel.
+  """
+  if not check_if_file_exists(channel_info_file):
+    return None
+  try:
+    with open(channel_info_file) as json_file:
+      channel_info = json.load(json_file)
+  except (OSError, ValueError):
+    return None
+  if channel_info["sim_code"] != sim_code:
+    return None
+  return channel_info
+
+
+def request_channel(sim_code, request):
+  """
+  Sends the request to the backend's step channel and returns its reply, or
+  None if the channel is not available.
+  """
+  channel_info = get_channel_info(sim_code)
+  if not channel_info:
+    return None
+  request["sim_code"] = sim_code
+  try:
+    with Client(tuple(channel_info["address"]),
+                authkey=bytes.fromhex(channel_info["authkey"])) as conn:
+      conn.send(request)
+      return conn.recv()
+  except Exception:
+    # The backend has gone away (or has been restarted with a new authkey).
+    return None
+
+
+def send_environment(sim_code, step, environment):
+  """
+  Hands the environment of the step to the backend. Returns True if the
+  backend received it.
+  """
+  request = {"type": "environment",
+             "step": step,
+             "environment": environment}
+  return request_channel(sim_code, request) is True
+
+
+def wait_movement(sim_code, step, timeout):
+  """
+  Waits (up to <timeout> seconds) for the backend to finish the movement of
+  the step. Returns the movement dictionary, or None.
+  """
+  request = {"type": "movement",
+             "step": step,
+             "timeout": timeout}
+  return request_channel(sim_code, request)
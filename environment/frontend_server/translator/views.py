@@ -6,16 +6,48 @@ import os
 import string
 import random
 import json
+import shutil
+import sys
+import time
 from os import listdir
 import os
 
 import datetime
 from django.shortcuts import render, redirect, HttpResponseRedirect
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from global_methods import *
 
+# The step logs are written by the backend, so we read them with its
+# step_log module (reverie/backend_server/step_log.py).
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "..", "..", "reverie", "backend_server"))
+from step_log import *
+
 from django.contrib.staticfiles.templatetags.staticfiles import static
 from .models import *
+from .step_channel import *
+from .memory_index import *
+
+# <update_wait_sec> is the number of seconds that an update_environment 
+# request waits for the backend to finish the movement of the step. 
+update_wait_sec = 10
+# <stream_max_sec> is how long an update_stream response lasts. A stream 
+# holds on to a server worker, so we end it every so often and the browser 
+# reconnects (after <stream_retry_ms>), going on from the last step it got.
+stream_max_sec = 60
+stream_retry_ms = 1000
+# <memory_page_size> is the number of memory nodes of each type the persona
+# state inspector shows at first (and loads with each "more"), and 
+# <memory_page_max> the largest page persona_memory returns. 
+memory_page_size = 50
+memory_page_max = 500
+# <replay_window_steps> is the number of steps of movement that the demo 
+# page gets at a time. <replay_keyframe_steps> is how often we keep the full
+# movements of all personas when we convert an old master_movement.json (see
+# get_replay_logs()). 
+replay_window_steps = 500
+replay_keyframe_steps = 1000
+
 
 def landing(request): 
   context = {}
@@ -23,8 +55,63 @@ def landing(request):
   return render(request, template, context)
 
 
+def get_replay_logs(sim_code): 
+  """
+  Returns the movement log and the keyframe log of a compressed simulation 
+  (see compress_sim_storage.py). Simulations that were compressed before 
+  these logs existed only have master_movement.json; we convert it once. 
+
+  ARGS:
+    sim_code: the compressed simulation. 
+  RETURNS: 
+    (move_log, keyframe_log): StepLog instances. 
+  """
+  compressed_folder = f"compressed_storage/{sim_code}"
+  if not check_if_file_exists(f"{compressed_folder}/movement_log/index.jsonl"): 
+    with open(f"{compressed_folder}/master_movement.json") as json_file: 
+      raw_all_movement = json.load(json_file)
+
+    # We write the logs into temporary folders first, so a concurrent 
+    # request never sees a half converted log. 
+    tmp_suffix = f".tmp{os.getpid()}"
+    move_log = StepLog(f"{compressed_folder}/movement_log{tmp_suffix}")
+    keyframe_log = StepLog(f"{compressed_folder}/keyframe_log{tmp_suffix}")
+    persona_last_move = dict()
+    for int_key in range(len(raw_all_movement.keys())): 
+      step_move = raw_all_movement[str(int_key)]
+      persona_last_move.update(step_move)
+      move_log.append(int_key, step_move)
+      if int_key % replay_keyframe_steps == 0: 
+        keyframe_log.append(int_key, persona_last_move)
+    move_log.close()
+    keyframe_log.close()
+
+    for kind in ["keyframe_log", "movement_log"]: 
+      try: 
+        os.rename(f"{compressed_folder}/{kind}{tmp_suffix}", 
+                  f"{compressed_folder}/{kind}")
+      except OSError: 
+        # Another request has converted it in the meantime. 
+        shutil.rmtree(f"{compressed_folder}/{kind}{tmp_suffix}")
+
+  return (get_step_log(compressed_folder, "movement"), 
+          get_step_log(compressed_folder, "keyframe"))
+
+
+def get_replay_state(move_log, keyframe_log, step): 
+  """
+  Returns the movement of every persona as of the step (i.e., their latest
+  movement at or before it). We start from the closest keyframe and apply 
+  the changes of the steps after it. 
+  """
+  keyframe = keyframe_log.last_step(step)
+  state = keyframe_log.read(keyframe)
+  for int_key in range(keyframe + 1, step + 1): 
+    state.update(move_log.read(int_key))
+  return state
+
+
 def demo(request, sim_code, step, play_speed="2"): 
-  move_file = f"compressed_storage/{sim_code}/master_movement.json"
   meta_file = f"compressed_storage/{sim_code}/meta.json"
   step = int(step)
   play_speed_opt = {"1": 1, "2": 2, "3": 4,
@@ -40,20 +127,18 @@ def demo(request, sim_code, step, play_speed="2"):
   sec_per_step = meta["sec_per_step"]
   start_datetime = datetime.datetime.strptime(meta["start_date"] + " 00:00:00", 
                                               '%B %d, %Y %H:%M:%S')
-  for i in range(step): 
-    start_datetime += datetime.timedelta(seconds=sec_per_step)
+  start_datetime += datetime.timedelta(seconds=sec_per_step * step)
   start_datetime = start_datetime.strftime("%Y-%m-%dT%H:%M:%S")
 
-  # Loading the movement file
-  raw_all_movement = dict()
-  with open(move_file) as json_file: 
-    raw_all_movement = json.load(json_file)
+  # Loading the movement logs
+  move_log, keyframe_log = get_replay_logs(sim_code)
+  last_step = move_log.last_step()
  
   # Loading all names of the personas
   persona_names = dict()
   persona_names = []
   persona_names_set = set()
-  for p in list(raw_all_movement["0"].keys()): 
+  for p in list(move_log.read(0).keys()): 
     persona_names += [{"original": p, 
                        "underscore": p.replace(" ", "_"), 
                        "initial": p[0] + p.split(" ")[-1][0]}]
@@ -61,31 +146,28 @@ def demo(request, sim_code, step, play_speed="2"):
 
   # <all_movement> is the main movement variable that we are passing to the 
   # frontend. Whereas we use ajax scheme to communicate steps to the frontend
-  # during the simulation stage, for this demo, we send all movement 
-  # information in one step. 
+  # during the simulation stage, for this demo, we send the first 
+  # <replay_window_steps> steps with the page, and the page fetches the rest
+  # from replay_movement ahead of the playback. 
   all_movement = dict()
 
   # Preparing the initial step. 
   # <init_prep> sets the locations and descriptions of all agents at the
   # beginning of the demo determined by <step>. 
-  init_prep = dict() 
-  for int_key in range(step+1): 
-    key = str(int_key)
-    val = raw_all_movement[key]
-    for p in persona_names_set: 
-      if p in val: 
-        init_prep[p] = val[p]
+  init_prep = get_replay_state(move_log, keyframe_log, step)
   persona_init_pos = dict()
   for p in persona_names_set: 
     persona_init_pos[p.replace(" ","_")] = init_prep[p]["movement"]
   all_movement[step] = init_prep
 
-  # Finish loading <all_movement>
-  for int_key in range(step+1, len(raw_all_movement.keys())): 
-    all_movement[int_key] = raw_all_movement[str(int_key)]
+  # Loading the first window of <all_movement>
+  for int_key in range(step+1, min(step + replay_window_steps, last_step + 1)): 
+    all_movement[int_key] = move_log.read(int_key)
 
   context = {"sim_code": sim_code,
              "step": step,
+             "last_step": last_step,
+             "window_steps": replay_window_steps,
              "persona_names": persona_names,
              "persona_init_pos": json.dumps(persona_init_pos), 
              "all_movement": json.dumps(all_movement), 
@@ -98,10 +180,63 @@ def demo(request, sim_code, step, play_speed="2"):
   return render(request, template, context)
 
 
+def replay_movement(request, sim_code): 
+  """
+  Serves a window of the movements of a compressed simulation to the demo 
+  page, which fetches them ahead of the playback. 
+
+  ARGS:
+    request: Django request with the "start" step and the number of steps 
+             ("count") as GET parameters. 
+    sim_code: the compressed simulation. 
+  RETURNS: 
+    JsonResponse: {"movement": {step: movement changes}, "last_step": int}
+  """
+  start = int(request.GET.get("start", 0))
+  count = min(int(request.GET.get("count", replay_window_steps)), 
+              replay_window_steps)
+
+  move_log, keyframe_log = get_replay_logs(sim_code)
+  last_step = move_log.last_step()
+  movement = dict()
+  for int_key in range(max(start, 0), min(start + count, last_step + 1)): 
+    movement[int_key] = move_log.read(int_key)
+
+  return JsonResponse({"movement": movement, "last_step": last_step})
+
+
 def UIST_Demo(request): 
   return demo(request, "March20_the_ville_n25_UIST_RUN-step-1-141", 2160, play_speed="3")
 
 
+def get_sim_manifest(sim_code): 
+  """
+  Returns the personas and the latest environment step of a simulation in 
+  storage. They come from the manifest that the backend keeps up to date 
+  (see write_manifest() in step_log.py); simulations without one are 
+  scanned instead. 
+
+  ARGS:
+    sim_code: the simulation. 
+  RETURNS: 
+    (persona_names, last_step), where <persona_names> is a list of 
+    [name, name with underscores] pairs. 
+  """
+  sim_folder = f"storage/{sim_code}"
+  manifest = read_manifest(sim_folder)
+  if manifest and manifest["latest_step"] is not None: 
+    persona_names = [[x, x.replace(" ", "_")] 
+                     for x in manifest["persona_names"]]
+    return persona_names, manifest["latest_step"]
+
+  persona_names = []
+  for i in find_filenames(f"{sim_folder}/personas", ""): 
+    x = i.split("/")[-1].strip()
+    if x[0] != ".": 
+      persona_names += [[x, x.replace(" ", "_")]]
+  return persona_names, get_last_step(sim_folder, "environment")
+
+
 def home(request):
   f_curr_sim_code = "temp_storage/curr_sim_code.json"
   f_curr_step = "temp_storage/curr_step.json"
@@ -119,26 +254,15 @@ def home(request):
 
   os.remove(f_curr_step)
 
-  persona_names = []
-  persona_names_set = set()
-  for i in find_filenames(f"storage/{sim_code}/personas", ""): 
-    x = i.split("/")[-1].strip()
-    if x[0] != ".": 
-      persona_names += [[x, x.replace(" ", "_")]]
-      persona_names_set.add(x)
+  persona_names, last_step = get_sim_manifest(sim_code)
+  persona_names_set = set(i[0] for i in persona_names)
 
   persona_init_pos = []
-  file_count = []
-  for i in find_filenames(f"storage/{sim_code}/environment", ".json"):
-    x = i.split("/")[-1].strip()
-    if x[0] != ".": 
-      file_count += [int(x.split(".")[0])]
-  curr_json = f'storage/{sim_code}/environment/{str(max(file_count))}.json'
-  with open(curr_json) as json_file:  
-    persona_init_pos_dict = json.load(json_file)
-    for key, val in persona_init_pos_dict.items(): 
-      if key in persona_names_set: 
-        persona_init_pos += [[key, val["x"], val["y"]]]
+  persona_init_pos_dict = read_step(f"storage/{sim_code}", "environment", 
+                                    last_step)
+  for key, val in persona_init_pos_dict.items(): 
+    if key in persona_names_set: 
+      persona_init_pos += [[key, val["x"], val["y"]]]
 
   context = {"sim_code": sim_code,
              "step": step, 
@@ -153,26 +277,15 @@ def replay(request, sim_code, step):
   sim_code = sim_code
   step = int(step)
 
-  persona_names = []
-  persona_names_set = set()
-  for i in find_filenames(f"storage/{sim_code}/personas", ""): 
-    x = i.split("/")[-1].strip()
-    if x[0] != ".": 
-      persona_names += [[x, x.replace(" ", "_")]]
-      persona_names_set.add(x)
+  persona_names, last_step = get_sim_manifest(sim_code)
+  persona_names_set = set(i[0] for i in persona_names)
 
   persona_init_pos = []
-  file_count = []
-  for i in find_filenames(f"storage/{sim_code}/environment", ".json"):
-    x = i.split("/")[-1].strip()
-    if x[0] != ".": 
-      file_count += [int(x.split(".")[0])]
-  curr_json = f'storage/{sim_code}/environment/{str(max(file_count))}.json'
-  with open(curr_json) as json_file:  
-    persona_init_pos_dict = json.load(json_file)
-    for key, val in persona_init_pos_dict.items(): 
-      if key in persona_names_set: 
-        persona_init_pos += [[key, val["x"], val["y"]]]
+  persona_init_pos_dict = read_step(f"storage/{sim_code}", "environment", 
+                                    last_step)
+  for key, val in persona_init_pos_dict.items(): 
+    if key in persona_names_set: 
+      persona_init_pos += [[key, val["x"], val["y"]]]
 
   context = {"sim_code": sim_code,
              "step": step,
@@ -183,15 +296,20 @@ def replay(request, sim_code, step):
   return render(request, template, context)
 
 
+def get_persona_memory_folder(sim_code, persona_name): 
+  memory = f"storage/{sim_code}/personas/{persona_name}/bootstrap_memory"
+  if not os.path.exists(memory): 
+    memory = f"compressed_storage/{sim_code}/personas/{persona_name}/bootstrap_memory"
+  return memory
+
+
 def replay_persona_state(request, sim_code, step, persona_name): 
   sim_code = sim_code
   step = int(step)
 
   persona_name_underscore = persona_name
   persona_name = " ".join(persona_name.split("_"))
-  memory = f"storage/{sim_code}/personas/{persona_name}/bootstrap_memory"
-  if not os.path.exists(memory): 
-    memory = f"compressed_storage/{sim_code}/personas/{persona_name}/bootstrap_memory"
+  memory = get_persona_memory_folder(sim_code, persona_name)
 
   with open(memory + "/scratch.json") as json_file:  
     scratch = json.load(json_file)
@@ -199,25 +317,15 @@ def replay_persona_state(request, sim_code, step, persona_name):
   with open(memory + "/spatial_memory.json") as json_file:  
     spatial = json.load(json_file)
 
-  with open(memory + "/associative_memory/nodes.json") as json_file:  
-    associative = json.load(json_file)
-
-  a_mem_event = []
-  a_mem_chat = []
-  a_mem_thought = []
-
-  for count in range(len(associative.keys()), 0, -1): 
-    node_id = f"node_{str(count)}"
-    node_details = associative[node_id]
-
-    if node_details["type"] == "event":
-      a_mem_event += [node_details]
-
-    elif node_details["type"] == "chat":
-      a_mem_chat += [node_details]
-
-    elif node_details["type"] == "thought":
-      a_mem_thought += [node_details]
+  # We only render the first page of each type of memory; the inspector 
+  # loads the rest from persona_memory as the user asks for it. 
+  memory_index = get_memory_index(memory)
+  a_mem_event, a_mem_event_cursor, a_mem_event_count = (
+    memory_index.get_page("event", memory_page_size))
+  a_mem_chat, a_mem_chat_cursor, a_mem_chat_count = (
+    memory_index.get_page("chat", memory_page_size))
+  a_mem_thought, a_mem_thought_cursor, a_mem_thought_count = (
+    memory_index.get_page("thought", memory_page_size))
   
   context = {"sim_code": sim_code,
              "step": step,
@@ -227,11 +335,60 @@ def replay_persona_state(request, sim_code, step, persona_name):
              "spatial": spatial,
              "a_mem_event": a_mem_event,
              "a_mem_chat": a_mem_chat,
-             "a_mem_thought": a_mem_thought}
+             "a_mem_thought": a_mem_thought,
+             "a_mem_event_cursor": a_mem_event_cursor,
+             "a_mem_chat_cursor": a_mem_chat_cursor,
+             "a_mem_thought_cursor": a_mem_thought_cursor,
+             "a_mem_event_count": a_mem_event_count,
+             "a_mem_chat_count": a_mem_chat_count,
+             "a_mem_thought_count": a_mem_thought_count,
+             "memory_page_size": memory_page_size}
   template = "persona_state/persona_state.html"
   return render(request, template, context)
 
 
+def persona_memory(request, sim_code, persona_name): 
+  """
+  Returns a page of a persona's associative memory, newest first. 
+
+  ARGS:
+    request: Django request with the GET parameters 
+      type: "event", "chat" or "thought" (default "event"). 
+      since, until: optional "%Y-%m-%d %H:%M:%S" bounds (or a prefix of 
+                    one, e.g. "2023-02-13") of the creation time. 
+      cursor: the "next_cursor" of the previous page. 
+      limit: the page size (at most <memory_page_max>). 
+    sim_code: the simulation. 
+    persona_name: the persona, with underscores for spaces. 
+  RETURNS: 
+    JsonResponse of {"nodes": [...], "next_cursor": ..., "count": ...}, 
+    where "count" is the number of nodes of the type in the time range. 
+  """
+  persona_name = " ".join(persona_name.split("_"))
+  memory = get_persona_memory_folder(sim_code, persona_name)
+  if not os.path.exists(memory + "/associative_memory/nodes.json"): 
+    return JsonResponse({"error": "unknown persona"}, status=404)
+
+  node_type = request.GET.get("type", "event")
+  if node_type not in node_types: 
+    return JsonResponse({"error": f"unknown type {node_type}"}, status=400)
+  try: 
+    limit = int(request.GET.get("limit", memory_page_size))
+    cursor = request.GET.get("cursor") or None
+    if cursor: 
+      parse_cursor(cursor)
+  except ValueError: 
+    return JsonResponse({"error": "bad limit or cursor"}, status=400)
+  limit = min(max(limit, 1), memory_page_max)
+
+  nodes, next_cursor, count = get_memory_index(memory).get_page(
+    node_type, limit, cursor, 
+    request.GET.get("since") or None, request.GET.get("until") or None)
+  return JsonResponse({"nodes": nodes, 
+                       "next_cursor": next_cursor, 
+                       "count": count})
+
+
 def path_tester(request):
   context = {}
   template = "path_tester/path_tester.html"
@@ -242,8 +399,9 @@ def process_environment(request):
   """
   <FRONTEND to BACKEND> 
   This sends the frontend visual world information to the backend server. 
-  It does this by writing the current environment representation to 
-  "storage/environment.json" file. 
+  It does this by sending the current environment representation through the
+  backend's step channel, or by writing it to the 
+  "storage/environment/{step}.json" file. 
 
   ARGS:
     request: Django request
@@ -259,8 +417,12 @@ def process_environment(request):
   sim_code = data["sim_code"]
   environment = data["environment"]
 
-  with open(f"storage/{sim_code}/environment/{step}.json", "w") as outfile:
-    outfile.write(json.dumps(environment, indent=2))
+  # We hand the environment to the backend through its step channel (the 
+  # backend then logs it to the environment file itself). If the channel is 
+  # not available, we write the file that the backend polls for. 
+  if not send_environment(sim_code, step, environment): 
+    with open(f"storage/{sim_code}/environment/{step}.json", "w") as outfile:
+      outfile.write(json.dumps(environment, indent=2))
 
   return HttpResponse("received")
 
@@ -270,8 +432,8 @@ def update_environment(request):
   <BACKEND to FRONTEND> 
   This sends the backend computation of the persona behavior to the frontend
   visual server. 
-  It does this by reading the new movement information from 
-  "storage/movement.json" file.
+  It does this by waiting for the new movement information on the backend's
+  step channel, or by reading it from the simulation's movement log.
 
   ARGS:
     request: Django request
@@ -286,15 +448,92 @@ def update_environment(request):
   step = data["step"]
   sim_code = data["sim_code"]
 
+  # We wait for the movement on the backend's step channel for a while, so 
+  # the frontend gets it as soon as it is computed. If the channel is not 
+  # available, we check the simulation's movement log instead. A server 
+  # whose workers handle one request at a time (see update_stream) could not
+  # serve process_environment while we wait, so there we answer right away 
+  # and the browser polls again, as it did before the channel. 
+  wait_sec = update_wait_sec
+  if not request.META.get("wsgi.multithread", True): 
+    wait_sec = 0
   response_data = {"<step>": -1}
-  if (check_if_file_exists(f"storage/{sim_code}/movement/{step}.json")):
-    with open(f"storage/{sim_code}/movement/{step}.json") as json_file: 
-      response_data = json.load(json_file)
+  movement = wait_movement(sim_code, step, wait_sec)
+  if movement: 
+    response_data = movement
+    response_data["<step>"] = step
+  else: 
+    movement = read_step(f"storage/{sim_code}", "movement", step)
+    if movement: 
+      response_data = movement
       response_data["<step>"] = step
 
   return JsonResponse(response_data)
 
 
+def update_stream(request): 
+  """
+  <BACKEND to FRONTEND> 
+  Streams the backend computation of the persona behavior to the frontend 
+  visual server as server-sent events, one "movement" event per step, as 
+  soon as the backend has computed it. This replaces polling 
+  update_environment. 
+  The stream starts at the "step" GET parameter and ends after 
+  <stream_max_sec>. When the browser reconnects, it tells us the last step 
+  it got in the Last-Event-ID header and we go on from there. When the 
+  backend stops serving the simulation, we send an "end" event and the 
+  browser goes back to polling. 
+
+  We only stream the movements that the backend hands over on its step 
+  channel, and only on a server that handles requests concurrently. A 
+  server whose workers handle one request at a time (e.g., gunicorn's sync
+  workers, see the Procfile) could not serve the process_environment 
+  requests while a stream holds the worker. Otherwise, we answer with 204 
+  No Content, which tells the browser not to reconnect but to poll. 
+
+  ARGS:
+    request: Django request with the "sim_code" and "step" GET parameters. 
+  RETURNS: 
+    StreamingHttpResponse, or an empty HttpResponse with status 204
+  """
+  sim_code = request.GET["sim_code"]
+  step = int(request.GET["step"])
+  if request.META.get("HTTP_LAST_EVENT_ID", "").isdigit(): 
+    step = int(request.META["HTTP_LAST_EVENT_ID"]) + 1
+
+  if (not request.META.get("wsgi.multithread", True) 
+      or not get_channel_info(sim_code)): 
+    return HttpResponse(status=204)
+
+  def stream_movements(step): 
+    yield f"retry: {stream_retry_ms}\n\n"
+    end_time = time.time() + stream_max_sec
+    while time.time() < end_time: 
+      wait_sec = max(0, min(update_wait_sec, end_time - time.time()))
+      movement = wait_movement(sim_code, step, wait_sec)
+      if not movement and not get_channel_info(sim_code): 
+        # The backend has stopped serving the simulation; the movement of 
+        # the step may still have made it into the log. 
+        movement = read_step(f"storage/{sim_code}", "movement", step)
+        if not movement: 
+          yield "event: end\ndata: {}\n\n"
+          return
+      if movement: 
+        movement["<step>"] = step
+        yield f"id: {step}\nevent: movement\ndata: {json.dumps(movement)}\n\n"
+        step += 1
+      else: 
+        # A comment line keeps the connection alive (and lets us notice 
+        # when the browser is gone). 
+        yield ": waiting\n\n"
+
+  response = StreamingHttpResponse(stream_movements(step), 
+                                   content_type="text/event-stream")
+  response["Cache-Control"] = "no-cache"
+  response["X-Accel-Buffering"] = "no"
+  return response
+
+
 def path_tester_update(request): 
   """
   Processing the path and saving it to path_tester_env.json temp storage for 
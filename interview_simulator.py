@@ -1,17 +1,60 @@
 import os
 import json
+import math
 from datetime import datetime
 from reverie.backend_server.market_research_personas import SAMPLE_PERSONAS
 from reverie.backend_server.utils import safe_generate
+# Imported the way the LLM wrapper imports it, so that this is the instance
+# it records the requests into.
+from llm_metrics import llm_metrics
+from local_llm_wrapper import LocalLLMWrapper
+
+# What safe_generate answers when there was no response from the model: the
+# LLM wrapper's error response, and safe_generate's own fallback.
+FAILED_RESPONSES = {LocalLLMWrapper.ERROR_RESPONSE,
+                    "I need to think about this more."}
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens of text without a tokenizer.
+
+    English text averages about four characters per token with the BPE
+    tokenizers of the usual local models (phi3.5, llama); we round up, so
+    the estimate errs on the side of a shorter prompt.
+    """
+    return math.ceil(len(text) / 4)
+
 
 class MarketResearchInterviewer:
-    def __init__(self, persona_type, research_topic):
+    # How many tokens of the prompt the previous conversation may take.
+    HISTORY_TOKEN_BUDGET = 1024
+    # Turns that do not fit verbatim are summarized (once; the summaries
+    # are cached) if this is set, and left out otherwise.
+    SUMMARIZE_OLD_TURNS = False
+    SUMMARY_MAX_TOKENS = 60
+
+    def __init__(self, persona_type, research_topic,
+                 history_token_budget=None, summarize_old_turns=None,
+                 count_tokens=estimate_tokens):
         self.persona_type = persona_type
         self.research_topic = research_topic
         self.persona_context = SAMPLE_PERSONAS[persona_type].generate_persona_prompt()
         self.conversation_history = []
         self.results = {}
         self.interview_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # The LLM requests of this interview are recorded under this prompt
+        # type in llm_metrics.
+        self.metrics_label = f"interview:{persona_type}"
+        # count_tokens may be swapped for a real tokenizer's counter.
+        self.history_token_budget = (self.HISTORY_TOKEN_BUDGET
+                                     if history_token_budget is None
+                                     else history_token_budget)
+        self.summarize_old_turns = (self.SUMMARIZE_OLD_TURNS
+                                    if summarize_old_turns is None
+                                    else summarize_old_turns)
+        self.count_tokens = count_tokens
+        # Maps the index of a turn in conversation_history to its summary.
+        self.turn_summaries = {}
 
     def ask_question(self, question):
         full_prompt = f"""{self.persona_context}
@@ -23,14 +66,89 @@ Previous Conversation:
 
 Interview Question: {question}
 Participant:"""
-        response = safe_generate(full_prompt)
+        with llm_metrics.prompt_type(self.metrics_label):
+            response = safe_generate(full_prompt)
         self.conversation_history.append({"question": question, "response": response})
         return response
 
     def format_conversation_history(self):
-        return "\n".join([
-            f"Q: {item['question']}\nA: {item['response']}" for item in self.conversation_history[-3:]
-        ])
+        """Pack as much of the conversation as fits the token budget.
+
+        The turns are taken newest first. Once a turn does not fit verbatim,
+        it and the older turns are given as their summaries (if
+        summarize_old_turns is set) for as long as those fit. The newest
+        turn is always included, cut short if it alone is over the budget.
+        """
+        budget = self.history_token_budget
+        summary_header = "Earlier in the interview:"
+        verbatim = []
+        summarized = []
+        # Set once a turn did not fit verbatim; the older turns are then
+        # only summarized, so that the verbatim turns have no gaps.
+        verbatim_full = False
+        for index in range(len(self.conversation_history) - 1, -1, -1):
+            item = self.conversation_history[index]
+            turn = f"Q: {item['question']}\nA: {item['response']}"
+            # +1 for the newline that joins the turns.
+            tokens = self.count_tokens(turn) + 1
+            if not verbatim_full and tokens <= budget:
+                verbatim.insert(0, turn)
+                budget -= tokens
+                continue
+            verbatim_full = True
+            if not verbatim:
+                verbatim.insert(0, self._truncate_to_budget(turn, budget))
+                budget = 0
+                continue
+            if not self.summarize_old_turns:
+                break
+            overhead = 0
+            if not summarized:
+                overhead = self.count_tokens(summary_header) + 1
+            # Do not generate a summary that cannot fit anyway.
+            if overhead + self.count_tokens("- ") + 1 >= budget:
+                break
+            summary = f"- {self.summarize_turn(index)}"
+            tokens = overhead + self.count_tokens(summary) + 1
+            if tokens > budget:
+                break
+            summarized.insert(0, summary)
+            budget -= tokens
+
+        if summarized:
+            return "\n".join([summary_header] + summarized
+                             + verbatim)
+        return "\n".join(verbatim)
+
+    def summarize_turn(self, index):
+        """Return the one-sentence summary of a turn, generating it the first
+        time it is needed.
+
+        A summary that failed is not cached: the turn is given verbatim (on
+        one line) this time, and the summary is generated again next time.
+        """
+        if index in self.turn_summaries:
+            return self.turn_summaries[index]
+        item = self.conversation_history[index]
+        prompt = f"""Summarize this interview exchange in one short sentence, keeping what the participant said about themselves.
+
+Q: {item['question']}
+A: {item['response']}
+Summary:"""
+        with llm_metrics.prompt_type(f"{self.metrics_label}:summary"):
+            summary = safe_generate(prompt, max_tokens=self.SUMMARY_MAX_TOKENS,
+                                    temperature=0)
+        summary = " ".join(summary.split())
+        if not summary or summary in FAILED_RESPONSES:
+            return " ".join(f"Q: {item['question']} A: {item['response']}".split())
+        self.turn_summaries[index] = summary
+        return summary
+
+    def _truncate_to_budget(self, text, budget):
+        """Cut text from the end until it fits budget tokens."""
+        while text and self.count_tokens(text) > budget:
+            text = text[:int(len(text) * budget / self.count_tokens(text))]
+        return text
 
     def conduct_full_interview(self, questions):
         for idx, question in enumerate(questions, 1):
@@ -48,6 +166,7 @@ Participant:"""
                 "persona_type": self.persona_type,
                 "research_topic": self.research_topic,
                 "conversation_history": self.conversation_history,
-                "results": self.results
+                "results": self.results,
+                "llm_metrics": llm_metrics.get().get(self.metrics_label)
             }, f, indent=2)
         return filepath
@@ -0,0 +1,131 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: annotation_cache.py
+Description: Defines the AnnotationCache class, a cache of the annotations
+that we generate for every new action (its pronunciatio, its event triple,
+the description of the object's state, and the object's event triple). The
+same action descriptions ("sleeping", "having breakfast") come up again and
+again across personas and days, and these annotations only depend on the
+description, so each of them only needs to be generated once.
+
+An entry is keyed by the kind of annotation and the normalized description
+(lower case, single spaces, no trailing period). The name of the persona is
+replaced by a placeholder in both the key and the value, so "Isabella
+Rodriguez is sleeping" and "Klaus Mueller is sleeping" share one entry and
+each persona gets the annotation back with its own name.
+
+The cache of a simulation is kept in reverie/annotation_cache.json, so it
+carries over when the simulation is saved and forked.
+"""
+import json
+import os
+import re
+import threading
+
+# <use_annotation_cache> turns the cache on or off, and
+# <persist_annotation_cache> whether the simulation loads and saves it.
+use_annotation_cache = True
+persist_annotation_cache = True
+persona_placeholder = "<persona>"
+
+
+class AnnotationCache:
+  def __init__(self):
+    # <entries> maps a key (see get_key()) to the templated annotation, a
+    # string or a list of strings.
+    self.entries = dict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+
+  def get_key(self, kind, descriptions, persona_name):
+    """
+    Returns the key of an annotation.
+
+    INPUT
+      kind: The kind of annotation. e.g., "pronunciatio"
+      descriptions: The list of strings the annotation is generated from.
+                    e.g., ["bed", "being slept in"]
+      persona_name: The name of the persona we annotate for.
+    OUTPUT
+      The key string. e.g., "act_obj_event_triple|bed|being slept in"
+    """
+    parts = [kind]
+    for description in descriptions:
+      description = " ".join(description.lower().split()).rstrip(".")
+      parts += [template_name(description, persona_name.lower())]
+    return "|".join(parts)
+
+
+  def get(self, kind, descriptions, persona_name):
+    """
+    Returns the cached annotation with the persona's name filled in, or None
+    if we do not have it.
+    """
+    key = self.get_key(kind, descriptions, persona_name)
+    with self.lock:
+      value = self.entries.get(key)
+      if value is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+    return fill_name(value, persona_name)
+
+
+  def set(self, kind, descriptions, persona_name, value):
+    """
+    Caches an annotation. <value> is a string or a list/tuple of strings.
+    """
+    key = self.get_key(kind, descriptions, persona_name)
+    with self.lock:
+      self.entries[key] = template_name(value, persona_name)
+
+
+  def load(self, cache_file):
+    """
+    Loads the entries of a cache file (if it exists) into the cache.
+    """
+    if not os.path.exists(cache_file):
+      return
+    try:
+      with open(cache_file) as json_file:
+        entries = json.load(json_file)
+    except (OSError, ValueError):
+      return
+    with self.lock:
+      self.entries.update(entries)
+
+
+  def save(self, cache_file):
+    with self.lock:
+      entries = dict(self.entries)
+    with open(cache_file + ".tmp", "w") as outfile:
+      outfile.write(json.dumps(entries, indent=2, ensure_ascii=False))
+    os.replace(cache_file + ".tmp", cache_file)
+
+
+def template_name(value, persona_name):
+  """
+  Replaces the persona's name in a string (or in each string of a list) with
+  the placeholder. fill_name() reverses it.
+  """
+  if isinstance(value, (list, tuple)):
+    return [template_name(i, persona_name) for i in value]
+  if not persona_name:
+    return value
+  return re.sub(rf"\b{re.escape(persona_name)}\b", persona_placeholder, value)
+
+
+def fill_name(value, persona_name):
+  if isinstance(value, (list, tuple)):
+    return [fill_name(i, persona_name) for i in value]
+  return value.replace(persona_placeholder, persona_name)
+
+
+def get_annotation_cache_file(sim_folder):
+  return f"{sim_folder}/reverie/annotation_cache.json"
+
+
+annotation_cache = AnnotationCache()
@@ -225,6 +225,33 @@ def copyanything(src, dst):
     else: raise
 
 
+def linkanything(src, dst, is_shared):
+  """
+  Copy over everything in the src folder to dst folder, except that the files
+  for which is_shared returns True are hard linked instead of copied. A 
+  linked file shares its storage with the original, so only do this for 
+  files that are never written again. If a file cannot be linked (e.g., 
+  src and dst are on different file systems), it is copied. 
+  ARGS:
+    src: address of the source folder  
+    dst: address of the destination folder  
+    is_shared: function that takes the address of a file in src and returns
+               whether it can be shared. 
+  RETURNS: 
+    None
+  """
+  def link_or_copy(src_file, dst_file): 
+    if is_shared(src_file): 
+      try: 
+        os.link(src_file, dst_file)
+        return dst_file
+      except OSError: 
+        pass
+    return shutil.copy2(src_file, dst_file)
+
+  shutil.copytree(src, dst, copy_function=link_or_copy)
+
+
 if __name__ == '__main__':
   pass
 
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class LLMMetrics:
+    """Per-prompt-type counters of the requests made to the local LLM.
+
+    LocalLLMWrapper records every request here under the prompt type of the
+    calling thread (see prompt_type()); requests made outside of one are
+    counted as "unlabeled". Recording is a few additions under a lock, so
+    it is always on.
+    """
+
+    # Summed per prompt type. The durations are in milliseconds; the
+    # prompt_eval/eval/total durations are the ones Ollama reports, and
+    # wall_ms is the time the request took as seen by the client. coalesced
+    # counts the requests that shared the generation of an identical
+    # request in flight instead of making one (see LocalLLMWrapper).
+    FIELDS = ("requests", "errors", "coalesced", "prompt_tokens",
+              "completion_tokens", "prompt_eval_ms", "eval_ms", "total_ms",
+              "wall_ms")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats = {}
+        self.started = datetime.now()
+
+    @contextmanager
+    def prompt_type(self, prompt_type):
+        """Records the requests of this thread under prompt_type while the
+        block runs."""
+        previous = getattr(self.local, "prompt_type", None)
+        self.local.prompt_type = prompt_type
+        try:
+            yield
+        finally:
+            self.local.prompt_type = previous
+
+    def current_prompt_type(self):
+        return getattr(self.local, "prompt_type", None) or "unlabeled"
+
+    def record(self, usage, prompt_type=None):
+        """Adds one request. usage is a dict with (some of) the FIELDS after
+        "coalesced" and an "error" flag."""
+        with self.lock:
+            row = self._get_row(prompt_type)
+            row["requests"] += 1
+            if usage.get("error"):
+                row["errors"] += 1
+            for field in self.FIELDS[3:]:
+                row[field] += usage.get(field, 0)
+
+    def record_coalesced(self, prompt_type=None):
+        """Adds one request that shared an identical request's generation."""
+        with self.lock:
+            self._get_row(prompt_type)["coalesced"] += 1
+
+    def _get_row(self, prompt_type):
+        if prompt_type is None:
+            prompt_type = self.current_prompt_type()
+        if prompt_type not in self.stats:
+            self.stats[prompt_type] = dict.fromkeys(self.FIELDS, 0)
+        return self.stats[prompt_type]
+
+    def get(self):
+        """Returns a copy of the per-prompt-type stats."""
+        with self.lock:
+            return {prompt_type: dict(row)
+                    for prompt_type, row in self.stats.items()}
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.started = datetime.now()
+
+    def get_report(self, call_stats=None):
+        """Returns the per-prompt-type stats, busiest first, with the totals.
+
+        call_stats: optional {prompt_type: {"calls", "attempts", "skipped",
+        "fail_safes", ...}} of the calls that made the requests (see
+        PromptStats in gpt_structure.py); adds their call, retry and fail
+        safe counts.
+        """
+        stats = self.get()
+        for prompt_type, calls in (call_stats or {}).items():
+            row = stats.setdefault(prompt_type, dict.fromkeys(self.FIELDS, 0))
+            row["calls"] = calls["calls"]
+            # Every call that was not skipped makes a first attempt; the
+            # rest of its attempts are retries.
+            row["retries"] = (calls["attempts"]
+                              - (calls["calls"] - calls["skipped"]))
+            row["fail_safes"] = calls["fail_safes"]
+
+        totals = {}
+        for row in stats.values():
+            for field, value in row.items():
+                totals[field] = totals.get(field, 0) + value
+        prompt_types = sorted(stats, key=lambda i: stats[i]["wall_ms"],
+                              reverse=True)
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "written": datetime.now().isoformat(timespec="seconds"),
+            "prompt_types": {i: stats[i] for i in prompt_types},
+            "totals": totals,
+        }
+
+    def format_report(self, call_stats=None):
+        """Returns the report as a table for printing."""
+        report = self.get_report(call_stats)
+        header = (f"{'prompt type':<50} {'calls':>6} {'reqs':>6} "
+                  f"{'shared':>6} {'retry':>6} {'fail':>5} "
+                  f"{'in tok':>8} {'out tok':>8} "
+                  f"{'eval s':>8} {'wall s':>8} {'avg s':>6}")
+        lines = [header, "-" * len(header)]
+        rows = list(report["prompt_types"].items())
+        rows += [("TOTAL", report["totals"])]
+        for prompt_type, row in rows:
+            requests = row.get("requests", 0)
+            wall_sec = row.get("wall_ms", 0) / 1000
+            eval_sec = (row.get("prompt_eval_ms", 0)
+                        + row.get("eval_ms", 0)) / 1000
+            avg_sec = wall_sec / requests if requests else 0
+            lines += [f"{prompt_type[-50:]:<50} {row.get('calls', '-'):>6} "
+                      f"{requests:>6} {row.get('coalesced', 0):>6} "
+                      f"{row.get('retries', '-'):>6} "
+                      f"{row.get('fail_safes', '-'):>5} "
+                      f"{row.get('prompt_tokens', 0):>8} "
+                      f"{row.get('completion_tokens', 0):>8} "
+                      f"{eval_sec:>8.1f} {wall_sec:>8.1f} {avg_sec:>6.2f}"]
+        return "\n".join(lines)
+
+    def export(self, path, call_stats=None):
+        """Writes the report as JSON to path."""
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.get_report(call_stats), f, indent=2)
+        # Replaced in one go, so a reader never sees a partial report.
+        os.replace(path + ".tmp", path)
+
+
+def get_usage(response_body, wall_sec):
+    """Returns the usage of an Ollama /api/generate response body."""
+    return {
+        "prompt_tokens": response_body.get("prompt_eval_count", 0),
+        "completion_tokens": response_body.get("eval_count", 0),
+        "prompt_eval_ms": response_body.get("prompt_eval_duration", 0) / 1e6,
+        "eval_ms": response_body.get("eval_duration", 0) / 1e6,
+        "total_ms": response_body.get("total_duration", 0) / 1e6,
+        "wall_ms": wall_sec * 1000,
+    }
+
+
+llm_metrics = LLMMetrics()
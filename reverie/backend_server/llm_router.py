@@ -0,0 +1,222 @@
+import threading
+import time
+
+import requests
+
+from llm_metrics import llm_metrics
+from local_llm_wrapper import LocalLLMWrapper
+
+
+class Backend:
+    """One Ollama server of an LLMRouter's pool and its state."""
+
+    def __init__(self, base_url, max_concurrency=1):
+        self.base_url = base_url.rstrip("/")
+        self.api_url = f"{self.base_url}/api/generate"
+        # Requests sent to this server at once; Ollama queues the rest
+        # anyway (OLLAMA_NUM_PARALLEL), so more only adds latency.
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.healthy = True
+        # drained: taken out of the pool by hand (see LLMRouter.drain).
+        # drained_until: taken out after failing, until this time.
+        self.drained = False
+        self.drained_until = 0.0
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+
+    def is_available(self, now):
+        return (self.healthy and not self.drained
+                and now >= self.drained_until)
+
+    def get_stats(self, now):
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "drained": self.drained or now < self.drained_until,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class LLMRouter(LocalLLMWrapper):
+    """A LocalLLMWrapper that spreads its requests over a pool of Ollama
+    servers (e.g. one per NUMA node or host) that all serve model_name.
+
+    Each request goes to the available server with the fewest requests
+    outstanding, relative to its max_concurrency; when every server is at
+    its cap, the request waits for one to free up. A server that fails
+    fail_threshold requests in a row is drained for drain_cooldown seconds,
+    and a server that fails its health check (GET /api/tags, every
+    health_check_interval seconds) is left out until it passes one again.
+    A failed request is retried on the next server, so a request only fails
+    when every available server failed it.
+
+    backends: base URLs, or dicts with a "base_url" and optionally a
+    "max_concurrency" (default_concurrency otherwise).
+    """
+
+    def __init__(self, backends, model_name="phi3.5", default_concurrency=1,
+                 fail_threshold=3, drain_cooldown=30.0,
+                 health_check_interval=10.0, health_check_timeout=2.0):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = []
+        for backend in backends:
+            if isinstance(backend, str):
+                backend = {"base_url": backend}
+            self.backends.append(Backend(
+                backend["base_url"],
+                backend.get("max_concurrency", default_concurrency)))
+        super().__init__(model_name=model_name,
+                         base_url=self.backends[0].base_url)
+
+        self.fail_threshold = fail_threshold
+        self.drain_cooldown = drain_cooldown
+        self.health_check_timeout = health_check_timeout
+        # Guards the state of the backends; notified whenever a backend
+        # frees up or comes back.
+        self.pool_changed = threading.Condition()
+
+        self.health_check_interval = health_check_interval
+        self.stopped = threading.Event()
+        if health_check_interval:
+            self.health_checker = threading.Thread(
+                target=self._run_health_checks, daemon=True,
+                name="llm-router-health")
+            self.health_checker.start()
+
+    def _request(self, data):
+        tried = set()
+        while True:
+            backend = self._acquire_backend(tried)
+            if backend is None:
+                break
+            tried.add(backend)
+            try:
+                response = self._send(backend.api_url, data)
+            finally:
+                self._release_backend(
+                    backend, self.local.last_usage.get("error", False))
+            if response != self.ERROR_RESPONSE:
+                return response
+
+        if not tried:
+            print("Error generating response: no LLM backend available")
+            self.local.last_usage = {"error": True}
+            llm_metrics.record(self.local.last_usage)
+        return self.ERROR_RESPONSE
+
+    def _acquire_backend(self, tried):
+        """Takes a slot on the least loaded available backend that has not
+        been tried yet, waiting while they are all at their cap. Returns
+        None when no such backend is left."""
+        with self.pool_changed:
+            while True:
+                now = time.monotonic()
+                candidates = [i for i in self.backends
+                              if i not in tried and i.is_available(now)]
+                if not candidates:
+                    return None
+                free = [i for i in candidates
+                        if i.outstanding < i.max_concurrency]
+                if free:
+                    backend = min(free, key=lambda i: (
+                        i.outstanding / i.max_concurrency, i.outstanding))
+                    backend.outstanding += 1
+                    backend.requests += 1
+                    return backend
+                # Wake up for drains that run out, too.
+                self.pool_changed.wait(timeout=1.0)
+
+    def _release_backend(self, backend, failed):
+        with self.pool_changed:
+            backend.outstanding -= 1
+            if not failed:
+                backend.consecutive_failures = 0
+            else:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.fail_threshold:
+                    print(f"Draining LLM backend {backend.base_url} for "
+                          f"{self.drain_cooldown:.0f}s after "
+                          f"{backend.consecutive_failures} failures")
+                    backend.drained_until = (time.monotonic()
+                                             + self.drain_cooldown)
+                    backend.consecutive_failures = 0
+            self.pool_changed.notify_all()
+
+    def check_health(self):
+        """Checks every backend once, in parallel."""
+        checks = [threading.Thread(target=self._check_backend, args=(i,))
+                  for i in self.backends]
+        for check in checks:
+            check.start()
+        for check in checks:
+            check.join()
+
+    def _check_backend(self, backend):
+        try:
+            response = requests.get(f"{backend.base_url}/api/tags",
+                                    timeout=self.health_check_timeout)
+            healthy = response.status_code == 200
+        except Exception:
+            healthy = False
+        with self.pool_changed:
+            if healthy != backend.healthy:
+                print(f"LLM backend {backend.base_url} is "
+                      f"{'up' if healthy else 'down'}")
+            backend.healthy = healthy
+            self.pool_changed.notify_all()
+
+    def _run_health_checks(self):
+        while not self.stopped.wait(self.health_check_interval):
+            self.check_health()
+
+    def drain(self, base_url):
+        """Stops sending new requests to a backend (e.g. to restart it);
+        its requests in flight finish."""
+        self._set_drained(base_url, True)
+
+    def undrain(self, base_url):
+        self._set_drained(base_url, False)
+
+    def _set_drained(self, base_url, drained):
+        with self.pool_changed:
+            for backend in self.backends:
+                if backend.base_url == base_url.rstrip("/"):
+                    backend.drained = drained
+                    backend.drained_until = 0.0
+                    break
+            else:
+                raise ValueError(f"Unknown LLM backend: {base_url}")
+            self.pool_changed.notify_all()
+
+    def stop(self):
+        """Stops the health checks."""
+        self.stopped.set()
+
+    def get_backend_stats(self):
+        with self.pool_changed:
+            now = time.monotonic()
+            return [i.get_stats(now) for i in self.backends]
+
+    def format_backend_report(self):
+        """Returns the state and load of each backend as a table."""
+        header = (f"{'backend':<40} {'state':>8} {'busy':>6} "
+                  f"{'reqs':>6} {'fails':>6}")
+        lines = [header, "-" * len(header)]
+        for stats in self.get_backend_stats():
+            if not stats["healthy"]:
+                state = "down"
+            elif stats["drained"]:
+                state = "drained"
+            else:
+                state = "up"
+            lines += [f"{stats['base_url'][-40:]:<40} {state:>8} "
+                      f"{stats['outstanding']:>3}/{stats['max_concurrency']:<2} "
+                      f"{stats['requests']:>6} {stats['failures']:>6}"]
+        return "\n".join(lines)
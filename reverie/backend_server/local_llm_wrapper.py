@@ -1,16 +1,39 @@
 import requests
 import json
+import threading
 import time
 import re
 
+from llm_metrics import llm_metrics, get_usage
+
 class LocalLLMWrapper:
+    # Returned by generate_response when the model could not be reached.
+    ERROR_RESPONSE = "Error: Unable to generate response"
+    DEFAULT_STOP = ["\n\n", "Human:", "Assistant:"]
+
     def __init__(self, model_name="phi3.5", base_url="http://localhost:11434"):
         self.model_name = model_name
         self.base_url = base_url
         self.api_url = f"{base_url}/api/generate"
-        
-    def generate_response(self, prompt, max_tokens=512, temperature=0.7):
-        """Generate response using local Ollama model"""
+        # The usage of the last request of each thread (see get_last_usage).
+        self.local = threading.local()
+        # Identical requests that are in flight at the same time share one
+        # generation (see _should_coalesce). in_flight maps a request key to
+        # the _Flight of the request that is being made.
+        self.coalesce_requests = True
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+
+    def generate_response(self, prompt, max_tokens=512, temperature=0.7,
+                          stop=None, options=None, format=None):
+        """Generate response using local Ollama model
+
+        stop: list of stop sequences (None for DEFAULT_STOP, [] for none).
+        options: extra Ollama options (e.g. top_p, presence_penalty) that
+        override the defaults.
+        format: "json" or a JSON schema dict; Ollama then constrains the
+        response to JSON (of that schema).
+        """
         data = {
             "model": self.model_name,
             "prompt": prompt,
@@ -19,19 +42,76 @@ class LocalLLMWrapper:
                 "temperature": temperature,
                 "num_predict": max_tokens,
                 "top_p": 0.9,
-                "stop": ["\n\n", "Human:", "Assistant:"]
+                "stop": self.DEFAULT_STOP if stop is None else list(stop)
             }
         }
-        
+        if options:
+            data["options"].update(options)
+        if format is not None:
+            data["format"] = format
+
+        if not self._should_coalesce(data):
+            return self._request(data)
+
+        key = json.dumps(data, sort_keys=True, ensure_ascii=False)
+        with self.in_flight_lock:
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[key] = _Flight()
+        if not leader:
+            # Another thread is making this very request; wait for its
+            # response instead of generating it again.
+            flight.done.wait()
+            self.local.last_usage = dict(flight.usage or {}, coalesced=True)
+            llm_metrics.record_coalesced()
+            return flight.response
+
+        try:
+            flight.response = self._request(data)
+            flight.usage = self.get_last_usage()
+        finally:
+            with self.in_flight_lock:
+                del self.in_flight[key]
+            flight.done.set()
+        return flight.response
+
+    def _should_coalesce(self, data):
+        """Only requests whose response does not depend on sampling (a
+        temperature of 0 or a fixed seed) may share a generation; sampled
+        requests are expected to come out different."""
+        options = data["options"]
+        return self.coalesce_requests and (options.get("temperature") == 0
+                                           or options.get("seed") is not None)
+
+    def _request(self, data):
+        return self._send(self.api_url, data)
+
+    def _send(self, api_url, data):
+        start = time.perf_counter()
         try:
-            response = requests.post(self.api_url, json=data, timeout=60)
+            response = requests.post(api_url, json=data, timeout=60)
             if response.status_code == 200:
-                return response.json()["response"].strip()
+                body = response.json()
+                text = body["response"].strip()
+                self._record_usage(get_usage(body, time.perf_counter() - start))
+                return text
             else:
                 raise Exception(f"Ollama API error: {response.status_code}")
         except Exception as e:
             print(f"Error generating response: {e}")
-            return "Error: Unable to generate response"
+            self._record_usage({"error": True,
+                                "wall_ms": (time.perf_counter() - start) * 1000})
+            return self.ERROR_RESPONSE
+
+    def _record_usage(self, usage):
+        self.local.last_usage = usage
+        llm_metrics.record(usage)
+
+    def get_last_usage(self):
+        """Return the token counts and durations of this thread's last
+        request (see llm_metrics.get_usage), or None."""
+        return getattr(self.local, "last_usage", None)
     
     def extract_rating(self, response_text):
         """Extract numerical rating from response"""
@@ -39,3 +119,12 @@ class LocalLLMWrapper:
         if numbers:
             return int(numbers[0])
         return 5  # Default rating
+
+
+class _Flight:
+    """A request in flight that identical requests wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = LocalLLMWrapper.ERROR_RESPONSE
+        self.usage = None
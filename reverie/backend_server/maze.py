@@ -11,6 +11,9 @@ import datetime
 import pickle
 import time
 import math
+import heapq
+
+from operator import itemgetter
 
 from global_methods import *
 from utils import *
@@ -155,6 +158,38 @@ class Maze:
         
         row += [tile_details]
       self.tiles += [row]
+
+    # Array layers for vectorized spatial queries. 
+    # <arena_id_maze> is a height x width numpy matrix that stores an integer
+    # id for the arena path ("world:sector:arena") of every tile, so that 
+    # finding the arena of a tile (or masking a window of the maze by an 
+    # arena) is a single array operation. <arena_ids> maps the arena path to
+    # its integer id. 
+    # e.g., self.arena_ids['the ville:hobbs cafe:cafe'] == 12
+    #       self.arena_id_maze[9][58] == 12
+    self.arena_ids = dict()
+    self.arena_id_maze = numpy.zeros((self.maze_height, self.maze_width), 
+                                     dtype=numpy.int32)
+    for i in range(self.maze_height):
+      for j in range(self.maze_width): 
+        arena_path = self.get_tile_path((j, i), "arena")
+        if arena_path not in self.arena_ids: 
+          self.arena_ids[arena_path] = len(self.arena_ids)
+        self.arena_id_maze[i][j] = self.arena_ids[arena_path]
+
+    # Spatial event index. 
+    # <arena_events> maps an arena id to all (tile, event) pairs that are 
+    # currently active in that arena. It is kept in sync with the "events" 
+    # sets of self.tiles by the event functions below (add_event_from_tile, 
+    # remove_event_from_tile, etc.), so perception only needs to look at the 
+    # events of the current arena instead of every tile in the vision square.
+    # We use dictionaries (with None values) as insertion-ordered sets. 
+    # e.g., self.arena_events[12] = 
+    #         {((72, 14), ('Isabella Rodriguez', 'is', 'idle', 'idle')): None,
+    #          ((74, 15), ('the ville:hobbs cafe:cafe:piano', None, None, 
+    #                      None)): None, ...}
+    self.arena_events = dict()
+
     # Each game object occupies an event in the tile. We are setting up the 
     # default event value here. 
     for i in range(self.maze_height):
@@ -165,7 +200,7 @@ class Maze:
                                   self.tiles[i][j]["arena"], 
                                   self.tiles[i][j]["game_object"]])
           go_event = (object_name, None, None, None)
-          self.tiles[i][j]["events"].add(go_event)
+          self.add_event_from_tile(go_event, (j, i))
 
     # Reverse tile access. 
     # <self.address_tiles> -- given a string address, we return a set of all 
@@ -283,23 +318,18 @@ class Maze:
     return path
 
 
-  def get_nearby_tiles(self, tile, vision_r): 
+  def get_vision_window(self, tile, vision_r): 
     """
-    Given the current tile and vision_r, return a list of tiles that are 
-    within the radius. Note that this implementation looks at a square 
-    boundary when determining what is within the radius. 
-    i.e., for vision_r, returns x's. 
-    x x x x x 
-    x x x x x
-    x x P x x 
-    x x x x x
-    x x x x x
+    Given the current tile and vision_r, return the boundary of the square
+    that is within the radius. The boundary is half-open, so it can be used
+    directly to slice the maze matrices (e.g., self.arena_id_maze). 
 
     INPUT: 
       tile: The tile coordinate of our interest in (x, y) form.
       vision_r: The radius of the persona's vision. 
     OUTPUT: 
-      nearby_tiles: a list of tiles that are within the radius. 
+      (left_end, right_end, top_end, bottom_end): the x range is 
+        [left_end, right_end) and the y range is [top_end, bottom_end). 
     """
     left_end = 0
     if tile[0] - vision_r > left_end: 
@@ -317,13 +347,95 @@ class Maze:
     if tile[1] - vision_r > top_end: 
       top_end = tile[1] - vision_r 
 
-    nearby_tiles = []
-    for i in range(left_end, right_end): 
-      for j in range(top_end, bottom_end): 
-        nearby_tiles += [(i, j)]
+    return left_end, right_end, top_end, bottom_end
+
+
+  def get_nearby_tiles(self, tile, vision_r): 
+    """
+    Given the current tile and vision_r, return a list of tiles that are 
+    within the radius. Note that this implementation looks at a square 
+    boundary when determining what is within the radius. 
+    i.e., for vision_r, returns x's. 
+    x x x x x 
+    x x x x x
+    x x P x x 
+    x x x x x
+    x x x x x
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+    OUTPUT: 
+      nearby_tiles: a list of tiles that are within the radius. 
+    """
+    left_end, right_end, top_end, bottom_end = self.get_vision_window(
+                                                             tile, vision_r)
+    xs, ys = numpy.meshgrid(numpy.arange(left_end, right_end), 
+                            numpy.arange(top_end, bottom_end), 
+                            indexing="ij")
+    nearby_tiles = list(zip(xs.ravel().tolist(), ys.ravel().tolist()))
     return nearby_tiles
 
 
+  def get_nearby_arena_events(self, tile, vision_r, att_bandwidth): 
+    """
+    The perception kernel. Given the current tile and vision_r, return the 
+    att_bandwidth closest events that take place within the radius and in 
+    the same arena as the current tile. 
+
+    Rather than visiting every tile in the vision square, we only look at the
+    active events of the current arena (self.arena_events) and keep the ones
+    that fall inside the vision window. An event that is extended across 
+    multiple tiles is only counted once, at the first tile where we would see
+    it when walking the window in the x-major order of get_nearby_tiles. 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+      att_bandwidth: The number of closest events to return. 
+    OUTPUT: 
+      a list of event quadruples ordered by their distance from the tile. 
+    EXAMPLE OUTPUT: 
+      [('Isabella Rodriguez', 'is', 'idle', 'idle'), 
+       ('the ville:hobbs cafe:cafe:cafe customer seating', None, None, None)]
+    """
+    left_end, right_end, top_end, bottom_end = self.get_vision_window(
+                                                             tile, vision_r)
+    curr_arena_id = self.arena_id_maze[tile[1]][tile[0]]
+
+    # <percept_events> maps each event to the (distance, x, y) of the tile 
+    # where we first see it. 
+    percept_events = dict()
+    for (x, y), event in self.arena_events.get(curr_arena_id, dict()): 
+      if left_end <= x < right_end and top_end <= y < bottom_end: 
+        if event in percept_events and percept_events[event][1:] < (x, y): 
+          continue
+        dist = math.hypot(x - tile[0], y - tile[1])
+        percept_events[event] = (dist, x, y)
+
+    closest = heapq.nsmallest(att_bandwidth, percept_events.items(), 
+                              key=itemgetter(1))
+    return [event for event, dist in closest]
+
+
+  def _index_event(self, curr_event, tile): 
+    """
+    Add a (tile, event) pair to the spatial event index. 
+    """
+    arena_id = self.arena_id_maze[tile[1]][tile[0]]
+    if arena_id not in self.arena_events: 
+      self.arena_events[arena_id] = dict()
+    self.arena_events[arena_id][(tile[0], tile[1]), curr_event] = None
+
+
+  def _unindex_event(self, curr_event, tile): 
+    """
+    Remove a (tile, event) pair from the spatial event index. 
+    """
+    arena_id = self.arena_id_maze[tile[1]][tile[0]]
+    self.arena_events[arena_id].pop(((tile[0], tile[1]), curr_event), None)
+
+
   def add_event_from_tile(self, curr_event, tile): 
     """
     Add an event triple to a tile.  
@@ -337,6 +449,7 @@ class Maze:
       None
     """
     self.tiles[tile[1]][tile[0]]["events"].add(curr_event)
+    self._index_event(curr_event, tile)
 
 
   def remove_event_from_tile(self, curr_event, tile):
@@ -351,19 +464,16 @@ class Maze:
     OUPUT: 
       None
     """
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
+    if curr_event in self.tiles[tile[1]][tile[0]]["events"]: 
+      self.tiles[tile[1]][tile[0]]["events"].remove(curr_event)
+      self._unindex_event(curr_event, tile)
 
 
   def turn_event_from_tile_idle(self, curr_event, tile):
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
-        new_event = (event[0], None, None, None)
-        self.tiles[tile[1]][tile[0]]["events"].add(new_event)
+    if curr_event in self.tiles[tile[1]][tile[0]]["events"]: 
+      self.remove_event_from_tile(curr_event, tile)
+      new_event = (curr_event[0], None, None, None)
+      self.add_event_from_tile(new_event, tile)
 
 
   def remove_subject_events_from_tile(self, subject, tile):
@@ -380,6 +490,7 @@ class Maze:
     for event in curr_tile_ev_cp: 
       if event[0] == subject:  
         self.tiles[tile[1]][tile[0]]["events"].remove(event)
+        self._unindex_event(event, tile)
 
 
 
@@ -7,7 +7,6 @@ Description: This defines the "Perceive" module for generative agents.
 import sys
 sys.path.append('../../')
 
-from operator import itemgetter
 from global_methods import *
 from persona.prompt_template.gpt_structure import *
 from persona.prompt_template.run_gpt_prompt import *
@@ -16,12 +15,46 @@ def generate_poig_score(persona, event_type, description):
   if "is idle" in description: 
     return 1
 
-  if event_type == "event": 
+  if event_type == "event" or event_type == "thought": 
     return run_gpt_prompt_event_poignancy(persona, description)[0]
   elif event_type == "chat": 
     return run_gpt_prompt_chat_poignancy(persona, 
                            persona.scratch.act_description)[0]
 
+def generate_poig_scores(persona, memories): 
+  """
+  Scores the poignancy of several memories with one batched prompt. The
+  memories whose score could not be read from the batched response are
+  scored one by one with generate_poig_score(). 
+
+  INPUT: 
+    persona: The Persona class instance 
+    memories: A list of (event type, description) pairs. 
+  OUTPUT: 
+    A list of the poignancy scores of the memories. 
+  """
+  if debug: print ("GNS FUNCTION: <generate_poig_scores>")
+
+  scores = [None] * len(memories)
+  pending = []
+  for count, (event_type, description) in enumerate(memories): 
+    if "is idle" in description: 
+      scores[count] = 1
+    else: 
+      pending += [count]
+
+  # A single memory is scored with its own prompt. 
+  if len(pending) > 1: 
+    batch_scores = run_gpt_prompt_poignancy_batch(
+                     persona, [memories[i] for i in pending])[0]
+    for count, score in zip(pending, batch_scores): 
+      scores[count] = score
+
+  for count, (event_type, description) in enumerate(memories): 
+    if scores[count] is None: 
+      scores[count] = generate_poig_score(persona, event_type, description)
+  return scores
+
 def perceive(persona, maze): 
   """
   Perceives events around the persona and saves it to the memory, both events 
@@ -41,71 +74,37 @@ def perceive(persona, maze):
     ret_events: a list of <ConceptNode> that are perceived and new. 
   """
   # PERCEIVE SPACE
-  # We get the nearby tiles given our current tile and the persona's vision
-  # radius. 
-  nearby_tiles = maze.get_nearby_tiles(persona.scratch.curr_tile, 
-                                       persona.scratch.vision_r)
-
-  # We then store the perceived space. Note that the s_mem of the persona is
-  # in the form of a tree constructed using dictionaries. 
-  for i in nearby_tiles: 
-    i = maze.access_tile(i)
-    if i["world"]: 
-      if (i["world"] not in persona.s_mem.tree): 
-        persona.s_mem.tree[i["world"]] = {}
-    if i["sector"]: 
-      if (i["sector"] not in persona.s_mem.tree[i["world"]]): 
-        persona.s_mem.tree[i["world"]][i["sector"]] = {}
-    if i["arena"]: 
-      if (i["arena"] not in persona.s_mem.tree[i["world"]]
-                                              [i["sector"]]): 
-        persona.s_mem.tree[i["world"]][i["sector"]][i["arena"]] = []
-    if i["game_object"]: 
-      if (i["game_object"] not in persona.s_mem.tree[i["world"]]
-                                                    [i["sector"]]
-                                                    [i["arena"]]): 
-        persona.s_mem.tree[i["world"]][i["sector"]][i["arena"]] += [
-                                                             i["game_object"]]
+  # We store the space within the persona's vision radius. Note that the 
+  # s_mem of the persona is in the form of a tree constructed using 
+  # dictionaries. The tree remembers which tiles it has already seen, so only
+  # the newly discovered tiles are added here. 
+  persona.s_mem.add_nearby_tiles(maze, 
+                                 persona.scratch.curr_tile, 
+                                 persona.scratch.vision_r)
 
   # PERCEIVE EVENTS. 
   # We will perceive events that take place in the same arena as the
-  # persona's current arena. 
-  curr_arena_path = maze.get_tile_path(persona.scratch.curr_tile, "arena")
-  # We do not perceive the same event twice (this can happen if an object is
-  # extended across multiple tiles).
-  percept_events_set = set()
-  # We will order our percept based on the distance, with the closest ones
-  # getting priorities. 
-  percept_events_list = []
-  # First, we put all events that are occuring in the nearby tiles into the
-  # percept_events_list
-  for tile in nearby_tiles: 
-    tile_details = maze.access_tile(tile)
-    if tile_details["events"]: 
-      if maze.get_tile_path(tile, "arena") == curr_arena_path:  
-        # This calculates the distance between the persona's current tile, 
-        # and the target tile.
-        dist = math.dist([tile[0], tile[1]], 
-                         [persona.scratch.curr_tile[0], 
-                          persona.scratch.curr_tile[1]])
-        # Add any relevant events to our temp set/list with the distant info. 
-        for event in tile_details["events"]: 
-          if event not in percept_events_set: 
-            percept_events_list += [[dist, event]]
-            percept_events_set.add(event)
-
-  # We sort, and perceive only persona.scratch.att_bandwidth of the closest
-  # events. If the bandwidth is larger, then it means the persona can perceive
-  # more elements within a small area. 
-  percept_events_list = sorted(percept_events_list, key=itemgetter(0))
-  perceived_events = []
-  for dist, event in percept_events_list[:persona.scratch.att_bandwidth]: 
-    perceived_events += [event]
-
-  # Storing events. 
-  # <ret_events> is a list of <ConceptNode> instances from the persona's 
-  # associative memory. 
-  ret_events = []
+  # persona's current arena. The maze masks our vision window by the current
+  # arena and orders the events there by their distance, with the closest 
+  # ones getting priorities. We perceive only persona.scratch.att_bandwidth of
+  # the closest events. If the bandwidth is larger, then it means the persona
+  # can perceive more elements within a small area. Note that we do not 
+  # perceive the same event twice (this can happen if an object is extended
+  # across multiple tiles).
+  perceived_events = maze.get_nearby_arena_events(persona.scratch.curr_tile, 
+                                                  persona.scratch.vision_r, 
+                                                  persona.scratch.att_bandwidth)
+
+  # Finding the new events. 
+  # We retrieve the latest persona.scratch.retention events. If there is  
+  # something new that is happening (that is, p_event not in latest_events),
+  # then we add that event to the a_mem and return it. The new events are
+  # added to the memory only after all of them are scored (see below), so we
+  # keep our own copy of the retention window and push each new event into
+  # it, as adding it to the memory would. 
+  latest_events = [i.spo_summary() for i in 
+                   persona.a_mem.seq_event[:persona.scratch.retention]]
+  new_events = []
   for p_event in perceived_events: 
     s, p, o, desc = p_event
     if not p: 
@@ -116,67 +115,82 @@ def perceive(persona, maze):
     desc = f"{s.split(':')[-1]} is {desc}"
     p_event = (s, p, o)
 
-    # We retrieve the latest persona.scratch.retention events. If there is  
-    # something new that is happening (that is, p_event not in latest_events),
-    # then we add that event to the a_mem and return it. 
-    latest_events = persona.a_mem.get_summarized_latest_events(
-                                    persona.scratch.retention)
     if p_event not in latest_events:
-      # We start by managing keywords. 
-      keywords = set()
-      sub = p_event[0]
-      obj = p_event[2]
-      if ":" in p_event[0]: 
-        sub = p_event[0].split(":")[-1]
-      if ":" in p_event[2]: 
-        obj = p_event[2].split(":")[-1]
-      keywords.update([sub, obj])
-
-      # Get event embedding
+      # The embedding and the poignancy are of the part of the description
+      # in parentheses, if there is one. 
       desc_embedding_in = desc
       if "(" in desc: 
         desc_embedding_in = (desc_embedding_in.split("(")[1]
                                               .split(")")[0]
                                               .strip())
-      if desc_embedding_in in persona.a_mem.embeddings: 
-        event_embedding = persona.a_mem.embeddings[desc_embedding_in]
+      new_events += [(p_event, desc, desc_embedding_in)]
+      latest_events[0:0] = [p_event]
+      latest_events = latest_events[:persona.scratch.retention]
+
+  # Scoring the new events. 
+  # The poignancy of all new events (and of the persona's own chat, if it is
+  # one of them) is rated with one batched prompt. 
+  pending_memories = []
+  for p_event, desc, desc_embedding_in in new_events: 
+    pending_memories += [("event", desc_embedding_in)]
+    if p_event[0] == f"{persona.name}" and p_event[1] == "chat with": 
+      pending_memories += [("chat", persona.scratch.act_description)]
+  poignancy_scores = generate_poig_scores(persona, pending_memories)
+
+  # Storing events. 
+  # <ret_events> is a list of <ConceptNode> instances from the persona's 
+  # associative memory. 
+  ret_events = []
+  for p_event, desc, desc_embedding_in in new_events: 
+    s, p, o = p_event
+
+    # We start by managing keywords. 
+    keywords = set()
+    sub = p_event[0]
+    obj = p_event[2]
+    if ":" in p_event[0]: 
+      sub = p_event[0].split(":")[-1]
+    if ":" in p_event[2]: 
+      obj = p_event[2].split(":")[-1]
+    keywords.update([sub, obj])
+
+    # Get event embedding
+    if desc_embedding_in in persona.a_mem.embeddings: 
+      event_embedding = persona.a_mem.embeddings[desc_embedding_in]
+    else: 
+      event_embedding = get_embedding(desc_embedding_in)
+    event_embedding_pair = (desc_embedding_in, event_embedding)
+    
+    # Get event poignancy. 
+    event_poignancy = poignancy_scores.pop(0)
+
+    # If we observe the persona's self chat, we include that in the memory
+    # of the persona here. 
+    chat_node_ids = []
+    if p_event[0] == f"{persona.name}" and p_event[1] == "chat with": 
+      curr_event = persona.scratch.act_event
+      if persona.scratch.act_description in persona.a_mem.embeddings: 
+        chat_embedding = persona.a_mem.embeddings[
+                           persona.scratch.act_description]
       else: 
-        event_embedding = get_embedding(desc_embedding_in)
-      event_embedding_pair = (desc_embedding_in, event_embedding)
-      
-      # Get event poignancy. 
-      event_poignancy = generate_poig_score(persona, 
-                                            "event", 
-                                            desc_embedding_in)
-
-      # If we observe the persona's self chat, we include that in the memory
-      # of the persona here. 
-      chat_node_ids = []
-      if p_event[0] == f"{persona.name}" and p_event[1] == "chat with": 
-        curr_event = persona.scratch.act_event
-        if persona.scratch.act_description in persona.a_mem.embeddings: 
-          chat_embedding = persona.a_mem.embeddings[
-                             persona.scratch.act_description]
-        else: 
-          chat_embedding = get_embedding(persona.scratch
-                                                .act_description)
-        chat_embedding_pair = (persona.scratch.act_description, 
-                               chat_embedding)
-        chat_poignancy = generate_poig_score(persona, "chat", 
-                                             persona.scratch.act_description)
-        chat_node = persona.a_mem.add_chat(persona.scratch.curr_time, None,
-                      curr_event[0], curr_event[1], curr_event[2], 
-                      persona.scratch.act_description, keywords, 
-                      chat_poignancy, chat_embedding_pair, 
-                      persona.scratch.chat)
-        chat_node_ids = [chat_node.node_id]
-
-      # Finally, we add the current event to the agent's memory. 
-      ret_events += [persona.a_mem.add_event(persona.scratch.curr_time, None,
-                           s, p, o, desc, keywords, event_poignancy, 
-                           event_embedding_pair, chat_node_ids)]
-      persona.scratch.importance_trigger_curr -= event_poignancy
-      persona.scratch.importance_ele_n += 1
+        chat_embedding = get_embedding(persona.scratch
+                                              .act_description)
+      chat_embedding_pair = (persona.scratch.act_description, 
+                             chat_embedding)
+      chat_poignancy = poignancy_scores.pop(0)
+      chat_node = persona.a_mem.add_chat(persona.scratch.curr_time, None,
+                    curr_event[0], curr_event[1], curr_event[2], 
+                    persona.scratch.act_description, keywords, 
+                    chat_poignancy, chat_embedding_pair, 
+                    persona.scratch.chat)
+      chat_node_ids = [chat_node.node_id]
+
+    # Finally, we add the current event to the agent's memory. 
+    ret_events += [persona.a_mem.add_event(persona.scratch.curr_time, None,
+                         s, p, o, desc, keywords, event_poignancy, 
+                         event_embedding_pair, chat_node_ids)]
+    persona.scratch.importance_trigger_curr -= event_poignancy
+    persona.scratch.importance_ele_n += 1
 
   return ret_events
 
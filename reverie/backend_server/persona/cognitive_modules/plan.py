@@ -4,14 +4,18 @@ Author: Joon Sung Park (joonspk@stanford.edu)
 File: plan.py
 Description: This defines the "Plan" module for generative agents. 
 """
+import copy
 import datetime
 import math
 import random 
 import sys
+import threading
 import time
+import traceback
 sys.path.append('../../')
 
 from global_methods import *
+from annotation_cache import *
 from persona.prompt_template.run_gpt_prompt import *
 from persona.cognitive_modules.retrieve import *
 from persona.cognitive_modules.converse import *
@@ -223,6 +227,93 @@ def generate_action_game_object(act_desp, act_address, persona, maze):
   return run_gpt_prompt_action_game_object(act_desp, persona, maze, act_address)[0]
 
 
+def generate_action_annotation(act_desp, persona, maze): 
+  """
+  Given the action description, annotates the new action in one prompt: its
+  sector, arena, and game object, its pronunciatio and event triple, and the
+  game object's description, pronunciatio, and event triple. 
+
+  INPUT: 
+    act_desp: description of the new action (e.g., "sleeping")
+    persona: The Persona class instance 
+    maze: The Maze class instance
+  OUTPUT: 
+    a dictionary of the annotations; the ones that could not be generated 
+    are None. 
+  EXAMPLE OUTPUT: 
+    {"sector": "Isabella Rodriguez's apartment", "arena": "main room", 
+     "game_object": "bed", "pronunciatio": "😴", "predicate": "is", 
+     "object": "sleep", "object_description": "being slept in", 
+     "object_pronunciatio": "🛌", "object_predicate": "is", 
+     "object_object": "occupied"}
+  """
+  if debug: print ("GNS FUNCTION: <generate_action_annotation>")
+  annotation = run_gpt_prompt_action_annotation(act_desp, persona, maze)[0]
+  if not use_annotation_cache: 
+    return annotation
+
+  # The annotations that only depend on the descriptions are shared with 
+  # the one-by-one prompts through the annotation cache, under the same 
+  # keys (see generate_action_pronunciatio() and the functions after it). 
+  # A cached annotation wins over the fused prompt's, and the fused prompt's
+  # validated ones are cached. Where the persona goes depends on where it is
+  # and what it knows, so the sector, arena, and game object are not cached.
+  annotation = dict(annotation)
+  validated = not last_response_was_fail_safe()
+  share_annotation(annotation, "pronunciatio", [act_desp], 
+                   ["pronunciatio"], persona, validated)
+  share_annotation(annotation, "event_triple", [act_desp], 
+                   ["predicate", "object"], persona, validated)
+  act_game_object = annotation["game_object"]
+  if act_game_object: 
+    act_obj_desp = annotation["object_description"]
+    share_annotation(annotation, "act_obj_desc", [act_game_object, act_desp],
+                     ["object_description"], persona, validated)
+    if annotation["object_description"] != act_obj_desp: 
+      # The fused prompt described the object's state differently, so its
+      # pronunciatio and triple do not go with the cached description. 
+      for field in ["object_pronunciatio", "object_predicate", 
+                    "object_object"]: 
+        annotation[field] = None
+    act_obj_desp = annotation["object_description"]
+    if act_obj_desp: 
+      share_annotation(annotation, "pronunciatio", [act_obj_desp], 
+                       ["object_pronunciatio"], persona, validated)
+      share_annotation(annotation, "act_obj_event_triple", 
+                       [act_game_object, act_obj_desp], 
+                       ["object_predicate", "object_object"], persona, 
+                       validated)
+  return annotation
+
+
+def share_annotation(annotation, kind, descriptions, fields, persona, 
+                     validated): 
+  """
+  Fills in the fields of a fused annotation from the annotation cache, or 
+  caches them if the cache does not have them yet. 
+
+  INPUT: 
+    annotation: The dictionary of generate_action_annotation(). 
+    kind, descriptions: The key of the annotation in the cache. 
+    fields: The fields of <annotation> that the cached annotation holds: one
+            field for a string, or the predicate and object of a triple. 
+    persona: The Persona class instance
+    validated: Whether the fused prompt did not end with its fail safe. 
+  OUTPUT: 
+    None
+  """
+  x = annotation_cache.get(kind, descriptions, persona.name)
+  if x: 
+    if len(fields) == 1: 
+      x = [x]
+    annotation.update(zip(fields, x))
+  elif validated and all(annotation[field] for field in fields): 
+    x = [annotation[field] for field in fields]
+    if len(fields) == 1: 
+      x = x[0]
+    annotation_cache.set(kind, descriptions, persona.name, x)
+
+
 def generate_action_pronunciatio(act_desp, persona): 
   """TODO 
   Given an action description, creates an emoji string description via a few
@@ -239,13 +330,20 @@ def generate_action_pronunciatio(act_desp, persona):
     "🧈🍞"
   """
   if debug: print ("GNS FUNCTION: <generate_action_pronunciatio>")
+  if use_annotation_cache: 
+    x = annotation_cache.get("pronunciatio", [act_desp], persona.name)
+    if x: 
+      return x
+
   try: 
     x = run_gpt_prompt_pronunciatio(act_desp, persona)[0]
   except: 
-    x = "🙂"
+    return "🙂"
 
   if not x: 
     return "🙂"
+  if use_annotation_cache and not last_response_was_fail_safe(): 
+    annotation_cache.set("pronunciatio", [act_desp], persona.name, x)
   return x
 
 
@@ -261,17 +359,48 @@ def generate_action_event_triple(act_desp, persona):
     "🧈🍞"
   """
   if debug: print ("GNS FUNCTION: <generate_action_event_triple>")
-  return run_gpt_prompt_event_triple(act_desp, persona)[0]
+  # The subject is always the persona, so we cache the predicate and the 
+  # object. 
+  if use_annotation_cache: 
+    x = annotation_cache.get("event_triple", [act_desp], persona.name)
+    if x: 
+      return (persona.name, x[0], x[1])
+
+  x = run_gpt_prompt_event_triple(act_desp, persona)[0]
+  if use_annotation_cache and not last_response_was_fail_safe(): 
+    annotation_cache.set("event_triple", [act_desp], persona.name, x[1:])
+  return x
 
 
 def generate_act_obj_desc(act_game_object, act_desp, persona): 
   if debug: print ("GNS FUNCTION: <generate_act_obj_desc>")
-  return run_gpt_prompt_act_obj_desc(act_game_object, act_desp, persona)[0]
+  if use_annotation_cache: 
+    x = annotation_cache.get("act_obj_desc", [act_game_object, act_desp], 
+                             persona.name)
+    if x: 
+      return x
+
+  x = run_gpt_prompt_act_obj_desc(act_game_object, act_desp, persona)[0]
+  if use_annotation_cache and not last_response_was_fail_safe(): 
+    annotation_cache.set("act_obj_desc", [act_game_object, act_desp], 
+                         persona.name, x)
+  return x
 
 
 def generate_act_obj_event_triple(act_game_object, act_obj_desc, persona): 
   if debug: print ("GNS FUNCTION: <generate_act_obj_event_triple>")
-  return run_gpt_prompt_act_obj_event_triple(act_game_object, act_obj_desc, persona)[0]
+  if use_annotation_cache: 
+    x = annotation_cache.get("act_obj_event_triple", 
+                             [act_game_object, act_obj_desc], persona.name)
+    if x: 
+      return (act_game_object, x[0], x[1])
+
+  x = run_gpt_prompt_act_obj_event_triple(act_game_object, act_obj_desc, 
+                                          persona)[0]
+  if use_annotation_cache and not last_response_was_fail_safe(): 
+    annotation_cache.set("act_obj_event_triple", 
+                         [act_game_object, act_obj_desc], persona.name, x[1:])
+  return x
 
 
 def generate_convo(maze, init_persona, target_persona): 
@@ -468,6 +597,16 @@ def _long_term_planning(persona, new_day):
              "New day", or False (for neither). This is important because we
              create the personas' long term planning on the new day. 
   """
+  _generate_day_plan(persona, new_day)
+  _add_day_plan_thought(persona)
+
+
+def _generate_day_plan(persona, new_day): 
+  """
+  Creates the wake-up hour, the daily requirements (on a new day, by 
+  revising the persona's identity) and the hourly schedule of the day of 
+  persona.scratch.curr_time. See _long_term_planning. 
+  """
   # We start by creating the wake up hour for the persona. 
   wake_up_hour = generate_wake_up_hour(persona)
 
@@ -497,6 +636,11 @@ def _long_term_planning(persona, new_day):
                                                    .f_daily_schedule[:])
 
 
+def _add_day_plan_thought(persona): 
+  """
+  Adds the persona's plan for the day (its daily_req) to its memory as a 
+  thought. 
+  """
   # Added March 4 -- adding plan to the memory.
   thought = f"This is {persona.scratch.name}'s plan for {persona.scratch.curr_time.strftime('%A %B %d')}:"
   for i in persona.scratch.daily_req: 
@@ -517,6 +661,126 @@ def _long_term_planning(persona, new_day):
   # print("Done sleeping!")
 
 
+# <fused_action_annotation> decides whether a new action is annotated with 
+# one prompt (see generate_action_annotation()) instead of one prompt per
+# annotation. The annotations that the fused prompt gets wrong are still 
+# generated one by one. 
+fused_action_annotation = False
+
+# <next_day_plan_hour> is the hour of the evening from which we plan the 
+# persona's next day in the background (see NextDayPlan), so that the 
+# personas do not all make their plans, one LLM call after another, in the
+# step where the day turns over. A plan is only committed if the persona's 
+# memory has not changed since we started it, so this pays off for personas
+# that are asleep (and alone) by then. It is None, i.e., we always plan at 
+# midnight, unless it is set. 
+next_day_plan_hour = None
+
+
+class NextDayPlan: 
+  """
+  The persona's plan for the next day, made in a background thread during 
+  the evening. 
+
+  The plan is made on a proxy of the persona: a copy whose scratch is moved
+  to the start of the next day and whose associative memory is a snapshot, 
+  so the persona itself keeps going as usual. At midnight, the plan is 
+  committed (see _commit_next_day_plan()) if what it was made from has not 
+  changed in the meantime, and discarded otherwise. 
+  """
+  def __init__(self, persona): 
+    # <date> is the day that we plan. 
+    self.date = persona.scratch.curr_time.date() + datetime.timedelta(days=1)
+    # <key> is what the plan was made from (see get_next_day_plan_key()). 
+    self.key = get_next_day_plan_key(persona)
+
+    self.proxy = copy.copy(persona)
+    self.proxy.scratch = copy.deepcopy(persona.scratch)
+    self.proxy.scratch.curr_time = datetime.datetime.combine(self.date, 
+                                                             datetime.time())
+    self.proxy.a_mem = persona.a_mem.snapshot()
+
+    # <done> is set once the plan has been made without an error. 
+    self.done = False
+    self.thread = threading.Thread(target=self._run, daemon=True)
+    self.thread.start()
+
+
+  def _run(self): 
+    try: 
+      _generate_day_plan(self.proxy, "New day")
+      self.done = True
+    except Exception: 
+      traceback.print_exc()
+      print (f"Planning {self.proxy.scratch.name}'s next day failed; "
+             "we will plan it at midnight.")
+
+
+def get_next_day_plan_key(persona): 
+  """
+  Returns what the persona's plan for the next day is made from: its 
+  identity, its current plan, and its memory. revise_identity() retrieves 
+  from all of the memory's nodes, ranked in part by when they were last 
+  accessed, so the key has the number of nodes and the latest access; a new
+  event, thought or chat, or a retrieval, changes the key. 
+  """
+  scratch = persona.scratch
+  last_accessed = max((node.last_accessed 
+                       for node in persona.a_mem.id_to_node.values()), 
+                      default=None)
+  return (scratch.name, scratch.age, scratch.innate, scratch.learned, 
+          scratch.currently, scratch.lifestyle, scratch.daily_plan_req, 
+          list(scratch.daily_req), 
+          len(persona.a_mem.id_to_node), last_accessed)
+
+
+def _start_next_day_plan(persona): 
+  """
+  Starts planning the persona's next day in the background if it is late 
+  enough in the evening and we have not started yet. 
+  """
+  curr_time = persona.scratch.curr_time
+  if next_day_plan_hour is None or curr_time.hour < next_day_plan_hour: 
+    return
+  next_date = curr_time.date() + datetime.timedelta(days=1)
+  if persona.next_day_plan and persona.next_day_plan.date == next_date: 
+    return
+  persona.next_day_plan = NextDayPlan(persona)
+
+
+def _commit_next_day_plan(persona): 
+  """
+  Commits the persona's plan for today that was made last evening, waiting
+  for it if it is still being made. 
+
+  INPUT
+    persona: The Persona class instance 
+  OUTPUT 
+    True if the plan was committed; False if there was none, or if it was 
+    discarded because the persona changed after we started it. 
+  """
+  next_day_plan = persona.next_day_plan
+  persona.next_day_plan = None
+  if (not next_day_plan 
+      or next_day_plan.date != persona.scratch.curr_time.date()): 
+    return False
+
+  next_day_plan.thread.join()
+  if (not next_day_plan.done 
+      or next_day_plan.key != get_next_day_plan_key(persona)): 
+    return False
+
+  proxy = next_day_plan.proxy
+  persona.scratch.currently = proxy.scratch.currently
+  persona.scratch.daily_plan_req = proxy.scratch.daily_plan_req
+  persona.scratch.daily_req = proxy.scratch.daily_req
+  persona.scratch.f_daily_schedule = proxy.scratch.f_daily_schedule
+  persona.scratch.f_daily_schedule_hourly_org = (proxy.scratch
+                                                 .f_daily_schedule_hourly_org)
+  persona.a_mem.sync_last_accessed(proxy.a_mem)
+  return True
+
+
 
 def _determine_action(persona, maze): 
   """
@@ -569,13 +833,14 @@ def _determine_action(persona, maze):
       # We decompose if the next action is longer than an hour, and fits the
       # criteria described in determine_decomp.
       if determine_decomp(act_desp, act_dura): 
-        persona.scratch.f_daily_schedule[curr_index:curr_index+1] = (
+        persona.scratch.splice_f_daily_schedule(curr_index, curr_index+1, 
                             generate_task_decomp(persona, act_desp, act_dura))
     if curr_index_60 + 1 < len(persona.scratch.f_daily_schedule):
       act_desp, act_dura = persona.scratch.f_daily_schedule[curr_index_60+1]
       if act_dura >= 60: 
         if determine_decomp(act_desp, act_dura): 
-          persona.scratch.f_daily_schedule[curr_index_60+1:curr_index_60+2] = (
+          persona.scratch.splice_f_daily_schedule(curr_index_60+1, 
+                            curr_index_60+2, 
                             generate_task_decomp(persona, act_desp, act_dura))
 
   if curr_index_60 < len(persona.scratch.f_daily_schedule):
@@ -588,7 +853,8 @@ def _determine_action(persona, maze):
       act_desp, act_dura = persona.scratch.f_daily_schedule[curr_index_60]
       if act_dura >= 60: 
         if determine_decomp(act_desp, act_dura): 
-          persona.scratch.f_daily_schedule[curr_index_60:curr_index_60+1] = (
+          persona.scratch.splice_f_daily_schedule(curr_index_60, 
+                              curr_index_60+1, 
                               generate_task_decomp(persona, act_desp, act_dura))
   # * End of Decompose * 
 
@@ -622,20 +888,45 @@ def _determine_action(persona, maze):
   # Finding the target location of the action and creating action-related
   # variables.
   act_world = maze.access_tile(persona.scratch.curr_tile)["world"]
+  # With <fused_action_annotation>, we first get all the annotations from one
+  # prompt. Each annotation that it does not give us is generated on its own.
+  annotation = dict()
+  if fused_action_annotation: 
+    annotation = generate_action_annotation(act_desp, persona, maze)
+
   # act_sector = maze.access_tile(persona.scratch.curr_tile)["sector"]
-  act_sector = generate_action_sector(act_desp, persona, maze)
-  act_arena = generate_action_arena(act_desp, persona, maze, act_world, act_sector)
+  act_sector = annotation.get("sector")
+  if not act_sector: 
+    act_sector = generate_action_sector(act_desp, persona, maze)
+  act_arena = annotation.get("arena")
+  if not act_arena: 
+    act_arena = generate_action_arena(act_desp, persona, maze, act_world, act_sector)
   act_address = f"{act_world}:{act_sector}:{act_arena}"
-  act_game_object = generate_action_game_object(act_desp, act_address,
-                                                persona, maze)
+  act_game_object = annotation.get("game_object")
+  if not act_game_object: 
+    act_game_object = generate_action_game_object(act_desp, act_address,
+                                                  persona, maze)
   new_address = f"{act_world}:{act_sector}:{act_arena}:{act_game_object}"
-  act_pron = generate_action_pronunciatio(act_desp, persona)
-  act_event = generate_action_event_triple(act_desp, persona)
+  act_pron = annotation.get("pronunciatio")
+  if not act_pron: 
+    act_pron = generate_action_pronunciatio(act_desp, persona)
+  if annotation.get("predicate"): 
+    act_event = (persona.name, annotation["predicate"], annotation["object"])
+  else: 
+    act_event = generate_action_event_triple(act_desp, persona)
   # Persona's actions also influence the object states. We set those up here. 
-  act_obj_desp = generate_act_obj_desc(act_game_object, act_desp, persona)
-  act_obj_pron = generate_action_pronunciatio(act_obj_desp, persona)
-  act_obj_event = generate_act_obj_event_triple(act_game_object, 
-                                                act_obj_desp, persona)
+  act_obj_desp = annotation.get("object_description")
+  if not act_obj_desp: 
+    act_obj_desp = generate_act_obj_desc(act_game_object, act_desp, persona)
+  act_obj_pron = annotation.get("object_pronunciatio")
+  if not act_obj_pron: 
+    act_obj_pron = generate_action_pronunciatio(act_obj_desp, persona)
+  if annotation.get("object_predicate"): 
+    act_obj_event = (act_game_object, annotation["object_predicate"], 
+                     annotation["object_object"])
+  else: 
+    act_obj_event = generate_act_obj_event_triple(act_game_object, 
+                                                  act_obj_desp, persona)
 
   # Adding the action to persona's queue. 
   persona.scratch.add_new_action(new_address, 
@@ -810,18 +1101,19 @@ def _create_react(persona, inserted_act, inserted_act_dur,
                   act_obj_event, act_start_time=None): 
   p = persona 
 
+  org_index = p.scratch.get_f_daily_schedule_hourly_org_index()
   min_sum = 0
-  for i in range (p.scratch.get_f_daily_schedule_hourly_org_index()): 
+  for i in range (org_index): 
     min_sum += p.scratch.f_daily_schedule_hourly_org[i][1]
   start_hour = int (min_sum/60)
 
-  if (p.scratch.f_daily_schedule_hourly_org[p.scratch.get_f_daily_schedule_hourly_org_index()][1] >= 120):
-    end_hour = start_hour + p.scratch.f_daily_schedule_hourly_org[p.scratch.get_f_daily_schedule_hourly_org_index()][1]/60
+  if (p.scratch.f_daily_schedule_hourly_org[org_index][1] >= 120):
+    end_hour = start_hour + p.scratch.f_daily_schedule_hourly_org[org_index][1]/60
 
-  elif (p.scratch.f_daily_schedule_hourly_org[p.scratch.get_f_daily_schedule_hourly_org_index()][1] + 
-      p.scratch.f_daily_schedule_hourly_org[p.scratch.get_f_daily_schedule_hourly_org_index()+1][1]): 
-    end_hour = start_hour + ((p.scratch.f_daily_schedule_hourly_org[p.scratch.get_f_daily_schedule_hourly_org_index()][1] + 
-              p.scratch.f_daily_schedule_hourly_org[p.scratch.get_f_daily_schedule_hourly_org_index()+1][1])/60)
+  elif (p.scratch.f_daily_schedule_hourly_org[org_index][1] + 
+      p.scratch.f_daily_schedule_hourly_org[org_index+1][1]): 
+    end_hour = start_hour + ((p.scratch.f_daily_schedule_hourly_org[org_index][1] + 
+              p.scratch.f_daily_schedule_hourly_org[org_index+1][1])/60)
 
   else: 
     end_hour = start_hour + 2
@@ -841,7 +1133,7 @@ def _create_react(persona, inserted_act, inserted_act_dur,
 
   ret = generate_new_decomp_schedule(p, inserted_act, inserted_act_dur, 
                                        start_hour, end_hour)
-  p.scratch.f_daily_schedule[start_index:end_index] = ret
+  p.scratch.splice_f_daily_schedule(start_index, end_index, ret)
   p.scratch.add_new_action(act_address,
                            inserted_act_dur,
                            inserted_act,
@@ -951,8 +1243,13 @@ def plan(persona, maze, personas, new_day, retrieved):
     The target action address of the persona (persona.scratch.act_address).
   """ 
   # PART 1: Generate the hourly schedule. 
-  if new_day: 
+  if new_day == "New day" and _commit_next_day_plan(persona): 
+    # Today's plan was made in the background last evening. 
+    _add_day_plan_thought(persona)
+  elif new_day: 
     _long_term_planning(persona, new_day)
+  else: 
+    _start_next_day_plan(persona)
 
   # PART 2: If the current action has expired, we want to create a new plan.
   if persona.scratch.act_check_finished(): 
@@ -17,6 +17,7 @@ from global_methods import *
 from persona.prompt_template.run_gpt_prompt import *
 from persona.prompt_template.gpt_structure import *
 from persona.cognitive_modules.retrieve import *
+from persona.cognitive_modules.perceive import generate_poig_scores
 
 def generate_focal_points(persona, n=3): 
   if debug: print ("GNS FUNCTION: <generate_focal_points>")
@@ -83,7 +84,6 @@ def generate_poig_score(persona, event_type, description):
                            persona.scratch.act_description)[0]
 
 
-
 def generate_planning_thought_on_convo(persona, all_utt):
   if debug: print ("GNS FUNCTION: <generate_planning_thought_on_convo>")
   return run_gpt_prompt_planning_thought_on_convo(persona, all_utt)[0]
@@ -112,24 +112,30 @@ def run_reflect(persona):
   # <retrieved> has keys of focal points, and values of the associated Nodes. 
   retrieved = new_retrieve(persona, focal_points)
 
-  # For each of the focal points, generate thoughts and save it in the 
-  # agent's memory. 
+  # For each of the focal points, generate thoughts. 
+  all_thoughts = []
   for focal_pt, nodes in retrieved.items(): 
     xx = [i.embedding_key for i in nodes]
     for xxx in xx: print (xxx)
 
     thoughts = generate_insights_and_evidence(persona, nodes, 5)
-    for thought, evidence in thoughts.items(): 
-      created = persona.scratch.curr_time
-      expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
-      s, p, o = generate_action_event_triple(thought, persona)
-      keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", thought)
-      thought_embedding_pair = (thought, get_embedding(thought))
+    all_thoughts += list(thoughts.items())
 
-      persona.a_mem.add_thought(created, expiration, s, p, o, 
-                                thought, keywords, thought_poignancy, 
-                                thought_embedding_pair, evidence)
+  # The poignancy of all the new thoughts is rated with one batched prompt,
+  # and then the thoughts are saved in the agent's memory. 
+  thought_poignancies = generate_poig_scores(
+                          persona, [("thought", i) for i, _ in all_thoughts])
+  for (thought, evidence), thought_poignancy in zip(all_thoughts, 
+                                                    thought_poignancies): 
+    created = persona.scratch.curr_time
+    expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
+    s, p, o = generate_action_event_triple(thought, persona)
+    keywords = set([s, p, o])
+    thought_embedding_pair = (thought, get_embedding(thought))
+
+    persona.a_mem.add_thought(created, expiration, s, p, o, 
+                              thought, keywords, thought_poignancy, 
+                              thought_embedding_pair, evidence)
 
 
 def reflection_trigger(persona): 
@@ -216,11 +222,18 @@ def reflect(persona):
       planning_thought = generate_planning_thought_on_convo(persona, all_utt)
       planning_thought = f"For {persona.scratch.name}'s planning: {planning_thought}"
 
+      memo_thought = generate_memo_on_convo(persona, all_utt)
+      memo_thought = f"{persona.scratch.name} {memo_thought}"
+
+      # Both thoughts are rated with one batched prompt. 
+      planning_poignancy, memo_poignancy = generate_poig_scores(
+        persona, [("thought", planning_thought), ("thought", memo_thought)])
+
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(planning_thought, persona)
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", planning_thought)
+      thought_poignancy = planning_poignancy
       thought_embedding_pair = (planning_thought, get_embedding(planning_thought))
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
@@ -229,14 +242,11 @@ def reflect(persona):
 
 
 
-      memo_thought = generate_memo_on_convo(persona, all_utt)
-      memo_thought = f"{persona.scratch.name} {memo_thought}"
-
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(memo_thought, persona)
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", memo_thought)
+      thought_poignancy = memo_poignancy
       thought_embedding_pair = (memo_thought, get_embedding(memo_thought))
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
@@ -10,6 +10,7 @@ agents paper.
 import sys
 sys.path.append('../../')
 
+import copy
 import json
 import datetime
 
@@ -302,6 +303,52 @@ class AssociativeMemory:
     return ret_str
 
 
+  def snapshot(self): 
+    """
+    Returns a copy of the memory that can be read (and retrieved from, which
+    updates the nodes' last_accessed) in another thread while this memory 
+    keeps changing. The nodes and the indexes over them are copied, but the
+    nodes' contents and the embedding vectors are shared, as they are not 
+    changed after a node is added. 
+
+    INPUT
+      None
+    OUTPUT 
+      An AssociativeMemory instance. 
+    """
+    a_mem = copy.copy(self)
+    a_mem.id_to_node = {node_id: copy.copy(node) 
+                        for node_id, node in self.id_to_node.items()}
+    a_mem.seq_event = [a_mem.id_to_node[i.node_id] for i in self.seq_event]
+    a_mem.seq_thought = [a_mem.id_to_node[i.node_id] 
+                         for i in self.seq_thought]
+    a_mem.seq_chat = [a_mem.id_to_node[i.node_id] for i in self.seq_chat]
+    for kw_to_node in ["kw_to_event", "kw_to_thought", "kw_to_chat"]: 
+      setattr(a_mem, kw_to_node, 
+              {kw: [a_mem.id_to_node[i.node_id] for i in nodes] 
+               for kw, nodes in getattr(self, kw_to_node).items()})
+    a_mem.kw_strength_event = dict(self.kw_strength_event)
+    a_mem.kw_strength_thought = dict(self.kw_strength_thought)
+    a_mem.embeddings = dict(self.embeddings)
+    return a_mem
+
+
+  def sync_last_accessed(self, a_mem_snapshot): 
+    """
+    Brings the last_accessed of our nodes up to the ones of a snapshot (see 
+    snapshot()), for the nodes that were accessed in the snapshot. 
+
+    INPUT
+      a_mem_snapshot: An AssociativeMemory returned by snapshot(). 
+    OUTPUT 
+      None
+    """
+    for node_id, node in a_mem_snapshot.id_to_node.items(): 
+      if (node_id in self.id_to_node 
+          and node.last_accessed > self.id_to_node[node_id].last_accessed): 
+        self.id_to_node[node_id].last_accessed = node.last_accessed
+
+
   def retrieve_relevant_thoughts(self, s_content, p_content, o_content): 
     contents = [s_content, p_content, o_content]
 
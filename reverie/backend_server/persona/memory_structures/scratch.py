@@ -4,7 +4,9 @@ Author: Joon Sung Park (joonspk@stanford.edu)
 File: scratch.py
 Description: Defines the short-term memory module for generative agents.
 """
+import bisect
 import datetime
+import itertools
 import json
 import sys
 sys.path.append('../../')
@@ -310,6 +312,71 @@ class Scratch:
       json.dump(scratch, outfile, indent=2) 
 
 
+  # <f_daily_schedule> and <f_daily_schedule_hourly_org> are properties so 
+  # that we can keep the elapsed minutes at the end of each of their actions
+  # (see get_schedule_elapsed()). Assigning a new schedule or splicing it 
+  # with splice_f_daily_schedule() drops those, and they are computed again
+  # the next time we look up an index. 
+  @property
+  def f_daily_schedule(self): 
+    return self._f_daily_schedule
+
+
+  @f_daily_schedule.setter
+  def f_daily_schedule(self, f_daily_schedule): 
+    self._f_daily_schedule = f_daily_schedule
+    self._f_daily_schedule_elapsed = None
+
+
+  @property
+  def f_daily_schedule_hourly_org(self): 
+    return self._f_daily_schedule_hourly_org
+
+
+  @f_daily_schedule_hourly_org.setter
+  def f_daily_schedule_hourly_org(self, f_daily_schedule_hourly_org): 
+    self._f_daily_schedule_hourly_org = f_daily_schedule_hourly_org
+    self._f_daily_schedule_hourly_org_elapsed = None
+
+
+  def splice_f_daily_schedule(self, start_index, end_index, new_schedule): 
+    """
+    Replaces the actions of self.f_daily_schedule[start_index:end_index] 
+    with <new_schedule>. Use this instead of assigning to a slice of the 
+    schedule, so that the elapsed minutes are brought up to date. 
+
+    INPUT
+      start_index, end_index: The slice of f_daily_schedule to replace. 
+      new_schedule: A list of [task, duration] that replaces the slice. 
+    OUTPUT 
+      None
+    """
+    self._f_daily_schedule[start_index:end_index] = new_schedule
+    self._f_daily_schedule_elapsed = None
+
+
+  def get_schedule_elapsed(self, schedule, elapsed): 
+    """
+    Returns the elapsed minutes of the day at the end of each action in the 
+    schedule, given the ones we computed before (or None). Note that the 
+    schedule can have a negative duration (e.g., the "sleeping" that fills 
+    up an over-full day), so we keep the running maximum; the first action 
+    whose end is past a given minute is then found by a binary search. 
+
+    INPUT
+      schedule: f_daily_schedule or f_daily_schedule_hourly_org. 
+      elapsed: The elapsed minutes we kept for the schedule, or None. 
+    OUTPUT 
+      A non-decreasing list of the same length as the schedule. 
+    """
+    if elapsed is None or len(elapsed) != len(schedule): 
+      elapsed = list(itertools.accumulate(
+                  itertools.accumulate(duration for task, duration 
+                                       in schedule), 
+                  max))
+    return elapsed
+
+
   def get_f_daily_schedule_index(self, advance=0):
     """
     We get the current index of self.f_daily_schedule. 
@@ -317,9 +384,10 @@ class Scratch:
     Recall that self.f_daily_schedule stores the decomposed action sequences 
     up until now, and the hourly sequences of the future action for the rest
     of today. Given that self.f_daily_schedule is a list of list where the 
-    inner list is composed of [task, duration], we continue to add up the 
-    duration until we reach "if elapsed > today_min_elapsed" condition. The
-    index where we stop is the index we will return. 
+    inner list is composed of [task, duration], the current index is the 
+    first action whose end (the sum of the durations up to and including 
+    it) is past the minutes elapsed today. We keep those sums, so this is a 
+    binary search. 
 
     INPUT
       advance: Integer value of the number minutes we want to look into the 
@@ -333,23 +401,11 @@ class Scratch:
     today_min_elapsed += self.curr_time.minute
     today_min_elapsed += advance
 
-    x = 0
-    for task, duration in self.f_daily_schedule: 
-      x += duration
-    x = 0
-    for task, duration in self.f_daily_schedule_hourly_org: 
-      x += duration
-
     # We then calculate the current index based on that. 
-    curr_index = 0
-    elapsed = 0
-    for task, duration in self.f_daily_schedule: 
-      elapsed += duration
-      if elapsed > today_min_elapsed: 
-        return curr_index
-      curr_index += 1
-
-    return curr_index
+    self._f_daily_schedule_elapsed = self.get_schedule_elapsed(
+      self._f_daily_schedule, self._f_daily_schedule_elapsed)
+    return bisect.bisect_right(self._f_daily_schedule_elapsed, 
+                               today_min_elapsed)
 
 
   def get_f_daily_schedule_hourly_org_index(self, advance=0):
@@ -369,14 +425,11 @@ class Scratch:
     today_min_elapsed += self.curr_time.minute
     today_min_elapsed += advance
     # We then calculate the current index based on that. 
-    curr_index = 0
-    elapsed = 0
-    for task, duration in self.f_daily_schedule_hourly_org: 
-      elapsed += duration
-      if elapsed > today_min_elapsed: 
-        return curr_index
-      curr_index += 1
-    return curr_index
+    self._f_daily_schedule_hourly_org_elapsed = self.get_schedule_elapsed(
+      self._f_daily_schedule_hourly_org, 
+      self._f_daily_schedule_hourly_org_elapsed)
+    return bisect.bisect_right(self._f_daily_schedule_hourly_org_elapsed, 
+                               today_min_elapsed)
 
 
   def get_str_iss(self): 
@@ -6,6 +6,7 @@ Description: Defines the MemoryTree class that serves as the agents' spatial
 memory that aids in grounding their behavior in the game world. 
 """
 import json
+import numpy
 import sys
 sys.path.append('../../')
 
@@ -18,6 +19,14 @@ class MemoryTree:
     if check_if_file_exists(f_saved): 
       self.tree = json.load(open(f_saved))
 
+    # <seen_tiles> is a maze_height x maze_width boolean bitmap of the tiles
+    # that have already been added to the tree. The world, sector, arena and
+    # game object of a tile never change, so once a tile is in the tree we 
+    # do not need to look at it again. It is allocated lazily the first time
+    # we perceive the maze (and is not saved; after loading, the tiles are 
+    # simply re-checked once). 
+    self.seen_tiles = None
+
 
   def print_tree(self): 
     def _print_tree(tree, depth):
@@ -35,6 +44,65 @@ class MemoryTree:
     _print_tree(self.tree, 0)
     
 
+  def add_tile(self, tile_details): 
+    """
+    Adds the world, sector, arena and game object of a tile to the tree if 
+    they are not already there. 
+
+    INPUT
+      tile_details: the tile details dictionary returned by 
+                    Maze.access_tile(). 
+    OUTPUT 
+      None
+    """
+    i = tile_details
+    if i["world"]: 
+      if (i["world"] not in self.tree): 
+        self.tree[i["world"]] = {}
+    if i["sector"]: 
+      if (i["sector"] not in self.tree[i["world"]]): 
+        self.tree[i["world"]][i["sector"]] = {}
+    if i["arena"]: 
+      if (i["arena"] not in self.tree[i["world"]][i["sector"]]): 
+        self.tree[i["world"]][i["sector"]][i["arena"]] = []
+    if i["game_object"]: 
+      if (i["game_object"] not in self.tree[i["world"]]
+                                           [i["sector"]]
+                                           [i["arena"]]): 
+        self.tree[i["world"]][i["sector"]][i["arena"]] += [
+                                                           i["game_object"]]
+
+
+  def add_nearby_tiles(self, maze, tile, vision_r): 
+    """
+    Adds the tiles within vision_r of the tile to the tree, skipping the 
+    tiles we have already seen. The new tiles are visited in the same order
+    as Maze.get_nearby_tiles(), so the tree grows exactly as it would if we
+    walked every nearby tile. 
+
+    INPUT
+      maze: An instance of <Maze>. 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+    OUTPUT 
+      The number of newly seen tiles. 
+    """
+    if self.seen_tiles is None: 
+      self.seen_tiles = numpy.zeros((maze.maze_height, maze.maze_width), 
+                                    dtype=bool)
+
+    left_end, right_end, top_end, bottom_end = maze.get_vision_window(
+                                                             tile, vision_r)
+    window = self.seen_tiles[top_end:bottom_end, left_end:right_end]
+
+    # We transpose the window so that we walk the tiles in x-major order. 
+    xs, ys = numpy.nonzero(~window.T)
+    for x, y in zip((xs + left_end).tolist(), (ys + top_end).tolist()): 
+      self.add_tile(maze.access_tile((x, y)))
+    window[:] = True
+    return len(xs)
+
+
   def save(self, out_json):
     with open(out_json, "w") as outfile:
       json.dump(self.tree, outfile) 
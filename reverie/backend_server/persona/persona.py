@@ -46,6 +46,9 @@ class Persona:
     # <scratch> is the persona's scratch (short term memory) space. 
     scratch_saved = f"{folder_mem_saved}/bootstrap_memory/scratch.json"
     self.scratch = Scratch(scratch_saved)
+    # <next_day_plan> is the plan for the next day that we make in the 
+    # background during the evening (see NextDayPlan in plan.py), or None. 
+    self.next_day_plan = None
 
 
   def save(self, save_folder): 
@@ -0,0 +1,535 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: gpt_structure.py
+Description: Wrapper functions for building the prompts and calling the
+language model.
+"""
+import json
+import random
+import string
+import threading
+import time
+
+from utils import *
+from llm_metrics import llm_metrics
+from persona.prompt_template.template_registry import *
+
+# <prompt_context> remembers, per thread, the template of the prompt that was
+# last generated (see generate_prompt()), and whether the last response of
+# the response functions was the fail safe.
+prompt_context = threading.local()
+
+# RETRY BUDGET PARAMETERS
+# <retry_budgets> caps the number of attempts for the prompts of a template,
+# keyed like the template registry (e.g., "v2/wake_up_hour_v1.txt"). The
+# <repeat> that the run_gpt_prompt function asks for applies otherwise.
+retry_budgets = dict()
+# Once <fail_safe_streak> calls of a prompt type for a persona in a row have
+# ended with the fail safe, we stop spending attempts on them: the calls get
+# the fail safe right away, except every <probe_every>th call, which gets a
+# single attempt to find out whether the model copes with it again. The
+# streak is kept per persona, as it is usually what one persona's memories
+# or schedule put into the prompt that the model cannot cope with.
+fail_safe_streak = 3
+probe_every = 5
+# The errors that fail an attempt rather than the call: a response that does
+# not parse into what we asked for (json.JSONDecodeError and the ValueError
+# of StructuredOutput.parse()), and a request that did not get through
+# (OSError, which the errors of requests derive from). Any other error is a
+# bug in the prompt function and is raised.
+attempt_errors = (ValueError, OSError)
+
+# STRUCTURED OUTPUT PARAMETERS
+# <structured_output_mode> is how we ask for the responses of the prompt
+# functions that declare a StructuredOutput:
+#   "schema" -- Ollama constrains the response to the declared JSON schema
+#               (Ollama 0.5 and later).
+#   "json"   -- Ollama constrains the response to some JSON object (older
+#               Ollama versions); the schema is only a hint in the prompt.
+#   None     -- the prompt is answered in free text, as without a
+#               StructuredOutput.
+structured_output_mode = "schema"
+
+
+def get_curr_template():
+  """
+  Returns the template file of the last prompt generated in this thread, or
+  None.
+  """
+  return getattr(prompt_context, "template", None)
+
+
+def last_response_was_fail_safe():
+  """
+  Returns True if the last safe_generate call in this thread returned its
+  fail safe instead of a validated response.
+  """
+  return getattr(prompt_context, "fail_safe", False)
+
+
+def get_prompt_type(prompt_type):
+  """
+  Returns the prompt type that we keep the retry budget and the stats under:
+  the key of the template file <prompt_type> (as the run_gpt_prompt
+  functions pass their prompt_template), any other name as it is, or
+  "unlabeled" for None.
+  """
+  if prompt_type is None:
+    return "unlabeled"
+  if prompt_type.endswith(".txt"):
+    return template_registry.get_template_key(prompt_type)
+  return prompt_type
+
+
+def generate_prompt(curr_input, prompt_lib_file):
+  """
+  Takes in the current input (e.g. comment that you want to classifiy) and
+  the path to a prompt file. The prompt file contains the raw str prompt that
+  will be used, which contains the following substr: !<INPUT>! -- this
+  function replaces this substr with the actual curr_input to produce the
+  final promopt that will be sent to the GPT3 server.
+
+  The templates are compiled once by the template registry, so this does not
+  read the prompt file.
+
+  ARGS:
+    curr_input: the input we want to feed in (IF THERE ARE MORE THAN ONE
+                INPUT, THIS CAN BE A LIST.)
+    prompt_lib_file: the path to the promopt file.
+  RETURNS:
+    a str prompt that will be sent to OpenAI's GPT server.
+  """
+  if type(curr_input) == type("string"):
+    curr_input = [curr_input]
+  curr_input = [str(i) for i in curr_input]
+
+  prompt = template_registry.get(prompt_lib_file).fill(curr_input)
+  prompt_context.template = prompt_lib_file
+  return prompt
+
+
+##############################################################################
+# RETRY STATS
+##############################################################################
+
+class PromptStats:
+  """
+  Keeps, for each prompt type, how many calls we made and how they went, so
+  that we know which prompts the model keeps failing and how many
+  generations we throw away on them.
+  """
+  def __init__(self):
+    # <stats> maps a prompt type to a dictionary of counts:
+    #   calls: the safe_generate_response calls.
+    #   attempts: the generations we asked the model for.
+    #   validated: the calls that got a response that passed validation.
+    #   fail_safes: the calls that ended with the fail safe.
+    #   skipped: the fail safe calls that we did not even try (see
+    #            fail_safe_streak).
+    self.stats = dict()
+    # <streaks> maps a (prompt type, persona name) pair to the calls in a
+    # row that have ended with the fail safe.
+    self.streaks = dict()
+    self.lock = threading.Lock()
+
+
+  def _get(self, prompt_type):
+    if prompt_type not in self.stats:
+      self.stats[prompt_type] = {"calls": 0, "attempts": 0, "validated": 0,
+                                 "fail_safes": 0, "skipped": 0}
+    return self.stats[prompt_type]
+
+
+  def start_call(self, prompt_type, persona_name, repeat):
+    """
+    Records a new call of the prompt type for the persona and returns the
+    number of attempts it may make.
+    """
+    with self.lock:
+      stats = self._get(prompt_type)
+      stats["calls"] += 1
+      budget = min(repeat, retry_budgets.get(prompt_type, repeat))
+      streak = self.streaks.get((prompt_type, persona_name), 0)
+      if streak >= fail_safe_streak:
+        if (streak - fail_safe_streak) % probe_every == probe_every - 1:
+          budget = min(budget, 1)
+        else:
+          budget = 0
+      return budget
+
+
+  def record_attempt(self, prompt_type):
+    with self.lock:
+      self._get(prompt_type)["attempts"] += 1
+
+
+  def end_call(self, prompt_type, persona_name, validated, attempts):
+    with self.lock:
+      stats = self._get(prompt_type)
+      streak_key = (prompt_type, persona_name)
+      if validated:
+        stats["validated"] += 1
+        self.streaks.pop(streak_key, None)
+      else:
+        stats["fail_safes"] += 1
+        self.streaks[streak_key] = self.streaks.get(streak_key, 0) + 1
+        if attempts == 0:
+          stats["skipped"] += 1
+
+
+  def get(self):
+    with self.lock:
+      return {prompt_type: dict(stats)
+              for prompt_type, stats in self.stats.items()}
+
+
+  def get_streak(self, prompt_type, persona_name=None):
+    with self.lock:
+      return self.streaks.get((prompt_type, persona_name), 0)
+
+
+  def reset(self):
+    with self.lock:
+      self.stats = dict()
+      self.streaks = dict()
+
+
+prompt_stats = PromptStats()
+
+
+def get_prompt_stats():
+  """
+  Returns a copy of the stats of all prompt types (see PromptStats).
+
+  EXAMPLE OUTPUT
+    {"v2/wake_up_hour_v1.txt": {"calls": 25, "attempts": 31,
+                                "validated": 25, "fail_safes": 0,
+                                "skipped": 0}, ...}
+  """
+  return prompt_stats.get()
+
+
+def print_prompt_stats():
+  """
+  Prints the stats of all prompt types, the ones that waste the most
+  generations (attempts that did not end in a validated response) first.
+  """
+  stats = get_prompt_stats()
+  def wasted(prompt_type):
+    return stats[prompt_type]["attempts"] - stats[prompt_type]["validated"]
+  print (f"{'prompt type':<50} {'calls':>6} {'tries':>6} {'valid':>6} "
+         f"{'fail':>6} {'skip':>6}")
+  for prompt_type in sorted(stats, key=wasted, reverse=True):
+    row = stats[prompt_type]
+    print (f"{prompt_type:<50} {row['calls']:>6} {row['attempts']:>6} "
+           f"{row['validated']:>6} {row['fail_safes']:>6} {row['skipped']:>6}")
+
+
+def print_llm_report():
+  """
+  Prints the LLM metrics of all prompt types (see llm_metrics.py) -- their
+  requests, tokens, and time -- along with their calls, retries, and fail 
+  safes, the ones that take the most time first. With an LLMRouter (see
+  llm_router.py), also prints the state and load of each of its backends.
+  """
+  print (llm_metrics.format_report(get_prompt_stats()))
+  if hasattr(llm, "format_backend_report"):
+    print (llm.format_backend_report())
+
+
+def export_llm_report(report_file):
+  """
+  Writes the report of print_llm_report() to <report_file> as JSON.
+  """
+  llm_metrics.export(report_file, get_prompt_stats())
+
+
+##############################################################################
+# STRUCTURED OUTPUT
+##############################################################################
+
+class StructuredOutput:
+  """
+  Declares the JSON object that a prompt function wants as its response. The
+  schema is handed to Ollama as the format of the response, so the model
+  can only answer with a JSON object of that form, and <to_response> turns
+  the object back into what the function's validate and clean up functions
+  expect.
+
+  EXAMPLE
+    StructuredOutput({"type": "object",
+                      "properties": {"answer": {"enum": ["yes", "no"]}},
+                      "required": ["answer"]},
+                     lambda response: response["answer"],
+                     example={"answer": "yes"})
+  """
+  def __init__(self, schema, to_response, example=None, max_tokens=None):
+    self.schema = schema
+    self.to_response = to_response
+    # <example> is an example of the JSON object; if given, it is added to
+    # the prompt so that the model knows what the fields are for.
+    self.example = example
+    # <max_tokens> is the number of tokens the JSON object may take. The
+    # max_tokens of a prompt's gpt_param were picked for its free text 
+    # answer, and the keys, quotes and braces of the JSON come on top of 
+    # that; a response that is cut off does not parse, and at temperature 0
+    # neither does any retry. None keeps the gpt_param's max_tokens.
+    self.max_tokens = max_tokens
+
+
+  def get_gpt_parameter(self, gpt_parameter):
+    if self.max_tokens is None:
+      return gpt_parameter
+    return dict(gpt_parameter, max_tokens=self.max_tokens)
+
+
+  def get_format(self):
+    if structured_output_mode == "json":
+      return "json"
+    return self.schema
+
+
+  def get_prompt(self, prompt):
+    if self.example is None:
+      return prompt
+    return (prompt + "\n\nAnswer with a JSON object like this: "
+            + json.dumps(self.example, ensure_ascii=False))
+
+
+  def parse(self, gpt_response):
+    """
+    Returns the response of the JSON object in <gpt_response>. Raises a
+    ValueError if it is not JSON or not an object of the schema.
+    """
+    response = json.loads(gpt_response)
+    try:
+      return self.to_response(response)
+    except (KeyError, IndexError, TypeError) as e:
+      raise ValueError(f"response does not match the schema: {e!r}")
+
+
+def chat_output(value_schema={"type": "string"}):
+  """
+  Returns the StructuredOutput of a ChatGPT_safe_generate_response prompt,
+  which asks for {"output": <value>}.
+  """
+  return StructuredOutput({"type": "object",
+                           "properties": {"output": value_schema},
+                           "required": ["output"]},
+                          lambda response: response["output"])
+
+
+def use_structured_output(structured_output):
+  return structured_output is not None and structured_output_mode is not None
+
+
+##############################################################################
+# LLM REQUESTS
+##############################################################################
+
+def GPT_request(prompt, gpt_parameter, format=None):
+  """
+  Given a prompt and a dictionary of GPT parameters (as in the
+  run_gpt_prompt functions), makes a request to the local LLM and returns
+  the response. The engine is ignored; we always ask the local model.
+
+  ARGS:
+    prompt: a str prompt
+    gpt_parameter: a python dictionary with the keys indicating the names of
+                   the parameter and the values indicating the parameter
+                   values.
+    format: the format that the response is constrained to (see
+            StructuredOutput), or None.
+  RETURNS:
+    a str of the model's response.
+  """
+  options = dict()
+  for key in ["top_p", "frequency_penalty", "presence_penalty"]:
+    if key in gpt_parameter:
+      options[key] = gpt_parameter[key]
+  # Stop sequences (e.g., "\n") would cut a JSON response short.
+  stop = gpt_parameter.get("stop") or []
+  if format is not None:
+    stop = []
+  return llm.generate_response(prompt,
+                               max_tokens=gpt_parameter.get("max_tokens", 512),
+                               temperature=gpt_parameter.get("temperature", 0),
+                               stop=stop,
+                               options=options,
+                               format=format)
+
+
+def ChatGPT_request(prompt, format=None, gpt_parameter=None):
+  """
+  Given a prompt, makes a request to the local LLM with its default
+  parameters (or with <gpt_parameter>, as GPT_request does) and returns the
+  response. If a <format> is given (see StructuredOutput), the response is
+  constrained to it.
+  """
+  if gpt_parameter is not None:
+    return GPT_request(prompt, gpt_parameter, format)
+  if format is not None:
+    return llm.generate_response(prompt, stop=[], format=format)
+  return llm.generate_response(prompt)
+
+
+def ChatGPT_single_request(prompt):
+  """
+  Makes a single request with no validation (e.g., for the free-form notes
+  of revise_identity()).
+  """
+  return ChatGPT_request(prompt)
+
+
+def _generate_with_budget(prompt_type, persona_name, repeat,
+                          fail_safe_response, attempt, verbose=False):
+  """
+  Runs up to <repeat> attempts (fewer if the retry budget of the prompt type
+  says so) and returns the first validated, cleaned up response, or the
+  fail safe.
+
+  ARGS:
+    prompt_type: see get_prompt_type()
+    persona_name: the persona that the fail safe streak is kept for, or None
+    repeat: the number of attempts that the caller asks for
+    fail_safe_response: what we return if no attempt is validated
+    attempt: a function that makes one attempt and returns a (validated,
+             response) pair; the response is cleaned up if validated.
+  RETURNS:
+    the response or the fail safe.
+  """
+  budget = prompt_stats.start_call(prompt_type, persona_name, repeat)
+  for i in range(budget):
+    prompt_stats.record_attempt(prompt_type)
+    try:
+      # The LLM requests of the attempt are recorded under the prompt type.
+      with llm_metrics.prompt_type(prompt_type):
+        validated, response = attempt()
+    except attempt_errors as e:
+      validated, response = False, e
+    if validated:
+      prompt_stats.end_call(prompt_type, persona_name, True, i + 1)
+      prompt_context.fail_safe = False
+      return response
+    if verbose:
+      print ("---- repeat count: ", i, response)
+      print (response)
+      print ("~~~~")
+
+  prompt_stats.end_call(prompt_type, persona_name, False, budget)
+  prompt_context.fail_safe = True
+  if verbose or budget == 0:
+    print (f"FAIL SAFE TRIGGERED ({prompt_type})")
+  return fail_safe_response
+
+
+def safe_generate_response(prompt,
+                           gpt_parameter,
+                           repeat=5,
+                           fail_safe_response="error",
+                           func_validate=None,
+                           func_clean_up=None,
+                           verbose=False,
+                           structured_output=None,
+                           prompt_type=None,
+                           persona_name=None):
+  if verbose:
+    print (prompt)
+
+  def attempt():
+    if use_structured_output(structured_output):
+      curr_gpt_response = GPT_request(
+        structured_output.get_prompt(prompt),
+        structured_output.get_gpt_parameter(gpt_parameter),
+        structured_output.get_format())
+      if curr_gpt_response == llm.ERROR_RESPONSE:
+        return False, curr_gpt_response
+      curr_gpt_response = structured_output.parse(curr_gpt_response)
+    else:
+      curr_gpt_response = GPT_request(prompt, gpt_parameter)
+      if curr_gpt_response == llm.ERROR_RESPONSE:
+        return False, curr_gpt_response
+    if func_validate(curr_gpt_response, prompt=prompt):
+      return True, func_clean_up(curr_gpt_response, prompt=prompt)
+    return False, curr_gpt_response
+
+  return _generate_with_budget(get_prompt_type(prompt_type), persona_name,
+                               repeat, fail_safe_response, attempt, verbose)
+
+
+def ChatGPT_safe_generate_response(prompt,
+                                   example_output,
+                                   special_instruction,
+                                   repeat=3,
+                                   fail_safe_response="error",
+                                   func_validate=None,
+                                   func_clean_up=None,
+                                   verbose=False,
+                                   structured_output=None,
+                                   prompt_type=None,
+                                   persona_name=None,
+                                   gpt_parameter=None):
+  prompt = '"""\n' + prompt + '\n"""\n'
+  prompt += f"Output the response to the prompt above in json. {special_instruction}\n"
+  prompt += "Example output json:\n"
+  prompt += '{"output": "' + str(example_output) + '"}'
+
+  if verbose:
+    print ("CHAT GPT PROMPT")
+    print (prompt)
+
+  def attempt():
+    if use_structured_output(structured_output):
+      curr_gpt_response = ChatGPT_request(structured_output.get_prompt(prompt),
+                                          structured_output.get_format(),
+                                          gpt_parameter)
+      if curr_gpt_response == llm.ERROR_RESPONSE:
+        return False, curr_gpt_response
+      curr_gpt_response = structured_output.parse(curr_gpt_response)
+    else:
+      curr_gpt_response = ChatGPT_request(prompt,
+                                          gpt_parameter=gpt_parameter).strip()
+      if curr_gpt_response == llm.ERROR_RESPONSE:
+        return False, curr_gpt_response
+      end_index = curr_gpt_response.rfind('}') + 1
+      curr_gpt_response = curr_gpt_response[:end_index]
+      curr_gpt_response = chat_output().parse(curr_gpt_response)
+    if func_validate(curr_gpt_response, prompt=prompt):
+      return True, func_clean_up(curr_gpt_response, prompt=prompt)
+    return False, curr_gpt_response
+
+  return _generate_with_budget(get_prompt_type(prompt_type), persona_name,
+                               repeat, fail_safe_response, attempt, verbose)
+
+
+def ChatGPT_safe_generate_response_OLD(prompt,
+                                       repeat=3,
+                                       fail_safe_response="error",
+                                       func_validate=None,
+                                       func_clean_up=None,
+                                       verbose=False,
+                                       structured_output=None,
+                                       prompt_type=None,
+                                       persona_name=None):
+  if verbose:
+    print ("CHAT GPT PROMPT")
+    print (prompt)
+
+  def attempt():
+    if use_structured_output(structured_output):
+      curr_gpt_response = ChatGPT_request(structured_output.get_prompt(prompt),
+                                          structured_output.get_format())
+      if curr_gpt_response == llm.ERROR_RESPONSE:
+        return False, curr_gpt_response
+      curr_gpt_response = structured_output.parse(curr_gpt_response)
+    else:
+      curr_gpt_response = ChatGPT_request(prompt).strip()
+      if curr_gpt_response == llm.ERROR_RESPONSE:
+        return False, curr_gpt_response
+    if func_validate(curr_gpt_response, prompt=prompt):
+      return True, func_clean_up(curr_gpt_response, prompt=prompt)
+    return False, curr_gpt_response
+
+  return _generate_with_budget(get_prompt_type(prompt_type), persona_name,
+                               repeat, fail_safe_response, attempt, verbose)
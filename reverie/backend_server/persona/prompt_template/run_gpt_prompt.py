@@ -7,6 +7,7 @@ interface with the safe_generate_response function.
 """
 import re
 import datetime
+import json
 import sys
 import ast
 
@@ -75,7 +76,9 @@ def run_gpt_prompt_wake_up_hour(persona, test_input=None, verbose=False):
   fail_safe = get_fail_safe()
 
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
   
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -147,7 +150,9 @@ def run_gpt_prompt_daily_plan(persona,
   fail_safe = get_fail_safe()
 
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
   output = ([f"wake up and complete the morning routine at {wake_up_hour}:00 am"]
               + output)
 
@@ -279,7 +284,9 @@ def run_gpt_prompt_generate_hourly_schedule(persona,
   fail_safe = get_fail_safe()
   
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
   
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -437,7 +444,9 @@ def run_gpt_prompt_task_decomp(persona,
   print ("?????")
   print (prompt)
   output = safe_generate_response(prompt, gpt_param, 5, get_fail_safe(),
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   # TODO THERE WAS A BUG HERE... 
   # This is for preventing overflows...
@@ -611,7 +620,9 @@ def run_gpt_prompt_action_sector(action_description,
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
   y = f"{maze.access_tile(persona.scratch.curr_tile)['world']}"
   x = [i.strip() for i in persona.s_mem.get_str_accessible_sectors(y).split(",")]
   if output not in x: 
@@ -708,7 +719,9 @@ def run_gpt_prompt_action_arena(action_description,
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
   print (output)
   # y = f"{act_world}:{act_sector}"
   # x = [i.strip() for i in persona.s_mem.get_str_accessible_sector_arenas(y).split(",")]
@@ -767,7 +780,9 @@ def run_gpt_prompt_action_game_object(action_description,
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   x = [i.strip() for i in persona.s_mem.get_str_accessible_arena_game_objects(temp_address).split(",")]
   if output not in x: 
@@ -835,7 +850,10 @@ def run_gpt_prompt_pronunciatio(action_description, persona, verbose=False):
   special_instruction = "The value for the output must ONLY contain the emojis." ########
   fail_safe = get_fail_safe()
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          chat_output(),
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -939,9 +957,23 @@ def run_gpt_prompt_event_triple(action_description, persona, verbose=False):
   prompt_template = "persona/prompt_template/v2/generate_event_triple_v1.txt"
   prompt_input = create_prompt_input(action_description, persona)
   prompt = generate_prompt(prompt_input, prompt_template)
+  # The prompt completes "(<subject>, <predicate>, <object>)"; we ask for the
+  # predicate and the object and write them out the same way. 
+  structured_output = StructuredOutput(
+    {"type": "object", 
+     "properties": {"predicate": {"type": "string"}, 
+                    "object": {"type": "string"}}, 
+     "required": ["predicate", "object"]}, 
+    lambda response: ", ".join(response[i].replace(",", " ").replace(")", " ")
+                               for i in ["predicate", "object"]) + ")", 
+    example={"predicate": "write", "object": "email"}, 
+    max_tokens=60)
   fail_safe = get_fail_safe(persona) ########
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up, 
+                                   structured_output=structured_output,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
   output = (persona.name, output[0], output[1])
 
   if debug or verbose: 
@@ -1011,7 +1043,9 @@ def run_gpt_prompt_act_obj_desc(act_game_object, act_desp, persona, verbose=Fals
   special_instruction = "The output should ONLY contain the phrase that should go in <fill in>." ########
   fail_safe = get_fail_safe(act_game_object) ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -1074,7 +1108,9 @@ def run_gpt_prompt_act_obj_event_triple(act_game_object, act_obj_desc, persona,
   prompt = generate_prompt(prompt_input, prompt_template)
   fail_safe = get_fail_safe(act_game_object)
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
   output = (act_game_object, output[0], output[1])
 
   if debug or verbose: 
@@ -1084,6 +1120,187 @@ def run_gpt_prompt_act_obj_event_triple(act_game_object, act_obj_desc, persona,
   return output, [output, prompt, gpt_param, prompt_input, fail_safe]
 
 
+def run_gpt_prompt_action_annotation(action_description, 
+                                     persona, 
+                                     maze, 
+                                     test_input=None, 
+                                     verbose=False): 
+  """
+  Annotates a new action in one prompt: where it takes place (its sector,
+  arena, and game object), its pronunciatio and event triple, and the state
+  of the game object (its description, pronunciatio, and event triple). 
+
+  Each field is checked on its own; a field that is missing or invalid (e.g.,
+  an arena that is not in the sector) is None in the output, and so are the
+  fields that depend on it, so that the caller can fill them in with the 
+  prompts that generate them one by one. 
+
+  INPUT: 
+    action_description: the description of the action (e.g., "sleeping")
+    persona: The Persona class instance
+    maze: The Maze class instance
+  OUTPUT: 
+    A dictionary with the keys of <annotation_fields>. 
+  """
+  annotation_fields = ["sector", "arena", "game_object", 
+                       "pronunciatio", "predicate", "object", 
+                       "object_description", "object_pronunciatio", 
+                       "object_predicate", "object_object"]
+  act_world = f"{maze.access_tile(persona.scratch.curr_tile)['world']}"
+
+  def get_accessible_locations(persona, act_world): 
+    # Returns {sector: {arena: [game objects]}} of the places the persona
+    # can go to, leaving out the other personas' houses and rooms (as the 
+    # sector and arena prompts do). 
+    locations = dict()
+    for sector in persona.s_mem.get_str_accessible_sectors(act_world).split(", "): 
+      if not sector or ("'s house" in sector 
+                        and persona.scratch.last_name not in sector): 
+        continue
+      locations[sector] = dict()
+      arena_str = persona.s_mem.get_str_accessible_sector_arenas(
+                    f"{act_world}:{sector}")
+      for arena in arena_str.split(", "): 
+        if not arena or ("'s room" in arena 
+                         and persona.scratch.last_name not in arena): 
+          continue
+        game_object_str = persona.s_mem.get_str_accessible_arena_game_objects(
+                            f"{act_world}:{sector}:{arena}")
+        locations[sector][arena] = [i.strip() for i in game_object_str.split(",")
+                                    if i.strip()]
+    return locations
+
+  locations = get_accessible_locations(persona, act_world)
+
+  def create_prompt_input(action_description, persona, maze, test_input=None): 
+    curr_tile = maze.access_tile(persona.scratch.curr_tile)
+    location_str = ""
+    for sector, arenas in locations.items(): 
+      location_str += f"{sector}\n"
+      for arena, game_objects in arenas.items(): 
+        location_str += f"  {arena}: {', '.join(game_objects)}\n"
+
+    action_description_1 = action_description
+    action_description_2 = action_description
+    if "(" in action_description: 
+      action_description_1 = action_description.split("(")[0].strip()
+      action_description_2 = action_description.split("(")[-1][:-1]
+
+    prompt_input = [persona.scratch.get_str_name(), 
+                    persona.scratch.living_area.split(":")[1], 
+                    curr_tile["sector"], 
+                    curr_tile["arena"], 
+                    persona.scratch.get_str_daily_plan_req(), 
+                    location_str.strip(), 
+                    persona.scratch.get_str_name(), 
+                    action_description_1, 
+                    action_description_2]
+    return prompt_input
+
+  def match_option(value, options): 
+    # The options are matched regardless of case. 
+    options = {i.lower(): i for i in options}
+    return options.get(value.lower())
+
+  def __func_clean_up(gpt_response, prompt=""):
+    if isinstance(gpt_response, str): 
+      gpt_response = json.loads(gpt_response[gpt_response.find("{"):
+                                             gpt_response.rfind("}") + 1])
+    annotation = dict()
+    for field in annotation_fields: 
+      value = gpt_response.get(field)
+      if isinstance(value, str) and value.strip(): 
+        annotation[field] = value.strip()
+      else: 
+        annotation[field] = None
+
+    # The arena has to be in the sector and the game object in the arena. 
+    # The object fields describe the game object's state, so they go with 
+    # the game object and its description. 
+    sector = annotation["sector"]
+    arena = annotation["arena"]
+    game_object = annotation["game_object"]
+    if sector: 
+      sector = match_option(sector, locations.keys())
+    if sector and arena: 
+      arena = match_option(arena, locations[sector].keys())
+    else: 
+      arena = None
+    if arena and game_object: 
+      game_object = match_option(game_object, locations[sector][arena])
+    else: 
+      game_object = None
+    annotation["sector"] = sector
+    annotation["arena"] = arena
+    annotation["game_object"] = game_object
+    if not game_object: 
+      annotation["object_description"] = None
+    if not annotation["object_description"]: 
+      for field in ["object_pronunciatio", "object_predicate", "object_object"]: 
+        annotation[field] = None
+
+    # A triple needs both its predicate and its object. 
+    for predicate, obj in [("predicate", "object"), 
+                           ("object_predicate", "object_object")]: 
+      if not annotation[predicate] or not annotation[obj]: 
+        annotation[predicate] = None
+        annotation[obj] = None
+
+    for field in ["pronunciatio", "object_pronunciatio"]: 
+      if annotation[field]: 
+        annotation[field] = annotation[field][:3]
+    if annotation["object_description"]: 
+      annotation["object_description"] = (annotation["object_description"]
+                                          .rstrip("."))
+    return annotation
+
+  def __func_validate(gpt_response, prompt=""): 
+    try: 
+      __func_clean_up(gpt_response, prompt="")
+    except: 
+      return False
+    return True 
+
+  def get_fail_safe(): 
+    fs = {field: None for field in annotation_fields}
+    return fs
+
+  gpt_param = {"engine": "text-davinci-003", "max_tokens": 200, 
+               "temperature": 0, "top_p": 1, "stream": False,
+               "frequency_penalty": 0, "presence_penalty": 0, "stop": None}
+  prompt_template = "persona/prompt_template/v3_ChatGPT/action_annotation_v1.txt"
+  prompt_input = create_prompt_input(action_description, persona, maze)
+  prompt = generate_prompt(prompt_input, prompt_template)
+  sectors = list(locations.keys())
+  structured_output = StructuredOutput(
+    {"type": "object", 
+     "properties": dict([("sector", {"enum": sectors} if sectors 
+                                    else {"type": "string"})] 
+                        + [(field, {"type": "string"}) 
+                           for field in annotation_fields[1:]]), 
+     "required": annotation_fields}, 
+    lambda response: response, 
+    example={"sector": "Hobbs Cafe", "arena": "cafe", 
+             "game_object": "cafe customer seating", 
+             "pronunciatio": "☕", "predicate": "drink", "object": "coffee", 
+             "object_description": "being sat on", 
+             "object_pronunciatio": "🪑", "object_predicate": "is", 
+             "object_object": "occupied"}, 
+    max_tokens=300)
+  fail_safe = get_fail_safe()
+  output = safe_generate_response(prompt, gpt_param, 3, fail_safe,
+                                   __func_validate, __func_clean_up, 
+                                   structured_output=structured_output,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
+
+  if debug or verbose: 
+    print_run_prompts(prompt_template, persona, gpt_param, 
+                      prompt_input, prompt, output)
+
+  return output, [output, prompt, gpt_param, prompt_input, fail_safe]
+
+
 
 
 
@@ -1221,7 +1438,9 @@ def run_gpt_prompt_new_decomp_schedule(persona,
   prompt = generate_prompt(prompt_input, prompt_template)
   fail_safe = get_fail_safe(main_act_dur, truncated_act_dur)
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
   
   # print ("* * * * output")
   # print (output)
@@ -1328,9 +1547,20 @@ def run_gpt_prompt_decide_to_talk(persona, target_persona, retrieved,test_input=
                                      test_input)
   prompt = generate_prompt(prompt_input, prompt_template)
 
+  # We only ask for the answer; the reasoning that the prompt invites would
+  # not fit in the 20 tokens of the gpt_param. 
+  structured_output = StructuredOutput(
+    {"type": "object", 
+     "properties": {"answer": {"enum": ["yes", "no"]}}, 
+     "required": ["answer"]}, 
+    lambda response: response["answer"], 
+    example={"answer": "yes"})
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up, 
+                                   structured_output=structured_output,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -1428,7 +1658,9 @@ def run_gpt_prompt_decide_to_react(persona, target_persona, retrieved,test_input
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -1571,7 +1803,9 @@ def run_gpt_prompt_create_conversation(persona, target_persona, curr_loc,
 
   fail_safe = get_fail_safe(persona, target_persona)
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -1636,7 +1870,9 @@ def run_gpt_prompt_summarize_conversation(persona, conversation, test_input=None
   special_instruction = "The output must continue the sentence above by filling in the <fill in> tag. Don't start with 'this is a conversation about...' Just finish the sentence but do not miss any important details (including who are chatting)." ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -1705,7 +1941,9 @@ def run_gpt_prompt_extract_keywords(persona, description, test_input=None, verbo
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
 
   if debug or verbose: 
@@ -1750,7 +1988,9 @@ def run_gpt_prompt_keyword_to_thoughts(persona, keyword, concept_summary, test_i
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -1808,7 +2048,9 @@ def run_gpt_prompt_convo_to_thoughts(persona,
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -1889,7 +2131,9 @@ def run_gpt_prompt_event_poignancy(persona, event_description, test_input=None,
   special_instruction = "The output should ONLY contain ONE integer value on the scale of 1 to 10." ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -1960,7 +2204,9 @@ def run_gpt_prompt_thought_poignancy(persona, event_description, test_input=None
   special_instruction = "The output should ONLY contain ONE integer value on the scale of 1 to 10." ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2032,7 +2278,9 @@ def run_gpt_prompt_chat_poignancy(persona, event_description, test_input=None, v
   special_instruction = "The output should ONLY contain ONE integer value on the scale of 1 to 10." ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2058,6 +2306,81 @@ def run_gpt_prompt_chat_poignancy(persona, event_description, test_input=None, v
   # return output, [output, prompt, gpt_param, prompt_input, fail_safe]
 
 
+def run_gpt_prompt_poignancy_batch(persona, memories, test_input=None, verbose=False): 
+  """
+  Rates the poignancy of several memories in one prompt. 
+
+  INPUT: 
+    persona: The Persona class instance 
+    memories: A list of (memory type, description) pairs, where the memory
+              type is "event", "chat" or "thought". 
+  OUTPUT: 
+    A list with the score (1 to 10) of each memory, or None for the memories
+    whose score we could not read from the response. 
+  """
+  memory_labels = {"event": "Event", "chat": "Conversation", 
+                   "thought": "Thought"}
+
+  def create_prompt_input(persona, memories, test_input=None): 
+    memory_str = ""
+    for count, (memory_type, description) in enumerate(memories): 
+      memory_str += f"{count + 1}. {memory_labels[memory_type]}: {description}\n"
+    prompt_input = [persona.scratch.name,
+                    persona.scratch.get_str_iss(),
+                    persona.scratch.name,
+                    str(len(memories)), 
+                    memory_str.strip()]
+    return prompt_input
+
+  def __chat_func_clean_up(gpt_response, prompt=""): ############
+    if isinstance(gpt_response, str): 
+      gpt_response = gpt_response.strip().strip("[]").split(",")
+    scores = []
+    for score in gpt_response: 
+      try: 
+        score = int(str(score).strip().strip('"'))
+        if score < 1 or score > 10: 
+          score = None
+      except ValueError: 
+        score = None
+      scores += [score]
+    return scores
+
+  def __chat_func_validate(gpt_response, prompt=""): ############
+    # A response with the wrong number of scores cannot be matched to the
+    # memories; a single score that does not parse only loses that memory. 
+    try: 
+      return len(__chat_func_clean_up(gpt_response, prompt)) == len(memories)
+    except: 
+      return False 
+
+  def get_fail_safe(): 
+    return [None] * len(memories)
+
+  gpt_param = {"engine": "text-davinci-002", "max_tokens": 15 + 5 * len(memories), 
+               "temperature": 0, "top_p": 1, "stream": False,
+               "frequency_penalty": 0, "presence_penalty": 0, "stop": None}
+  prompt_template = "persona/prompt_template/v3_ChatGPT/poignancy_batch_v1.txt" ########
+  prompt_input = create_prompt_input(persona, memories)  ########
+  prompt = generate_prompt(prompt_input, prompt_template)
+  example_output = ", ".join(["5", "2", "8"][:len(memories)]) ########
+  special_instruction = f"The output should ONLY contain {len(memories)} integer values on the scale of 1 to 10, separated by commas." ########
+  fail_safe = get_fail_safe() ########
+  output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
+                                          __chat_func_validate, __chat_func_clean_up, verbose,
+                                          chat_output({"type": "array", 
+                                                       "items": {"type": "integer"}}),
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name,
+                                          gpt_parameter=gpt_param)
+
+  if debug or verbose: 
+    print_run_prompts(prompt_template, persona, gpt_param, 
+                      prompt_input, prompt, output)
+
+  return output, [output, prompt, gpt_param, prompt_input, fail_safe]
+
+
 
 
 
@@ -2108,7 +2431,9 @@ def run_gpt_prompt_focal_pt(persona, statements, n, test_input=None, verbose=Fal
   special_instruction = "Output must be a list of str." ########
   fail_safe = get_fail_safe(n) ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2127,7 +2452,9 @@ def run_gpt_prompt_focal_pt(persona, statements, n, test_input=None, verbose=Fal
 
   fail_safe = get_fail_safe(n)
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2178,7 +2505,9 @@ def run_gpt_prompt_insight_and_guidance(persona, statements, n, test_input=None,
 
   fail_safe = get_fail_safe(n)
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2235,7 +2564,9 @@ def run_gpt_prompt_agent_chat_summarize_ideas(persona, target_persona, statement
   special_instruction = 'The output should be a string that responds to the question.' ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2303,7 +2634,9 @@ def run_gpt_prompt_agent_chat_summarize_relationship(persona, target_persona, st
   special_instruction = 'The output should be a string that responds to the question.' ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2431,7 +2764,9 @@ def run_gpt_prompt_agent_chat(maze, persona, target_persona,
   special_instruction = 'The output should be a list of list where the inner lists are in the form of ["<Name>", "<Utterance>"].' ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   # print ("HERE END JULY 23 -- ----- ") ########
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
@@ -2512,7 +2847,9 @@ def run_gpt_prompt_summarize_ideas(persona, statements, question, test_input=Non
   special_instruction = 'The output should be a string that responds to the question.' ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2602,7 +2939,9 @@ def run_gpt_prompt_generate_next_convo_line(persona, interlocutor_desc, prev_con
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2642,7 +2981,9 @@ def run_gpt_prompt_generate_whisper_inner_thought(persona, whisper, test_input=N
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2679,7 +3020,9 @@ def run_gpt_prompt_planning_thought_on_convo(persona, all_utt, test_input=None,
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2731,7 +3074,9 @@ def run_gpt_prompt_memo_on_convo(persona, all_utt, test_input=None, verbose=Fals
   special_instruction = 'The output should ONLY contain a string that summarizes anything interesting that the agent may have noticed' ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_type=prompt_template,
+                                          persona_name=persona.name)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2745,7 +3090,9 @@ def run_gpt_prompt_memo_on_convo(persona, all_utt, test_input=None, verbose=Fals
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_type=prompt_template,
+                                   persona_name=persona.name)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2787,7 +3134,9 @@ def run_gpt_generate_safety_score(persona, comment, test_input=None, verbose=Fal
   print (prompt)
   fail_safe = get_fail_safe() 
   output = ChatGPT_safe_generate_response_OLD(prompt, 3, fail_safe,
-                        __chat_func_validate, __chat_func_clean_up, verbose)
+                        __chat_func_validate, __chat_func_clean_up, verbose,
+                        prompt_type=prompt_template,
+                        persona_name=persona.name)
   print (output)
   
   gpt_param = {"engine": "text-davinci-003", "max_tokens": 50, 
@@ -2901,8 +3250,22 @@ def run_gpt_generate_iterative_chat_utt(maze, init_persona, target_persona, retr
   prompt = generate_prompt(prompt_input, prompt_template)
   print (prompt)
   fail_safe = get_fail_safe() 
+  # The prompt asks for a json with the utterance under the persona's name 
+  # and whether it ended the conversation. 
+  utterance_key = init_persona.scratch.name
+  end_key = f"Did the conversation end with {init_persona.scratch.name}'s utterance?"
+  structured_output = StructuredOutput(
+    {"type": "object", 
+     "properties": {utterance_key: {"type": "string"}, 
+                    end_key: {"type": "boolean"}}, 
+     "required": [utterance_key, end_key]}, 
+    lambda response: json.dumps({utterance_key: response[utterance_key], 
+                                 end_key: response[end_key]}))
   output = ChatGPT_safe_generate_response_OLD(prompt, 3, fail_safe,
-                        __chat_func_validate, __chat_func_clean_up, verbose)
+                        __chat_func_validate, __chat_func_clean_up, verbose,
+                        structured_output,
+                        prompt_type=prompt_template,
+                        persona_name=init_persona.name)
   print (output)
   
   gpt_param = {"engine": "text-davinci-003", "max_tokens": 50, 
@@ -0,0 +1,124 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: template_registry.py
+Description: Defines the registry of the prompt templates (the .txt files in
+v1, v2, v3_ChatGPT, and safety). Every template is read and compiled once,
+when the registry is loaded, into the literal text between its
+!<INPUT n>! slots, so that generate_prompt() only has to join the pieces
+with the prompt inputs.
+"""
+import os
+import re
+import threading
+
+# <template_sets> are the folders of prompt templates that we load at
+# startup.
+template_sets = ["v1", "v2", "v3_ChatGPT", "safety"]
+comment_block_marker = "<commentblockmarker>###</commentblockmarker>"
+input_slot_pattern = re.compile(r"!<INPUT (\d+)>!")
+
+
+class PromptTemplate:
+  def __init__(self, template_file, template_str):
+    self.template_file = template_file
+
+    # The part of the template above the comment block marker describes the
+    # template (its inputs and so on) and is not part of the prompt.
+    if comment_block_marker in template_str:
+      template_str = template_str.split(comment_block_marker)[1]
+
+    # <parts> alternates between the literal text and the input slots, e.g.
+    # ["Name: ", 0, "\nAge: ", 1, ""]; it always starts and ends with text.
+    self.parts = input_slot_pattern.split(template_str)
+    for count in range(1, len(self.parts), 2):
+      self.parts[count] = int(self.parts[count])
+
+
+  def fill(self, curr_input):
+    """
+    Returns the prompt with the inputs in their slots. A slot that has no
+    input is left as it is.
+
+    INPUT
+      curr_input: A list of the input strings.
+    OUTPUT
+      The prompt string.
+    """
+    prompt = list(self.parts)
+    for count in range(1, len(prompt), 2):
+      if prompt[count] < len(curr_input):
+        prompt[count] = curr_input[prompt[count]]
+      else:
+        prompt[count] = f"!<INPUT {prompt[count]}>!"
+    return "".join(prompt).strip()
+
+
+class TemplateRegistry:
+  def __init__(self, template_folder):
+    self.template_folder = template_folder
+    # <templates> maps a template key (see get_template_key()) to its
+    # PromptTemplate.
+    self.templates = dict()
+    self.lock = threading.Lock()
+    self.load()
+
+
+  def load(self):
+    """
+    (Re)loads all templates of the <template_sets>.
+    """
+    templates = dict()
+    for template_set in template_sets:
+      set_folder = f"{self.template_folder}/{template_set}"
+      if not os.path.isdir(set_folder):
+        continue
+      for file_name in sorted(os.listdir(set_folder)):
+        if file_name.endswith(".txt"):
+          template_file = f"{set_folder}/{file_name}"
+          templates[self.get_template_key(template_file)] = (
+            self.compile_template(template_file))
+    with self.lock:
+      self.templates = templates
+
+
+  def get_template_key(self, template_file):
+    """
+    Returns the key of a template file. The run_gpt_prompt functions name
+    the templates relative to the backend server folder (e.g.,
+    "persona/prompt_template/v2/wake_up_hour_v1.txt"), so we key the
+    templates in this folder by their path below it ("v2/wake_up_hour_v1.txt")
+    and do not depend on the working directory.
+    """
+    template_file = os.path.normpath(template_file).replace(os.sep, "/")
+    if "prompt_template/" in template_file:
+      return template_file.split("prompt_template/")[-1]
+    return os.path.abspath(template_file)
+
+
+  def compile_template(self, template_file):
+    with open(template_file, "r") as f:
+      return PromptTemplate(template_file, f.read())
+
+
+  def get(self, template_file):
+    """
+    Returns the PromptTemplate of a template file. A template that is not in
+    the template sets is compiled the first time it is asked for.
+
+    INPUT
+      template_file: The path of the template.
+        e.g., "persona/prompt_template/v2/wake_up_hour_v1.txt"
+    OUTPUT
+      A PromptTemplate instance.
+    """
+    key = self.get_template_key(template_file)
+    template = self.templates.get(key)
+    if template is None:
+      template = self.compile_template(template_file)
+      with self.lock:
+        self.templates[key] = template
+    return template
+
+
+template_registry = TemplateRegistry(os.path.dirname(os.path.abspath(__file__)))
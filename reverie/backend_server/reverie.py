@@ -28,12 +28,14 @@ import os
 import shutil
 import traceback
 
-from selenium import webdriver
-
 from global_methods import *
 from utils import *
+from annotation_cache import *
 from maze import *
 from persona.persona import *
+from step_executor import *
+from step_channel import *
+from step_log import *
 
 ##############################################################################
 #                                  REVERIE                                   #
@@ -42,7 +44,9 @@ from persona.persona import *
 class ReverieServer: 
   def __init__(self, 
                fork_sim_code,
-               sim_code):
+               sim_code, 
+               fork_mode="link",
+               log_steps=True):
     # FORKING FROM A PRIOR SIMULATION:
     # <fork_sim_code> indicates the simulation we are forking from. 
     # Interestingly, all simulations must be forked from some initial 
@@ -53,9 +57,33 @@ class ReverieServer:
     # <sim_code> indicates our current simulation. The first step here is to 
     # copy everything that's in <fork_sim_code>, but edit its 
     # reverie/meta/json's fork variable. 
+    # <fork_mode> decides how we copy. With "copy", we copy everything. With
+    # "link" (the default), the history of the fork is hard linked instead:
+    # the segments of its step logs and the environment and movement files 
+    # of the steps before its current step. These are never written again, 
+    # neither by the fork nor by us, so the two simulations can share them.
+    # The step log indices, the persona memories, and the rest are still 
+    # copied, since we append to or rewrite them. 
     self.sim_code = sim_code
     sim_folder = f"{fs_storage}/{self.sim_code}"
-    copyanything(fork_folder, sim_folder)
+    if fork_mode == "link": 
+      with open(f"{fork_folder}/reverie/meta.json") as json_file:  
+        fork_step = json.load(json_file)["step"]
+
+      def is_history_file(src_file): 
+        folder, file_name = os.path.split(src_file)
+        step, ext = os.path.splitext(file_name)
+        if os.path.dirname(folder) != fork_folder: 
+          return False
+        if os.path.basename(folder) in ["environment_log", "movement_log"]: 
+          return file_name.startswith("segment_")
+        return (os.path.basename(folder) in ["environment", "movement"]
+                and ext == ".json" and step.isdigit() 
+                and int(step) < fork_step)
+
+      linkanything(fork_folder, sim_folder, is_history_file)
+    else: 
+      copyanything(fork_folder, sim_folder)
 
     with open(f"{sim_folder}/reverie/meta.json") as json_file:  
       reverie_meta = json.load(json_file)
@@ -105,6 +133,12 @@ class ReverieServer:
     # The tile take the form of a set, (row, col). 
     # e.g., ["Isabella Rodriguez"] = (58, 39)
     self.personas_tile = dict()
+    # <personas_next_tile> is a dictionary that contains the tile each 
+    # persona moves to in the current step, as decided in the last step. This
+    # is where the personas will be once the step is played out, which we use
+    # when running headless. 
+    # e.g., ["Isabella Rodriguez"] = (58, 40)
+    self.personas_next_tile = dict()
     
     # # <persona_convo_match> is a dictionary that describes which of the two
     # # personas are talking to each other. It takes a key of a persona's full
@@ -119,8 +153,7 @@ class ReverieServer:
     # self.persona_convo = dict()
 
     # Loading in all personas. 
-    init_env_file = f"{sim_folder}/environment/{str(self.step)}.json"
-    init_env = json.load(open(init_env_file))
+    init_env = read_step(sim_folder, "environment", self.step)
     for persona_name in reverie_meta['persona_names']: 
       persona_folder = f"{sim_folder}/personas/{persona_name}"
       p_x = init_env[persona_name]["x"]
@@ -129,13 +162,52 @@ class ReverieServer:
 
       self.personas[persona_name] = curr_persona
       self.personas_tile[persona_name] = (p_x, p_y)
-      self.maze.tiles[p_y][p_x]["events"].add(curr_persona.scratch
-                                              .get_curr_event_and_desc())
+      self.personas_next_tile[persona_name] = (p_x, p_y)
+      self.maze.add_event_from_tile(curr_persona.scratch
+                                    .get_curr_event_and_desc(), (p_x, p_y))
+
+    # The action annotations that the personas have generated so far (see 
+    # annotation_cache.py). 
+    if persist_annotation_cache: 
+      annotation_cache.load(get_annotation_cache_file(sim_folder))
 
     # REVERIE SETTINGS PARAMETERS:  
     # <server_sleep> denotes the amount of time that our while loop rests each
     # cycle; this is to not kill our machine. 
     self.server_sleep = 0.1
+    # <step_executor> runs the personas' cognitive sequence in each step. 
+    # Its <workers> denotes the number of personas that may be moved 
+    # concurrently (personas that can interact are always moved one after 
+    # another). The default of 1 moves every persona in turn. 
+    self.step_executor = StepExecutor(reverie_meta.get("step_workers", 1))
+    # <log_steps> denotes whether we log the environment and the movements 
+    # of each step to <env_log> and <move_log> (the environment_log and 
+    # movement_log folders of the simulation). The steps are handed between
+    # the frontend and the backend through <step_channel>, so the logs are 
+    # the record of the simulation. Note that replaying, compressing, and 
+    # forking a simulation read them, so only turn this off for throwaway 
+    # runs (see also the "set log steps" command). 
+    self.log_steps = log_steps
+    self.env_log = get_step_log(sim_folder, "environment")
+    self.move_log = get_step_log(sim_folder, "movement")
+    # <env_latest_step> and <env_step_count> are the last step and the number
+    # of steps that have an environment record. We keep them (along with the
+    # persona names) in the manifest of the simulation, so the frontend does
+    # not need to list the steps to open it. 
+    env_steps = get_steps(sim_folder, "environment")
+    self.env_latest_step = env_steps[-1] if env_steps else None
+    self.env_step_count = len(env_steps)
+    self.update_manifest()
+
+    # <step_channel> is the local socket channel through which the frontend
+    # sends us the environment of each step and receives the movements. If
+    # it cannot be opened, we fall back to polling the step files. 
+    try: 
+      self.step_channel = StepChannel(self.sim_code)
+    except: 
+      traceback.print_exc()
+      print ("Could not open the step channel; polling the step files.")
+      self.step_channel = None
 
     # SIGNALING THE FRONTEND SERVER: 
     # curr_sim_code.json contains the current simulation code, and
@@ -177,15 +249,84 @@ class ReverieServer:
     reverie_meta["maze_name"] = self.maze.maze_name
     reverie_meta["persona_names"] = list(self.personas.keys())
     reverie_meta["step"] = self.step
+    reverie_meta["step_workers"] = self.step_executor.workers
     reverie_meta_f = f"{sim_folder}/reverie/meta.json"
     with open(reverie_meta_f, "w") as outfile: 
       outfile.write(json.dumps(reverie_meta, indent=2))
 
+    # A simulation that is forked from this one starts from the environment 
+    # of the current step. If the frontend has not sent it yet (or we are 
+    # running headless), we log it ourselves. 
+    if read_step(sim_folder, "environment", self.step) is None: 
+      self.log_environment(self.step, self.get_headless_environment())
+    self.update_manifest()
+
     # Save the personas.
     for persona_name, persona in self.personas.items(): 
       save_folder = f"{sim_folder}/personas/{persona_name}/bootstrap_memory"
       persona.save(save_folder)
 
+    # Save the action annotations. 
+    if persist_annotation_cache: 
+      annotation_cache.save(get_annotation_cache_file(sim_folder))
+
+    # Save the LLM metrics of this run (see print_llm_report()). 
+    export_llm_report(f"{sim_folder}/reverie/llm_metrics.json")
+
+
+  def get_headless_environment(self): 
+    """
+    Returns the environment of the current step as the frontend would send 
+    it after playing out the last step's movements, i.e., with each persona
+    at its <personas_next_tile>. 
+
+    INPUT
+      None
+    OUTPUT 
+      The environment dictionary. 
+    EXAMPLE OUTPUT 
+      {"Isabella Rodriguez": {"maze": "the_ville", "x": 72, "y": 14}, ...}
+    """
+    new_env = dict()
+    for persona_name, tile in self.personas_next_tile.items(): 
+      new_env[persona_name] = {"maze": self.maze.maze_name, 
+                               "x": tile[0], 
+                               "y": tile[1]}
+    return new_env
+
+
+  def log_environment(self, step, env): 
+    """
+    Appends the environment of a step to <env_log> and updates the manifest
+    of the simulation. 
+
+    INPUT
+      step: The step of the environment. 
+      env: The environment dictionary. 
+    OUTPUT 
+      None
+    """
+    self.env_log.append(step, env)
+    if self.env_latest_step is None or step > self.env_latest_step: 
+      self.env_latest_step = step
+      self.env_step_count += 1
+      self.update_manifest()
+
+
+  def update_manifest(self): 
+    """
+    Writes the manifest of the simulation (see write_manifest() in 
+    step_log.py) with the current latest step, step count, and personas. 
+
+    INPUT
+      None
+    OUTPUT 
+      None
+    """
+    sim_folder = f"{fs_storage}/{self.sim_code}"
+    write_manifest(sim_folder, self.env_latest_step, self.env_step_count, 
+                   list(self.personas.keys()))
+
 
   def start_path_tester_server(self): 
     """
@@ -276,7 +417,7 @@ class ReverieServer:
       time.sleep(self.server_sleep * 10)
 
 
-  def start_server(self, int_counter): 
+  def start_server(self, int_counter, headless=False): 
     """
     The main backend server of Reverie. 
     This function retrieves the environment file from the frontend to 
@@ -286,6 +427,10 @@ class ReverieServer:
     INPUT
       int_counter: Integer value for the number of steps left for us to take
                    in this iteration. 
+      headless: If True, we do not wait for the frontend. Instead, each 
+                persona arrives at the next tile it chose in the previous 
+                step (which is what the frontend does when it plays the 
+                movement), and we go on to the next step right away. 
     OUTPUT 
       None
     """
@@ -308,108 +453,117 @@ class ReverieServer:
       if int_counter == 0: 
         break
 
-      # <curr_env_file> file is the file that our frontend outputs. When the
-      # frontend has done its job and moved the personas, then it will put a 
-      # new environment file that matches our step count. That's when we run 
-      # the content of this for loop. Otherwise, we just wait. 
+      # When the frontend has done its job and moved the personas, it sends
+      # us the new environment that matches our step count. That's when we 
+      # run the content of this loop. Otherwise, we just wait. The 
+      # environment comes through <step_channel>, which wakes us up as soon 
+      # as it arrives; if the channel is not available, we fall back to 
+      # polling the <curr_env_file> that the frontend then outputs. 
+      new_env = None
       curr_env_file = f"{sim_folder}/environment/{self.step}.json"
-      if check_if_file_exists(curr_env_file):
-        # If we have an environment file, it means we have a new perception
-        # input to our personas. So we first retrieve it.
+      if headless: 
+        # When running headless, we play out the last step's movements 
+        # ourselves instead of waiting for the frontend. 
+        new_env = self.get_headless_environment()
+
+      elif self.step_channel: 
+        new_env = self.step_channel.wait_environment(self.step, 
+                                                     self.server_sleep)
+
+      if new_env is None and check_if_file_exists(curr_env_file):
         try: 
           # Try and save block for robustness of the while loop.
           with open(curr_env_file) as json_file:
             new_env = json.load(json_file)
-            env_retrieved = True
+          # Once it is in the log, we no longer need the file. 
+          if self.log_steps: 
+            os.remove(curr_env_file)
         except: 
           pass
-      
-        if env_retrieved: 
-          # This is where we go through <game_obj_cleanup> to clean up all 
-          # object actions that were used in this cylce. 
-          for key, val in game_obj_cleanup.items(): 
-            # We turn all object actions to their blank form (with None). 
-            self.maze.turn_event_from_tile_idle(key, val)
-          # Then we initialize game_obj_cleanup for this cycle. 
-          game_obj_cleanup = dict()
-
-          # We first move our personas in the backend environment to match 
-          # the frontend environment. 
-          for persona_name, persona in self.personas.items(): 
-            # <curr_tile> is the tile that the persona was at previously. 
-            curr_tile = self.personas_tile[persona_name]
-            # <new_tile> is the tile that the persona will move to right now,
-            # during this cycle. 
-            new_tile = (new_env[persona_name]["x"], 
-                        new_env[persona_name]["y"])
-
-            # We actually move the persona on the backend tile map here. 
-            self.personas_tile[persona_name] = new_tile
-            self.maze.remove_subject_events_from_tile(persona.name, curr_tile)
+
+      if new_env is not None: 
+        if self.log_steps: 
+          self.log_environment(self.step, new_env)
+
+        # This is where we go through <game_obj_cleanup> to clean up all 
+        # object actions that were used in this cylce. 
+        for key, val in game_obj_cleanup.items(): 
+          # We turn all object actions to their blank form (with None). 
+          self.maze.turn_event_from_tile_idle(key, val)
+        # Then we initialize game_obj_cleanup for this cycle. 
+        game_obj_cleanup = dict()
+
+        # We first move our personas in the backend environment to match 
+        # the frontend environment. 
+        for persona_name, persona in self.personas.items(): 
+          # <curr_tile> is the tile that the persona was at previously. 
+          curr_tile = self.personas_tile[persona_name]
+          # <new_tile> is the tile that the persona will move to right now,
+          # during this cycle. 
+          new_tile = (new_env[persona_name]["x"], 
+                      new_env[persona_name]["y"])
+
+          # We actually move the persona on the backend tile map here. 
+          self.personas_tile[persona_name] = new_tile
+          self.maze.remove_subject_events_from_tile(persona.name, curr_tile)
+          self.maze.add_event_from_tile(persona.scratch
+                                       .get_curr_event_and_desc(), new_tile)
+
+          # Now, the persona will travel to get to their destination. *Once*
+          # the persona gets there, we activate the object action.
+          if not persona.scratch.planned_path: 
+            # We add that new object action event to the backend tile map. 
+            # At its creation, it is stored in the persona's backend. 
+            game_obj_cleanup[persona.scratch
+                             .get_curr_obj_event_and_desc()] = new_tile
             self.maze.add_event_from_tile(persona.scratch
-                                         .get_curr_event_and_desc(), new_tile)
-
-            # Now, the persona will travel to get to their destination. *Once*
-            # the persona gets there, we activate the object action.
-            if not persona.scratch.planned_path: 
-              # We add that new object action event to the backend tile map. 
-              # At its creation, it is stored in the persona's backend. 
-              game_obj_cleanup[persona.scratch
-                               .get_curr_obj_event_and_desc()] = new_tile
-              self.maze.add_event_from_tile(persona.scratch
-                                     .get_curr_obj_event_and_desc(), new_tile)
-              # We also need to remove the temporary blank action for the 
-              # object that is currently taking the action. 
-              blank = (persona.scratch.get_curr_obj_event_and_desc()[0], 
-                       None, None, None)
-              self.maze.remove_event_from_tile(blank, new_tile)
-
-          # Then we need to actually have each of the personas perceive and
-          # move. The movement for each of the personas comes in the form of
-          # x y coordinates where the persona will move towards. e.g., (50, 34)
-          # This is where the core brains of the personas are invoked. 
-          movements = {"persona": dict(), 
-                       "meta": dict()}
-          for persona_name, persona in self.personas.items(): 
-            # <next_tile> is a x,y coordinate. e.g., (58, 9)
-            # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
-            # <description> is a string description of the movement. e.g., 
-            #   writing her next novel (editing her novel) 
-            #   @ double studio:double studio:common room:sofa
-            next_tile, pronunciatio, description = persona.move(
-              self.maze, self.personas, self.personas_tile[persona_name], 
-              self.curr_time)
-            movements["persona"][persona_name] = {}
-            movements["persona"][persona_name]["movement"] = next_tile
-            movements["persona"][persona_name]["pronunciatio"] = pronunciatio
-            movements["persona"][persona_name]["description"] = description
-            movements["persona"][persona_name]["chat"] = (persona
-                                                          .scratch.chat)
-
-          # Include the meta information about the current stage in the 
-          # movements dictionary. 
-          movements["meta"]["curr_time"] = (self.curr_time 
-                                             .strftime("%B %d, %Y, %H:%M:%S"))
-
-          # We then write the personas' movements to a file that will be sent 
-          # to the frontend server. 
-          # Example json output: 
-          # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
-          #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
-          #  "meta": {curr_time: <datetime>}}
-          curr_move_file = f"{sim_folder}/movement/{self.step}.json"
-          with open(curr_move_file, "w") as outfile: 
-            outfile.write(json.dumps(movements, indent=2))
-
-          # After this cycle, the world takes one step forward, and the 
-          # current time moves by <sec_per_step> amount. 
-          self.step += 1
-          self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
-
-          int_counter -= 1
-          
-      # Sleep so we don't burn our machines. 
-      time.sleep(self.server_sleep)
+                                   .get_curr_obj_event_and_desc(), new_tile)
+            # We also need to remove the temporary blank action for the 
+            # object that is currently taking the action. 
+            blank = (persona.scratch.get_curr_obj_event_and_desc()[0], 
+                     None, None, None)
+            self.maze.remove_event_from_tile(blank, new_tile)
+
+        # Then we need to actually have each of the personas perceive and
+        # move. The movement for each of the personas comes in the form of
+        # x y coordinates where the persona will move towards. e.g., (50, 34)
+        # This is where the core brains of the personas are invoked. 
+        movements = {"persona": dict(), 
+                     "meta": dict()}
+        movements["persona"] = self.step_executor.move_personas(
+          self.maze, self.personas, self.personas_tile, self.curr_time)
+
+        # Include the meta information about the current stage in the 
+        # movements dictionary. 
+        movements["meta"]["curr_time"] = (self.curr_time 
+                                           .strftime("%B %d, %Y, %H:%M:%S"))
+
+        # We then send the personas' movements to the frontend server. 
+        # Example json output: 
+        # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
+        #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
+        #  "meta": {curr_time: <datetime>}}
+        # The movements are handed to the frontend through <step_channel>, 
+        # and also appended to <move_log> (which is where the frontend reads
+        # them from when the channel is not available). 
+        if self.log_steps or not self.step_channel: 
+          self.move_log.append(self.step, movements)
+        if self.step_channel: 
+          self.step_channel.put_movement(self.step, movements)
+        for persona_name, persona_move in movements["persona"].items(): 
+          self.personas_next_tile[persona_name] = tuple(
+                                                  persona_move["movement"])
+
+        # After this cycle, the world takes one step forward, and the 
+        # current time moves by <sec_per_step> amount. 
+        self.step += 1
+        self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
+
+        int_counter -= 1
+
+      elif not self.step_channel: 
+        # Sleep so we don't burn our machines. 
+        time.sleep(self.server_sleep)
 
 
   def open_server(self): 
@@ -440,6 +594,11 @@ class ReverieServer:
           # Finishes the simulation environment and saves the progress. 
           # Example: fin
           self.save()
+          print_llm_report()
+          if self.step_channel: 
+            self.step_channel.close()
+          self.env_log.close()
+          self.move_log.close()
           break
 
         elif sim_command.lower() == "start path tester mode": 
@@ -453,7 +612,11 @@ class ReverieServer:
           # Finishes the simulation environment but does not save the progress
           # and erases all saved data from current simulation. 
           # Example: exit 
+          self.env_log.close()
+          self.move_log.close()
           shutil.rmtree(sim_folder) 
+          if self.step_channel: 
+            self.step_channel.close()
           break 
 
         elif sim_command.lower() == "save": 
@@ -461,13 +624,45 @@ class ReverieServer:
           # Example: save
           self.save()
 
+        elif sim_command[:12].lower() == "run headless": 
+          # Runs the number of steps specified in the prompt without the 
+          # frontend server. 
+          # Example: run headless 1000
+          int_count = int(sim_command.split()[-1])
+          self.start_server(int_count, headless=True)
+
         elif sim_command[:3].lower() == "run": 
           # Runs the number of steps specified in the prompt.
           # Example: run 1000
           int_count = int(sim_command.split()[-1])
           rs.start_server(int_count)
 
-        elif ("print persona schedule" 
+        elif sim_command[:11].lower() == "set workers": 
+          # Sets the number of personas that may be moved concurrently in 
+          # each step. 
+          # Example: set workers 8
+          self.step_executor.shutdown()
+          self.step_executor.workers = int(sim_command.split()[-1])
+
+        elif sim_command[:13].lower() == "set log steps": 
+          # Turns the logging of the environment and the movements of each 
+          # step on or off (see <log_steps>). 
+          # Example: set log steps off
+          self.log_steps = sim_command.split()[-1].lower() != "off"
+
+        elif sim_command.lower() == "print prompt stats":
+          # Prints, for each prompt type, the number of calls, generation
+          # attempts, validated responses, and fail safes so far.
+          # Example: print prompt stats
+          print_prompt_stats()
+
+        elif sim_command.lower() == "print llm report": 
+          # Prints, for each prompt type, the LLM requests, tokens, and time
+          # along with the calls, retries, and fail safes so far. 
+          # Example: print llm report
+          print_llm_report()
+
+        elif ("print persona schedule"
               in sim_command[:22].lower()): 
           # Print the decomposed schedule of the persona specified in the 
           # prompt.
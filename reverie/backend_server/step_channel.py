@@ -0,0 +1,177 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: step_channel.py
+Description: Defines the StepChannel class, a local socket channel that hands
+the environment of each step from the frontend server to the backend, and the
+personas' movements back to the frontend. This replaces the file polling of
+environment/{step}.json and movement/{step}.json; the backend wakes up as
+soon as a new environment arrives, and the frontend's update request waits
+for the movement instead of re-checking for the file.
+
+The channel is a multiprocessing.connection listener on localhost. Its
+address and authkey are written to <fs_temp_storage>/step_channel.json so the
+frontend can find it. Every request is a dictionary with a "type" and the
+"sim_code" it is meant for:
+  {"type": "environment", "sim_code": ..., "step": 12, "environment": {...}}
+    -> True once the backend has the environment (False if rejected)
+  {"type": "movement", "sim_code": ..., "step": 12, "timeout": 10}
+    -> the movement dictionary of the step, or None if it did not arrive
+       within the timeout
+"""
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+
+from global_methods import *
+from utils import *
+
+# The seconds to wait before accepting again after a failed accept.
+accept_retry_sec = 1
+
+
+class StepChannel:
+  def __init__(self, sim_code):
+    self.sim_code = sim_code
+
+    # <environments> and <movements> map a step to the environment received
+    # from the frontend and to the movement computed by the backend.
+    # <cond> is notified whenever either of them changes.
+    self.environments = dict()
+    self.movements = dict()
+    self.cond = threading.Condition()
+
+    authkey = os.urandom(16)
+    self.listener = Listener(("localhost", 0), authkey=authkey)
+    self.closed = False
+
+    self.info_file = f"{fs_temp_storage}/step_channel.json"
+    channel_info = dict()
+    channel_info["sim_code"] = self.sim_code
+    channel_info["address"] = list(self.listener.address)
+    channel_info["authkey"] = authkey.hex()
+    with open(self.info_file, "w") as outfile:
+      outfile.write(json.dumps(channel_info, indent=2))
+
+    self.accept_thread = threading.Thread(target=self._accept_loop,
+                                          daemon=True)
+    self.accept_thread.start()
+
+
+  def _accept_loop(self):
+    while not self.closed:
+      try:
+        conn = self.listener.accept()
+      except AuthenticationError:
+        print ("Step channel: a client failed the authentication.")
+        continue
+      except Exception:
+        if self.closed:
+          return
+        # Not the closed listener; wait a bit so that an error that keeps
+        # coming back does not spin.
+        traceback.print_exc()
+        time.sleep(accept_retry_sec)
+        continue
+      thread = threading.Thread(target=self._serve, args=(conn,),
+                                daemon=True)
+      thread.start()
+
+
+  def _serve(self, conn):
+    try:
+      with conn:
+        while True:
+          try:
+            request = conn.recv()
+          except EOFError:
+            return
+          conn.send(self._handle(request))
+    except Exception:
+      traceback.print_exc()
+
+
+  def _handle(self, request):
+    if request.get("sim_code") != self.sim_code:
+      if request["type"] == "environment":
+        return False
+      return None
+
+    step = int(request["step"])
+    if request["type"] == "environment":
+      with self.cond:
+        self.environments[step] = request["environment"]
+        self.cond.notify_all()
+      return True
+
+    elif request["type"] == "movement":
+      with self.cond:
+        self.cond.wait_for(lambda: step in self.movements or self.closed,
+                           timeout=request.get("timeout", 0))
+        return self.movements.get(step)
+
+
+  def wait_environment(self, step, timeout):
+    """
+    Waits for the environment of the step to arrive from the frontend.
+
+    INPUT
+      step: The step whose environment we want.
+      timeout: The maximum number of seconds to wait.
+    OUTPUT
+      The environment dictionary of the step, or None if it did not arrive
+      within the timeout.
+    """
+    with self.cond:
+      self.cond.wait_for(lambda: step in self.environments or self.closed,
+                         timeout=timeout)
+      new_env = self.environments.pop(step, None)
+      if new_env is not None:
+        # Environments of the earlier steps will never be asked for.
+        for old_step in [i for i in self.environments if i < step]:
+          del self.environments[old_step]
+      return new_env
+
+
+  def put_movement(self, step, movement):
+    """
+    Hands the movement of the step to the frontend. We only keep the movement
+    of the latest step, since the frontend never asks for an older one.
+
+    INPUT
+      step: The step of the movement.
+      movement: The movement dictionary of the step.
+    OUTPUT
+      None
+    """
+    with self.cond:
+      self.movements = {step: movement}
+      self.cond.notify_all()
+
+
+  def close(self):
+    """
+    Closes the channel and removes its info file, so the frontend falls back
+    to the step files.
+    """
+    with self.cond:
+      if self.closed:
+        return
+      self.closed = True
+      self.cond.notify_all()
+    # Closing the listener does not wake up an accept() that is blocked on
+    # it, so we connect once (and hang up) to let the accept loop return.
+    try:
+      with socket.create_connection(self.listener.address, timeout=1):
+        pass
+    except OSError:
+      pass
+    self.listener.close()
+    if check_if_file_exists(self.info_file):
+      os.remove(self.info_file)
@@ -0,0 +1,157 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: step_executor.py
+Description: Defines the StepExecutor class that runs the cognitive sequence
+(perceive, retrieve, plan, reflect, execute) of the personas in a Reverie
+step. Most of a persona's move is spent waiting on LLM calls, so personas
+that cannot affect one another in this step are moved concurrently on a
+thread pool, while personas that can interact are moved one after another in
+the usual persona order.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class StepExecutor:
+  def __init__(self, workers=1):
+    # <workers> is the number of threads that move personas concurrently.
+    # With a single worker, the personas are moved one after another exactly
+    # as in the original Reverie loop.
+    self.workers = workers
+    self.pool = None
+
+
+  def group_personas(self, maze, personas, personas_tile):
+    """
+    Splits the personas into groups that can be moved independently of each
+    other in the current step.
+
+    During a move, a persona only reads another persona's state when it
+    perceives that persona's event (the other persona stands within its
+    vision window, in the same arena) or when it is chatting with (or
+    walking to) that persona. Such personas are put into the same group, and
+    the grouping is transitive. The maze is not modified while the personas
+    move, so this is all we need to look at.
+
+    INPUT
+      maze: The Maze class of the current world.
+      personas: A dictionary that contains all persona names as keys, and the
+                Persona instance as values.
+      personas_tile: A dictionary that contains all persona names as keys,
+                     and their current (x, y) tile as values.
+    OUTPUT
+      A list of groups, where each group is a list of persona names in the
+      order of <personas>. The groups are ordered by their first persona.
+    EXAMPLE OUTPUT
+      [["Isabella Rodriguez", "Klaus Mueller"], ["Maria Lopez"]]
+    """
+    names = list(personas.keys())
+    parent = {name: name for name in names}
+
+    def find(name):
+      while parent[name] != name:
+        parent[name] = parent[parent[name]]
+        name = parent[name]
+      return name
+
+    def union(a, b):
+      a, b = find(a), find(b)
+      if a != b:
+        parent[b] = a
+
+    for name in names:
+      scratch = personas[name].scratch
+      tile = personas_tile[name]
+      left_end, right_end, top_end, bottom_end = maze.get_vision_window(
+                                                     tile, scratch.vision_r)
+      curr_arena_id = maze.arena_id_maze[tile[1]][tile[0]]
+      for other_name in names:
+        if other_name == name:
+          continue
+        x, y = personas_tile[other_name]
+        if (left_end <= x < right_end and top_end <= y < bottom_end
+            and maze.arena_id_maze[y][x] == curr_arena_id):
+          union(name, other_name)
+
+      if scratch.chatting_with in parent:
+        union(name, scratch.chatting_with)
+      if scratch.act_address and "<persona>" in scratch.act_address:
+        target_name = scratch.act_address.split("<persona>")[-1].strip()
+        if target_name in parent:
+          union(name, target_name)
+
+    groups = dict()
+    for name in names:
+      groups.setdefault(find(name), []).append(name)
+    return list(groups.values())
+
+
+  def move_personas(self, maze, personas, personas_tile, curr_time):
+    """
+    Moves all personas for the current step.
+
+    INPUT
+      maze: The Maze class of the current world.
+      personas: A dictionary that contains all persona names as keys, and the
+                Persona instance as values.
+      personas_tile: A dictionary that contains all persona names as keys,
+                     and their current (x, y) tile as values.
+      curr_time: datetime instance that indicates the game's current time.
+    OUTPUT
+      A dictionary that contains all persona names as keys (in the order of
+      <personas>), and their movement as values. The persona's chat is 
+      recorded right after its own move, as a later persona in the same group
+      may start a new chat with it. 
+    EXAMPLE OUTPUT
+      {"Maria Lopez": {"movement": (58, 9), 
+                       "pronunciatio": "\ud83d\udca4",
+                       "description": "sleeping @ ...:bed", 
+                       "chat": None}, ...}
+    """
+    def move_group(group):
+      ret = dict()
+      for name in group:
+        # <next_tile> is a x,y coordinate. e.g., (58, 9)
+        # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
+        # <description> is a string description of the movement. e.g., 
+        #   writing her next novel (editing her novel) 
+        #   @ double studio:double studio:common room:sofa
+        next_tile, pronunciatio, description = personas[name].move(
+          maze, personas, personas_tile[name], curr_time)
+        ret[name] = {}
+        ret[name]["movement"] = next_tile
+        ret[name]["pronunciatio"] = pronunciatio
+        ret[name]["description"] = description
+        ret[name]["chat"] = personas[name].scratch.chat
+      return ret
+
+    if self.workers <= 1 or len(personas) <= 1:
+      return move_group(list(personas.keys()))
+
+    if self.pool is None:
+      self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    # Note that personas in different groups share the random module, so the
+    # random choices (e.g., the target tile picked in execute) are only 
+    # reproducible across runs with a single worker. 
+    groups = self.group_personas(maze, personas, personas_tile)
+    futures = [self.pool.submit(move_group, group) for group in groups]
+
+    # We wait for every group before collecting the results so that an 
+    # exception in one group does not leave the others running into the next
+    # step. 
+    wait(futures)
+    results = dict()
+    for future in futures:
+      results.update(future.result())
+
+    return {name: results[name] for name in personas}
+
+
+  def shutdown(self):
+    """
+    Shuts down the thread pool (if any). It is created again on demand. 
+    """
+    if self.pool is not None:
+      self.pool.shutdown()
+      self.pool = None
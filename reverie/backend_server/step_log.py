@@ -0,0 +1,297 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: step_log.py
+Description: Defines the StepLog class, a compact log of per-step records
+(the environment and the movements of each step of a simulation). Instead of
+writing one indented JSON file per step, the records are appended as single
+JSON lines to segment files, and an append-only index maps each step to its
+place in a segment so that any step can be read directly.
+
+A log is a folder (e.g., storage/<sim_code>/movement_log) that contains:
+  segment_<n>.jsonl -- the records. A writer always starts a new segment and
+                       rolls over to a new one every <segment_steps> steps,
+                       so a segment is never written again once a writer is
+                       done with it.
+  index.jsonl       -- one [step, segment, offset, length] line per record.
+                       If a step is written more than once, the last record
+                       wins.
+
+Simulations written before the log existed keep their step in
+<kind>/<step>.json files; read_step() and get_last_step() fall back to those.
+
+The backend also keeps a small manifest of the simulation in
+reverie/manifest.json (its latest environment step, the number of
+environment steps, and its persona names), so that the frontend can open a
+simulation without listing its steps. See write_manifest() and
+read_manifest().
+
+Note: the frontend server reads the logs with this module too (it adds this
+folder to its path), so it only depends on the standard library. Its views
+share the logs of get_step_log() across threads, so a StepLog guards its
+index with a lock.
+"""
+import bisect
+import json
+import os
+import threading
+
+
+class StepLog:
+  def __init__(self, log_folder, segment_steps=1000):
+    self.log_folder = log_folder
+    self.segment_steps = segment_steps
+    self.index_file = f"{log_folder}/index.jsonl"
+
+    # <index> maps a step to its (segment, offset, length). <index_offset> is
+    # how far into the index file we have read. <sorted_steps> is the sorted
+    # list of the steps in <index>; the steps mostly come in order, so we
+    # keep it up to date as we go instead of sorting the index each time.
+    self.index = dict()
+    self.index_offset = 0
+    self.sorted_steps = []
+    self.lock = threading.Lock()
+
+    # The segment we are currently appending to (if we are writing).
+    self.segment = None
+    self.segment_file = None
+    self.segment_count = 0
+
+
+  def refresh(self):
+    """
+    Reads the index entries that were appended since we last looked. Another
+    process may be writing the log, so we stop at the last complete line.
+    """
+    with self.lock:
+      self._refresh()
+
+
+  def _refresh(self):
+    # The caller holds self.lock.
+    if not os.path.exists(self.index_file):
+      return
+    index_size = os.path.getsize(self.index_file)
+    if index_size == self.index_offset:
+      return
+    if index_size < self.index_offset:
+      # The log has been removed and written anew (e.g., a simulation that
+      # was exited and then created again under the same name).
+      self.index = dict()
+      self.index_offset = 0
+      self.sorted_steps = []
+    with open(self.index_file, "rb") as index_file:
+      index_file.seek(self.index_offset)
+      new_lines = index_file.read()
+    end = new_lines.rfind(b"\n") + 1
+    for line in new_lines[:end].splitlines():
+      step, segment, offset, length = json.loads(line)
+      self._add_to_index(step, (segment, offset, length))
+    self.index_offset += end
+
+
+  def _add_to_index(self, step, location):
+    # The caller holds self.lock.
+    if step not in self.index:
+      if not self.sorted_steps or step > self.sorted_steps[-1]:
+        self.sorted_steps += [step]
+      else:
+        bisect.insort(self.sorted_steps, step)
+    self.index[step] = location
+
+
+  def append(self, step, data):
+    """
+    Appends the record of a step to the log.
+
+    INPUT
+      step: The step of the record.
+      data: The JSON serializable record. e.g., the movements of the step.
+    OUTPUT
+      None
+    """
+    if self.segment_file is None or self.segment_count >= self.segment_steps:
+      self._open_new_segment()
+
+    record = (json.dumps(data) + "\n").encode("utf-8")
+    offset = self.segment_file.tell()
+    self.segment_file.write(record)
+    self.segment_file.flush()
+    self.segment_count += 1
+
+    # The record has to be in the segment before the index points at it.
+    entry = [step, self.segment, offset, len(record)]
+    with open(self.index_file, "ab") as index_file:
+      index_file.write((json.dumps(entry) + "\n").encode("utf-8"))
+    with self.lock:
+      self._add_to_index(step, (self.segment, offset, len(record)))
+
+
+  def _open_new_segment(self):
+    self.close()
+    if not os.path.exists(self.log_folder):
+      os.makedirs(self.log_folder)
+    self.refresh()
+
+    # We never append to an existing segment; it may be shared (hard linked)
+    # with the simulation we were forked from.
+    n = len([i for i in os.listdir(self.log_folder)
+             if i.startswith("segment_")])
+    while True:
+      self.segment = f"segment_{n}.jsonl"
+      try:
+        self.segment_file = open(f"{self.log_folder}/{self.segment}", "xb")
+        break
+      except FileExistsError:
+        n += 1
+    self.segment_count = 0
+
+
+  def read(self, step):
+    """
+    Returns the record of the step, or None if it is not in the log. We
+    refresh first, as the step may have been written again since we last
+    looked (e.g., by a simulation that was resumed from an earlier step).
+    """
+    with self.lock:
+      self._refresh()
+      location = self.index.get(step)
+    if location is None:
+      return None
+    segment, offset, length = location
+    with open(f"{self.log_folder}/{segment}", "rb") as segment_file:
+      segment_file.seek(offset)
+      return json.loads(segment_file.read(length))
+
+
+  def steps(self):
+    """
+    Returns the sorted list of all steps in the log.
+    """
+    with self.lock:
+      self._refresh()
+      return list(self.sorted_steps)
+
+
+  def last_step(self, until=None):
+    """
+    Returns the last step in the log (at or before <until>, if given), or
+    None if there is none.
+
+    EXAMPLE
+      last_step(2160) -> 2000, the keyframe to start a replay at step 2160
+      from.
+    """
+    with self.lock:
+      self._refresh()
+      end = len(self.sorted_steps)
+      if until is not None:
+        end = bisect.bisect_right(self.sorted_steps, until)
+      if end == 0:
+        return None
+      return self.sorted_steps[end - 1]
+
+
+  def close(self):
+    if self.segment_file is not None:
+      self.segment_file.close()
+      self.segment_file = None
+
+
+# <step_logs> keeps the logs we have opened for reading, so their index is
+# only read incrementally.
+step_logs = dict()
+step_logs_lock = threading.Lock()
+
+
+def get_step_log(sim_folder, kind):
+  """
+  Returns the StepLog of the simulation folder for the kind of record
+  ("environment" or "movement").
+  """
+  log_folder = f"{sim_folder}/{kind}_log"
+  with step_logs_lock:
+    if log_folder not in step_logs:
+      step_logs[log_folder] = StepLog(log_folder)
+    return step_logs[log_folder]
+
+
+def read_step(sim_folder, kind, step):
+  """
+  Returns the record of the step from the simulation's log, falling back to
+  the <kind>/<step>.json file. Returns None if neither has it.
+
+  EXAMPLE
+    read_step("storage/July1_the_ville", "movement", 12)
+  """
+  data = get_step_log(sim_folder, kind).read(step)
+  if data is None:
+    step_file = f"{sim_folder}/{kind}/{step}.json"
+    if os.path.exists(step_file):
+      with open(step_file) as json_file:
+        data = json.load(json_file)
+  return data
+
+
+def get_steps(sim_folder, kind):
+  """
+  Returns the sorted list of all steps that have a record, either in the log
+  or as a <kind>/<step>.json file.
+  """
+  steps = set(get_step_log(sim_folder, kind).steps())
+  step_folder = f"{sim_folder}/{kind}"
+  if os.path.exists(step_folder):
+    for file_name in os.listdir(step_folder):
+      step, ext = os.path.splitext(file_name)
+      if ext == ".json" and step.isdigit():
+        steps.add(int(step))
+  return sorted(steps)
+
+
+def get_last_step(sim_folder, kind):
+  """
+  Returns the last step that has a record, or None.
+  """
+  steps = get_steps(sim_folder, kind)
+  if not steps:
+    return None
+  return steps[-1]
+
+
+def write_manifest(sim_folder, latest_step, step_count, persona_names):
+  """
+  Writes the manifest of the simulation. The file is replaced in one go, so
+  a reader never sees a partial manifest.
+
+  INPUT
+    sim_folder: The simulation folder. e.g., "storage/July1_the_ville"
+    latest_step: The last step that has an environment record.
+    step_count: The number of steps that have an environment record.
+    persona_names: The list of the names of the simulation's personas.
+  OUTPUT
+    None
+  """
+  manifest = dict()
+  manifest["latest_step"] = latest_step
+  manifest["step_count"] = step_count
+  manifest["persona_names"] = persona_names
+  manifest_file = f"{sim_folder}/reverie/manifest.json"
+  with open(manifest_file + ".tmp", "w") as outfile:
+    outfile.write(json.dumps(manifest, indent=2))
+  os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def read_manifest(sim_folder):
+  """
+  Returns the manifest dictionary of the simulation, or None if it has none
+  (e.g., a simulation that the backend has not opened since the manifest
+  was added).
+  """
+  manifest_file = f"{sim_folder}/reverie/manifest.json"
+  if not os.path.exists(manifest_file):
+    return None
+  try:
+    with open(manifest_file) as json_file:
+      return json.load(json_file)
+  except (OSError, ValueError):
+    return None
@@ -6,14 +6,75 @@ Description: Compresses a simulation for replay demos.
 """
 import shutil
 import json
-from global_methods import *
+import os
+import sys
+sys.path.append('backend_server')
+
+from concurrent.futures import ProcessPoolExecutor
 
-def compress(sim_code):
+from global_methods import *
+from step_log import *
+
+# The fields of a persona's movement that we keep in the compressed storage.
+move_fields = ["movement", "pronunciatio", "description", "chat"]
+# Every <keyframe_steps> steps, we log the full movement of all personas to
+# the keyframe log, so a replay can start at any step without going through 
+# all the steps before it. 
+keyframe_steps = 1000
+
+
+def load_moves(sim_storage, steps): 
+  """
+  Loads the persona movements of the given steps. This is where the parsing
+  happens, so it runs in the worker processes of compress(). 
+
+  INPUT
+    sim_storage: The folder of the simulation. 
+    steps: The steps to load. 
+  OUTPUT
+    A list of {persona_name: {field: value}} dictionaries, one per step. 
+  """
+  moves = []
+  for step in steps: 
+    step_move = read_step(sim_storage, "movement", step)["persona"]
+    moves += [{p: {field: move[field] for field in move_fields} 
+               for p, move in step_move.items()}]
+  return moves
+
+
+def compress(sim_code, incremental=True, workers=None, chunk_steps=200):
+  """
+  Compresses the movements of a simulation into compressed_storage for the 
+  replay demos. master_movement.json maps each step to the personas whose 
+  movement changed at that step (every persona is listed at step 0). The 
+  same per-step changes are also logged to movement_log (a StepLog) for the
+  paginated replay, along with the full movements in keyframe_log every 
+  <keyframe_steps> steps. 
+
+  The movement records are parsed in parallel, <chunk_steps> steps at a time,
+  but only a few chunks are ever in flight and each step is written out as 
+  soon as we have it, so the memory use does not grow with the length of the
+  simulation. The output is compact: one "step": {...} line per step. 
+
+  We keep our progress in compress_state.json (the last step, the last 
+  movement of each persona, and where the closing brace of 
+  master_movement.json is). With <incremental>, a later call only compresses
+  the steps that were added since. 
+
+  INPUT
+    sim_code: The simulation to compress. 
+    incremental: Whether to continue from the last compression. 
+    workers: The number of processes that parse the records. 
+    chunk_steps: The number of steps that a process parses at a time. 
+  OUTPUT
+    None
+  """
   sim_storage = f"../environment/frontend_server/storage/{sim_code}"
   compressed_storage = f"../environment/frontend_server/compressed_storage/{sim_code}"
   persona_folder = sim_storage + "/personas"
-  move_folder = sim_storage + "/movement"
   meta_file = sim_storage + "/reverie/meta.json"
+  master_move_file = f"{compressed_storage}/master_movement.json"
+  state_file = f"{compressed_storage}/compress_state.json"
 
   persona_names = []
   for i in find_filenames(persona_folder, ""): 
@@ -21,41 +82,90 @@ def compress(sim_code):
     if x[0] != ".": 
       persona_names += [x]
 
-  max_move_count = max([int(i.split("/")[-1].split(".")[0]) 
-                 for i in find_filenames(move_folder, "json")])
-  
-  persona_last_move = dict()
-  master_move = dict()  
-  for i in range(max_move_count+1): 
-    master_move[i] = dict()
-    with open(f"{move_folder}/{str(i)}.json") as json_file:  
-      i_move_dict = json.load(json_file)["persona"]
-      for p in persona_names: 
-        move = False
-        if i == 0: 
-          move = True
-        elif (i_move_dict[p]["movement"] != persona_last_move[p]["movement"]
-          or i_move_dict[p]["pronunciatio"] != persona_last_move[p]["pronunciatio"]
-          or i_move_dict[p]["description"] != persona_last_move[p]["description"]
-          or i_move_dict[p]["chat"] != persona_last_move[p]["chat"]): 
-          move = True
-
-        if move: 
-          persona_last_move[p] = {"movement": i_move_dict[p]["movement"],
-                                  "pronunciatio": i_move_dict[p]["pronunciatio"], 
-                                  "description": i_move_dict[p]["description"], 
-                                  "chat": i_move_dict[p]["chat"]}
-          master_move[i][p] = {"movement": i_move_dict[p]["movement"],
-                               "pronunciatio": i_move_dict[p]["pronunciatio"], 
-                               "description": i_move_dict[p]["description"], 
-                               "chat": i_move_dict[p]["chat"]}
+  max_move_count = get_last_step(sim_storage, "movement")
+
+  # <state> is where we left off. "end_offset" is the byte offset of the 
+  # closing brace of master_movement.json, which we write over when we 
+  # append more steps. 
+  state = {"last_step": -1, "persona_last_move": dict(), "end_offset": None}
+  if (incremental and check_if_file_exists(state_file) 
+      and check_if_file_exists(master_move_file)): 
+    with open(state_file) as json_file: 
+      state = json.load(json_file)
+    if state["last_step"] > max_move_count: 
+      # The simulation is not the one we compressed before. 
+      state = {"last_step": -1, "persona_last_move": dict(), 
+               "end_offset": None}
+  persona_last_move = state["persona_last_move"]
+  first_step = state["last_step"] + 1
 
   create_folder_if_not_there(compressed_storage)
-  with open(f"{compressed_storage}/master_movement.json", "w") as outfile:
-    outfile.write(json.dumps(master_move, indent=2))
+  if first_step == 0: 
+    for log_folder in ["movement_log", "keyframe_log"]: 
+      if os.path.exists(f"{compressed_storage}/{log_folder}"): 
+        shutil.rmtree(f"{compressed_storage}/{log_folder}")
+    outfile = open(master_move_file, "wb")
+    outfile.write(b"{")
+  else: 
+    outfile = open(master_move_file, "r+b")
+    outfile.seek(state["end_offset"])
+    outfile.truncate()
+
+  chunks = (range(i, min(i + chunk_steps, max_move_count + 1)) 
+            for i in range(first_step, max_move_count + 1, chunk_steps))
+
+  move_log = StepLog(f"{compressed_storage}/movement_log")
+  keyframe_log = StepLog(f"{compressed_storage}/keyframe_log")
+
+  def write_moves(steps, moves): 
+    for i, i_move_dict in zip(steps, moves): 
+      # Delta encoding: we only keep the personas whose movement changed 
+      # since their last recorded one. 
+      step_move = dict()
+      for p in persona_names: 
+        if i == 0 or i_move_dict[p] != persona_last_move[p]: 
+          persona_last_move[p] = i_move_dict[p]
+          step_move[p] = i_move_dict[p]
+
+      if i > 0: 
+        outfile.write(b",")
+      outfile.write(f"\n{json.dumps(str(i))}: {json.dumps(step_move)}"
+                    .encode("utf-8"))
+      move_log.append(i, step_move)
+      if i % keyframe_steps == 0: 
+        keyframe_log.append(i, persona_last_move)
+
+  workers = workers or os.cpu_count() or 1
+  with ProcessPoolExecutor(max_workers=workers) as executor: 
+    # We keep at most 2 * <workers> chunks in flight and write them out in 
+    # order. 
+    pending = []
+    for chunk in chunks: 
+      pending += [(chunk, executor.submit(load_moves, sim_storage, chunk))]
+      if len(pending) >= 2 * workers: 
+        steps, future = pending.pop(0)
+        write_moves(steps, future.result())
+    for steps, future in pending: 
+      write_moves(steps, future.result())
+
+  move_log.close()
+  keyframe_log.close()
+
+  state["last_step"] = max_move_count
+  state["persona_last_move"] = persona_last_move
+  state["end_offset"] = outfile.tell()
+  outfile.write(b"\n}\n")
+  outfile.close()
+
+  # We replace the state file in one go so that an interrupted run never 
+  # leaves a state that does not match master_movement.json. 
+  with open(state_file + ".tmp", "w") as json_file: 
+    json_file.write(json.dumps(state))
+  os.replace(state_file + ".tmp", state_file)
 
   shutil.copyfile(meta_file, f"{compressed_storage}/meta.json")
-  shutil.copytree(persona_folder, f"{compressed_storage}/personas/")
+  shutil.copytree(persona_folder, f"{compressed_storage}/personas/", 
+                  dirs_exist_ok=True)
 
 if __name__ == '__main__':
   compress("July1_the_ville_isabella_maria_klaus-step-3-9")
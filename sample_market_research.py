@@ -1,11 +1,18 @@
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Add the reverie backend to Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'reverie', 'backend_server'))
 
 from interview_simulator import MarketResearchInterviewer
+from llm_metrics import llm_metrics
+
+# Interviews run at once. Keep this at 1 for a single Ollama server; with an
+# LLMRouter over several servers (see Readme), set it to about the total
+# number of requests they serve at once.
+INTERVIEW_WORKERS = 1
 
 # Define your research questions
 PRODUCT_CONCEPT_QUESTIONS = [
@@ -349,37 +356,26 @@ def run_market_research_simulation():
     
     all_results = {}
     
-    for persona_type in selected_personas:
-        print(f"\n{'='*70}")
-        print(f"INTERVIEWING: {persona_type.replace('_', ' ').title()}")
-        print(f"{'='*70}")
-        
-        try:
-            # Create interviewer instance
-            interviewer = MarketResearchInterviewer(
-                persona_type=persona_type,
-                research_topic=topic_name
-            )
-            
-            # Conduct interview
-            results = interviewer.conduct_full_interview(questions)
-            
-            # Save results
-            filepath = interviewer.save_interview()
-            all_results[persona_type] = {
-                "results": results,
-                "filepath": filepath
-            }
-            
-            print(f"\nInterview completed and saved to: {filepath}")
+    if INTERVIEW_WORKERS > 1 and len(selected_personas) > 1:
+        # The questions of one interview build on each other, so each
+        # interview is asked in order; the interviews run side by side.
+        with ThreadPoolExecutor(max_workers=INTERVIEW_WORKERS) as executor:
+            interviews = [executor.submit(run_interview, persona_type,
+                                          topic_name, questions)
+                          for persona_type in selected_personas]
+            for persona_type, interview in zip(selected_personas, interviews):
+                result = interview.result()
+                if result:
+                    all_results[persona_type] = result
+    else:
+        for persona_type in selected_personas:
+            result = run_interview(persona_type, topic_name, questions)
+            if result:
+                all_results[persona_type] = result
             
-        except Exception as e:
-            print(f"Error interviewing {persona_type}: {e}")
-            continue
-        
-        # Optional pause between interviews
-        if len(selected_personas) > 1:
-            input("\nPress Enter to continue to next interview...")
+            # Optional pause between interviews
+            if len(selected_personas) > 1:
+                input("\nPress Enter to continue to next interview...")
     
     print(f"\n{'='*70}")
     print("SIMULATION COMPLETE")
@@ -392,6 +388,34 @@ def run_market_research_simulation():
     
     return all_results
 
+def run_interview(persona_type, topic_name, questions):
+    """Interview one persona and save the results"""
+    print(f"\n{'='*70}")
+    print(f"INTERVIEWING: {persona_type.replace('_', ' ').title()}")
+    print(f"{'='*70}")
+    
+    try:
+        # Create interviewer instance
+        interviewer = MarketResearchInterviewer(
+            persona_type=persona_type,
+            research_topic=topic_name
+        )
+        
+        # Conduct interview
+        results = interviewer.conduct_full_interview(questions)
+        
+        # Save results
+        filepath = interviewer.save_interview()
+        print(f"\nInterview completed and saved to: {filepath}")
+        return {
+            "results": results,
+            "filepath": filepath
+        }
+        
+    except Exception as e:
+        print(f"Error interviewing {persona_type}: {e}")
+        return None
+
 def generate_interview_summary(results, topic_name):
     """Generate a brief summary of interview results"""
     
@@ -411,6 +435,21 @@ def generate_interview_summary(results, topic_name):
     print(f"\nAll interview data is available in the 'interview_results' directory.")
     print("You can analyze the JSON files or use the analyze_interviews.py script for detailed analysis.")
 
+    print_llm_report()
+
+def print_llm_report(directory="interview_results"):
+    """Print the LLM requests, tokens and time of this run and save them"""
+
+    print("\n=== LLM METRICS ===")
+    print(llm_metrics.format_report())
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    run_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filepath = os.path.join(directory, f"llm_metrics_{run_time}.json")
+    llm_metrics.export(filepath)
+    print(f"LLM metrics saved to: {filepath}")
+
 def run_quick_test():
     """Run a quick test with one persona and fewer questions"""
     
@@ -434,6 +473,7 @@ def run_quick_test():
         
         print(f"\nTest completed successfully!")
         print(f"Results saved to: {filepath}")
+        print_llm_report()
         
         return results
         
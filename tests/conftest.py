@@ -0,0 +1,122 @@
+"""
+Shared setup of the tests.
+
+The backend modules import each other by their bare names (e.g., "from utils
+import *"), as they do when reverie.py is run from reverie/backend_server, so
+that folder goes on the path. The repository root comes first, so that
+"reverie" is the package and not reverie/backend_server/reverie.py.
+
+utils.py holds the local configuration (see the Readme) and is not checked
+in. Without one, the tests use the configuration below; the tests that talk
+to the model replace utils.llm with a fake.
+"""
+import json
+import os
+import shutil
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_SERVER = os.path.join(ROOT, "reverie", "backend_server")
+FRONTEND_SERVER = os.path.join(ROOT, "environment", "frontend_server")
+MAZE_ASSETS = os.path.join(FRONTEND_SERVER, "static_dirs", "assets")
+
+for path in [BACKEND_SERVER, ROOT]:
+    if path in sys.path:
+        sys.path.remove(path)
+    sys.path.insert(0, path)
+for path in [os.path.join(ROOT, "reverie"), FRONTEND_SERVER]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+try:
+    import utils
+except ImportError:
+    from local_llm_wrapper import LocalLLMWrapper
+
+    utils = types.ModuleType("utils")
+    utils.openai_api_key = "local_llm"
+    utils.key_owner = "Local User"
+    utils.maze_assets_loc = MAZE_ASSETS
+    utils.env_matrix = f"{MAZE_ASSETS}/the_ville/matrix"
+    utils.env_visuals = f"{MAZE_ASSETS}/the_ville/visuals"
+    utils.fs_storage = os.path.join(FRONTEND_SERVER, "storage")
+    utils.fs_temp_storage = os.path.join(FRONTEND_SERVER, "temp_storage")
+    utils.collision_block_id = "32125"
+    utils.debug = False
+    utils.llm = LocalLLMWrapper(model_name="phi3.5")
+
+    def safe_generate(prompt, max_tokens=512, temperature=0.7):
+        try:
+            return utils.llm.generate_response(prompt, max_tokens, temperature)
+        except Exception as e:
+            print(f"Generation error: {e}")
+            return "I need to think about this more."
+
+    utils.safe_generate = safe_generate
+    sys.modules["utils"] = utils
+sys.modules.setdefault("reverie.backend_server.utils", utils)
+
+
+class FakeLLM:
+    """Answers generate_response() from a list of replies (the last one is
+    repeated) and records the requests. A reply can also be a function of
+    the requested format (a JSON schema, "json" or None).
+
+    A reply is cut off after max_tokens tokens, counted as 3 characters
+    each, the way a model stops mid-JSON when its budget runs out.
+    """
+
+    ERROR_RESPONSE = "Error: Unable to generate response"
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.requests = []
+
+    def generate_response(self, prompt, max_tokens=512, temperature=0.7,
+                          stop=None, options=None, format=None):
+        self.requests.append({"prompt": prompt, "max_tokens": max_tokens,
+                              "temperature": temperature, "format": format})
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if callable(reply):
+            reply = reply(format)
+        return reply[:max_tokens * 3]
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Returns a function that makes the prompt functions talk to a FakeLLM
+    with the given replies."""
+    from persona.prompt_template import gpt_structure
+
+    def use_replies(*replies):
+        llm = FakeLLM(replies)
+        monkeypatch.setattr(gpt_structure, "llm", llm)
+        return llm
+
+    gpt_structure.prompt_stats.reset()
+    yield use_replies
+    gpt_structure.prompt_stats.reset()
+
+
+@pytest.fixture(scope="session")
+def maze(tmp_path_factory):
+    """The Maze of the Ville. The map's maze_meta_info.json is not checked
+    in, so we build the matrix folder with one."""
+    import maze as maze_module
+
+    env_matrix = tmp_path_factory.mktemp("the_ville") / "matrix"
+    shutil.copytree(f"{MAZE_ASSETS}/the_ville/matrix", env_matrix)
+    with open(env_matrix / "maze_meta_info.json", "w") as f:
+        json.dump({"world_name": "the ville", "maze_width": 140,
+                   "maze_height": 100, "sq_tile_size": 32,
+                   "special_constraint": ""}, f)
+
+    saved_env_matrix = maze_module.env_matrix
+    maze_module.env_matrix = str(env_matrix)
+    try:
+        return maze_module.Maze("the_ville")
+    finally:
+        maze_module.env_matrix = saved_env_matrix
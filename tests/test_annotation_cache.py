@@ -0,0 +1,166 @@
+"""
+The AnnotationCache shares the annotations of an action across personas, and
+plan.py only caches the annotations that the model actually gave.
+"""
+import datetime
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from annotation_cache import AnnotationCache, fill_name, template_name
+from persona.cognitive_modules import plan
+from persona.memory_structures.scratch import Scratch
+from persona.memory_structures.spatial_memory import MemoryTree
+
+
+def test_personas_share_an_entry_under_their_own_names():
+    cache = AnnotationCache()
+    cache.set("event_triple", ["Isabella Rodriguez is  Sleeping."],
+              "Isabella Rodriguez",
+              ["is", "sleeping next to Isabella Rodriguez"])
+
+    assert (cache.get("event_triple", ["klaus mueller is sleeping"],
+                      "Klaus Mueller")
+            == ["is", "sleeping next to Klaus Mueller"])
+    assert cache.get("event_triple", ["Klaus Mueller is eating"],
+                     "Klaus Mueller") is None
+    assert cache.get("pronunciatio", ["Klaus Mueller is sleeping"],
+                     "Klaus Mueller") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_only_whole_names_are_templated():
+    value = "Isabella Rodriguez's cafe, not Isabella Rodriguezz's"
+    templated = template_name(value, "Isabella Rodriguez")
+    assert templated == "<persona>'s cafe, not Isabella Rodriguezz's"
+    assert fill_name(templated, "Isabella Rodriguez") == value
+    assert template_name(["a", "b"], "") == ["a", "b"]
+
+
+def test_save_and_load(tmp_path):
+    cache_file = str(tmp_path / "annotation_cache.json")
+    cache = AnnotationCache()
+    cache.set("pronunciatio", ["having breakfast"], "Maria Lopez", "🍳")
+    cache.save(cache_file)
+
+    loaded = AnnotationCache()
+    loaded.load(cache_file)
+    assert loaded.entries == cache.entries
+    assert (loaded.get("pronunciatio", ["Having breakfast"], "Klaus Mueller")
+            == "🍳")
+
+    # A missing or broken cache file leaves the cache as it was.
+    loaded.load(str(tmp_path / "missing.json"))
+    with open(cache_file, "w") as outfile:
+        outfile.write('{"pronunciatio|')
+    loaded.load(cache_file)
+    assert loaded.entries == cache.entries
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = AnnotationCache()
+    monkeypatch.setattr(plan, "annotation_cache", cache)
+    monkeypatch.setattr(plan, "use_annotation_cache", True)
+    return cache
+
+
+def make_persona(name):
+    return SimpleNamespace(name=name)
+
+
+def test_annotations_are_generated_once_for_all_personas(fake_llm, cache):
+    llm = fake_llm(json.dumps({"output": "💤"}))
+
+    for name in ["Isabella Rodriguez", "Klaus Mueller", "Maria Lopez"]:
+        assert (plan.generate_action_pronunciatio("sleeping",
+                                                  make_persona(name))
+                == "💤")
+    assert len(llm.requests) == 1
+
+
+def test_fail_safe_annotations_are_not_cached(fake_llm, cache):
+    llm = fake_llm(json.dumps({"output": ""}))
+
+    assert (plan.generate_action_pronunciatio(
+                "sleeping", make_persona("Isabella Rodriguez")) == "😋")
+    assert cache.entries == dict()
+
+    llm.replies = [json.dumps({"output": "💤"})]
+    assert (plan.generate_action_pronunciatio(
+                "sleeping", make_persona("Klaus Mueller")) == "💤")
+    assert cache.get("pronunciatio", ["sleeping"], "Maria Lopez") == "💤"
+
+
+def make_cafe_persona(maze, name):
+    """A persona at Hobbs Cafe, for the fused annotation prompt."""
+    cafe_tile = next((x, y) for y, row in enumerate(maze.tiles)
+                     for x, tile in enumerate(row)
+                     if tile["sector"] == "Hobbs Cafe" and tile["arena"])
+    scratch = Scratch("")
+    scratch.name = name
+    scratch.first_name, scratch.last_name = name.split(" ")
+    scratch.curr_time = datetime.datetime(2023, 2, 13, 7, 30)
+    scratch.curr_tile = cafe_tile
+    scratch.daily_plan_req = "open Hobbs Cafe at 8am"
+    scratch.living_area = "the Ville:Hobbs Cafe:cafe"
+    s_mem = MemoryTree("")
+    s_mem.tree = {maze.access_tile(cafe_tile)["world"]: {"Hobbs Cafe": {
+        "cafe": ["cafe customer seating", "behind the cafe counter"]}}}
+    return SimpleNamespace(name=name, scratch=scratch, s_mem=s_mem)
+
+
+def fused_reply(name, pronunciatio, object_description):
+    return json.dumps({
+        "sector": "Hobbs Cafe", "arena": "cafe",
+        "game_object": "behind the cafe counter",
+        "pronunciatio": pronunciatio, "predicate": "is preparing",
+        "object": f"the coffee of {name}",
+        "object_description": object_description,
+        "object_pronunciatio": "☕", "object_predicate": "is",
+        "object_object": f"used by {name}"})
+
+
+def test_fused_annotations_share_the_cache(fake_llm, cache, maze):
+    act_desp = "preparing the coffee"
+    isabella = make_cafe_persona(maze, "Isabella Rodriguez")
+    klaus = make_cafe_persona(maze, "Klaus Mueller")
+    llm = fake_llm(fused_reply("Isabella Rodriguez", "🫘", "being used"))
+
+    annotation = plan.generate_action_annotation(act_desp, isabella, maze)
+    assert annotation["pronunciatio"] == "🫘"
+
+    # The one-by-one prompts of another persona find the fused annotations.
+    assert plan.generate_action_pronunciatio(act_desp, klaus) == "🫘"
+    assert (plan.generate_action_event_triple(act_desp, klaus)
+            == ("Klaus Mueller", "is preparing",
+                "the coffee of Klaus Mueller"))
+    assert (plan.generate_act_obj_desc("behind the cafe counter", act_desp,
+                                       klaus) == "being used")
+    assert plan.generate_action_pronunciatio("being used", klaus) == "☕"
+    assert (plan.generate_act_obj_event_triple("behind the cafe counter",
+                                               "being used", klaus)
+            == ("behind the cafe counter", "is", "used by Klaus Mueller"))
+    assert len(llm.requests) == 1
+
+    # The cached annotations win over a second fused answer; the object's
+    # pronunciatio and triple go with the cached description.
+    llm.replies = [fused_reply("Klaus Mueller", "🍵", "being cleaned")]
+    annotation = plan.generate_action_annotation(act_desp, klaus, maze)
+    assert annotation == {
+        "sector": "Hobbs Cafe", "arena": "cafe",
+        "game_object": "behind the cafe counter", "pronunciatio": "🫘",
+        "predicate": "is preparing", "object": "the coffee of Klaus Mueller",
+        "object_description": "being used", "object_pronunciatio": "☕",
+        "object_predicate": "is", "object_object": "used by Klaus Mueller"}
+
+
+def test_a_failed_fused_annotation_is_not_cached(fake_llm, cache, maze):
+    fake_llm("I am not sure.")
+    annotation = plan.generate_action_annotation(
+        "preparing the coffee", make_cafe_persona(maze, "Klaus Mueller"),
+        maze)
+
+    assert set(annotation.values()) == {None}
+    assert cache.entries == dict()
@@ -0,0 +1,150 @@
+"""
+The streaming compress_sim_storage writes what the original one did, and an
+incremental run writes what a full run would.
+"""
+import json
+import os
+import random
+import shutil
+
+import pytest
+
+import compress_sim_storage
+import step_log
+from step_log import StepLog
+
+PERSONAS = ["Isabella Rodriguez", "Klaus Mueller", "Maria Lopez"]
+SIM_CODE = "July1_the_ville"
+
+
+def old_compress(sim_storage):
+    """The master_movement of the original compress(), as a dictionary."""
+    persona_last_move = dict()
+    master_move = dict()
+    step = 0
+    while True:
+        with open(f"{sim_storage}/movement_copy/{step}.json") as json_file:
+            i_move_dict = json.load(json_file)["persona"]
+        master_move[step] = dict()
+        for p in PERSONAS:
+            move = {field: i_move_dict[p][field] for field in
+                    ["movement", "pronunciatio", "description", "chat"]}
+            if step == 0 or move != persona_last_move[p]:
+                persona_last_move[p] = move
+                master_move[step][p] = move
+        step += 1
+        if not os.path.exists(f"{sim_storage}/movement_copy/{step}.json"):
+            return json.loads(json.dumps(master_move, indent=2))
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """A repository layout in tmp_path; compress() is run from its reverie
+    folder, as it is meant to be."""
+    frontend_server = tmp_path / "environment" / "frontend_server"
+    sim_storage = frontend_server / "storage" / SIM_CODE
+    for persona in PERSONAS:
+        os.makedirs(sim_storage / "personas" / persona / "bootstrap_memory")
+        with open(sim_storage / "personas" / persona / "bootstrap_memory"
+                  / "scratch.json", "w") as outfile:
+            json.dump({"name": persona}, outfile)
+    os.makedirs(sim_storage / "reverie")
+    with open(sim_storage / "reverie" / "meta.json", "w") as outfile:
+        json.dump({"step": 0}, outfile)
+    os.makedirs(sim_storage / "movement")
+    os.makedirs(sim_storage / "movement_copy")
+    os.makedirs(tmp_path / "reverie")
+    monkeypatch.chdir(tmp_path / "reverie")
+    # The logs that were opened for reading are kept by their (relative)
+    # folder, which is the same in every test.
+    monkeypatch.setattr(step_log, "step_logs", dict())
+    monkeypatch.setattr(compress_sim_storage, "keyframe_steps", 10)
+    return sim_storage
+
+
+def add_steps(rng, sim_storage, first_step, last_step, last_moves):
+    """Writes random movements for the steps; the first third of them as
+    step files (as older simulations have them) and the rest to the log."""
+    move_log = StepLog(f"{sim_storage}/movement_log")
+    for step in range(first_step, last_step + 1):
+        persona = dict()
+        for p in PERSONAS:
+            if p not in last_moves or rng.random() < 0.3:
+                last_moves[p] = {
+                    "movement": [rng.randrange(140), rng.randrange(100)],
+                    "pronunciatio": rng.choice(["☕", "📚", "💤"]),
+                    "description": rng.choice(["reading", "sleeping"]),
+                    "chat": rng.choice([None, [[p, "Hi!"]]])}
+            persona[p] = dict(last_moves[p])
+        movement = {"persona": persona, "meta": {"curr_time": f"{step}"}}
+        if step < last_step // 3:
+            with open(f"{sim_storage}/movement/{step}.json", "w") as outfile:
+                json.dump(movement, outfile, indent=2)
+        else:
+            move_log.append(step, movement)
+        with open(f"{sim_storage}/movement_copy/{step}.json", "w") as outfile:
+            json.dump(movement, outfile)
+    move_log.close()
+
+
+def compressed_folder():
+    return f"../environment/frontend_server/compressed_storage/{SIM_CODE}"
+
+
+def read_master_movement():
+    with open(f"{compressed_folder()}/master_movement.json") as json_file:
+        return json.load(json_file)
+
+
+def test_compress_writes_the_old_master_movement(storage):
+    rng = random.Random(34)
+    add_steps(rng, storage, 0, 95, dict())
+
+    compress_sim_storage.compress(SIM_CODE, workers=2, chunk_steps=7)
+
+    master_move = read_master_movement()
+    assert master_move == old_compress(storage)
+    move_log = StepLog(f"{compressed_folder()}/movement_log")
+    assert {str(step): move_log.read(step)
+            for step in move_log.steps()} == master_move
+
+    # Each keyframe has the full movement of every persona at its step.
+    keyframe_log = StepLog(f"{compressed_folder()}/keyframe_log")
+    assert keyframe_log.steps() == list(range(0, 96, 10))
+    for step in keyframe_log.steps():
+        with open(f"{storage}/movement_copy/{step}.json") as json_file:
+            persona = json.load(json_file)["persona"]
+        assert keyframe_log.read(step) == persona
+    assert os.path.exists(f"{compressed_folder()}/personas/Klaus Mueller/"
+                          "bootstrap_memory/scratch.json")
+
+
+def test_incremental_compress_equals_a_full_compress(storage):
+    rng = random.Random(340)
+    last_moves = dict()
+    add_steps(rng, storage, 0, 40, last_moves)
+    compress_sim_storage.compress(SIM_CODE, workers=2, chunk_steps=7)
+    add_steps(rng, storage, 41, 73, last_moves)
+    compress_sim_storage.compress(SIM_CODE, workers=2, chunk_steps=5)
+    add_steps(rng, storage, 74, 74, last_moves)
+    compress_sim_storage.compress(SIM_CODE, workers=1, chunk_steps=5)
+
+    incremental = dict()
+    for file_name in ["master_movement.json", "compress_state.json"]:
+        with open(f"{compressed_folder()}/{file_name}", "rb") as infile:
+            incremental[file_name] = infile.read()
+    move_log = StepLog(f"{compressed_folder()}/movement_log")
+    incremental_moves = {step: move_log.read(step)
+                         for step in move_log.steps()}
+    shutil.rmtree(compressed_folder())
+
+    compress_sim_storage.compress(SIM_CODE, incremental=False, workers=2,
+                                  chunk_steps=7)
+
+    for file_name, data in incremental.items():
+        with open(f"{compressed_folder()}/{file_name}", "rb") as infile:
+            assert infile.read() == data
+    move_log = StepLog(f"{compressed_folder()}/movement_log")
+    assert {step: move_log.read(step)
+            for step in move_log.steps()} == incremental_moves
+    assert read_master_movement() == old_compress(storage)
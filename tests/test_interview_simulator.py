@@ -0,0 +1,57 @@
+"""
+The conversation history of an interview is fit to its token budget, with
+the older turns summarized.
+"""
+import interview_simulator
+from interview_simulator import MarketResearchInterviewer
+
+
+def make_interviewer(turns, budget):
+    interviewer = MarketResearchInterviewer(
+        "tech_early_adopter", "smart home devices",
+        history_token_budget=budget, summarize_old_turns=True)
+    for i in range(turns):
+        interviewer.conversation_history.append({
+            "question": f"What do you think of product {i}?",
+            "response": f"I like product {i} because it saves me time. " * 4})
+    return interviewer
+
+
+def test_old_turns_are_summarized_once(monkeypatch):
+    prompts = []
+
+    def safe_generate(prompt, max_tokens=512, temperature=0.7):
+        prompts.append(prompt)
+        return "They like it.\n"
+    monkeypatch.setattr(interview_simulator, "safe_generate", safe_generate)
+    interviewer = make_interviewer(4, 100)
+
+    history = interviewer.format_conversation_history()
+    assert interviewer.count_tokens(history) <= 100
+    assert history.startswith("Earlier in the interview:\n- They like it.")
+    assert history.endswith(interviewer.conversation_history[-1]["response"])
+
+    summaries = len(prompts)
+    assert summaries > 0
+    assert interviewer.format_conversation_history() == history
+    assert len(prompts) == summaries
+
+
+def test_failed_summaries_are_not_cached(monkeypatch):
+    replies = ["Error: Unable to generate response",
+               "I need to think about this more.", "They like product 0."]
+
+    def safe_generate(prompt, max_tokens=512, temperature=0.7):
+        return replies.pop(0)
+    monkeypatch.setattr(interview_simulator, "safe_generate", safe_generate)
+    interviewer = make_interviewer(2, 1000)
+
+    for _ in range(2):
+        assert interviewer.summarize_turn(0) == (
+            "Q: What do you think of product 0? A: "
+            + " ".join(["I like product 0 because it saves me time."] * 4))
+    assert interviewer.turn_summaries == {}
+
+    assert interviewer.summarize_turn(0) == "They like product 0."
+    assert interviewer.summarize_turn(0) == "They like product 0."
+    assert interviewer.turn_summaries == {0: "They like product 0."}
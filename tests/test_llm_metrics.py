@@ -0,0 +1,41 @@
+"""
+LLMMetrics counts the LLM requests per prompt type.
+"""
+import datetime
+
+from llm_metrics import LLMMetrics
+
+
+def test_records_requests_under_the_prompt_type():
+    metrics = LLMMetrics()
+    with metrics.prompt_type("v2/wake_up_hour_v1.txt"):
+        metrics.record({"prompt_tokens": 100, "completion_tokens": 5,
+                        "wall_ms": 200})
+        metrics.record({"error": True, "wall_ms": 50})
+        metrics.record_coalesced()
+    metrics.record({"prompt_tokens": 10, "wall_ms": 20})
+
+    stats = metrics.get()
+    assert stats["v2/wake_up_hour_v1.txt"] == {
+        "requests": 2, "errors": 1, "coalesced": 1, "prompt_tokens": 100,
+        "completion_tokens": 5, "prompt_eval_ms": 0, "eval_ms": 0,
+        "total_ms": 0, "wall_ms": 250}
+    assert stats["unlabeled"]["requests"] == 1
+
+    report = metrics.get_report({"v2/wake_up_hour_v1.txt": {
+        "calls": 1, "attempts": 2, "skipped": 0, "fail_safes": 0}})
+    assert list(report["prompt_types"]) == ["v2/wake_up_hour_v1.txt",
+                                            "unlabeled"]
+    assert report["prompt_types"]["v2/wake_up_hour_v1.txt"]["retries"] == 1
+    assert report["totals"]["requests"] == 3
+
+
+def test_prompt_modules_keep_the_datetime_module():
+    # The cognitive modules star-import gpt_structure, and use
+    # datetime.timedelta and friends; llm_metrics must not shadow the module
+    # with its datetime class.
+    from persona.cognitive_modules import plan
+    from persona.prompt_template import run_gpt_prompt
+
+    for module in [run_gpt_prompt, plan]:
+        assert module.datetime is datetime
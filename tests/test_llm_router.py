@@ -0,0 +1,176 @@
+"""
+The LLMRouter spreads the requests over its backends within their caps, and
+fails over to another backend when one fails or is down.
+"""
+import threading
+import time
+
+import pytest
+
+import llm_router
+import local_llm_wrapper
+from llm_metrics import LLMMetrics
+from llm_router import LLMRouter
+
+URLS = ["http://numa0:11434", "http://numa1:11434", "http://numa2:11434"]
+
+
+class FakeRouter(LLMRouter):
+    """An LLMRouter whose backends fail while their URL is in <failing>, and
+    whose requests wait for <release> when it is given."""
+
+    def __init__(self, backends, **kwargs):
+        super().__init__(backends, health_check_interval=0, **kwargs)
+        self.failing = set()
+        self.release = None
+        self.sends = []
+        self.busy = {url: 0 for url in URLS}
+        self.max_busy = {url: 0 for url in URLS}
+        self.sends_lock = threading.Lock()
+
+    def _send(self, api_url, data):
+        base_url = api_url[:-len("/api/generate")]
+        with self.sends_lock:
+            self.sends += [base_url]
+            self.busy[base_url] += 1
+            self.max_busy[base_url] = max(self.max_busy[base_url],
+                                          self.busy[base_url])
+        if self.release is not None:
+            self.release.wait(5)
+        with self.sends_lock:
+            self.busy[base_url] -= 1
+        if base_url in self.failing:
+            self._record_usage({"error": True})
+            return self.ERROR_RESPONSE
+        self._record_usage({"prompt_tokens": 10})
+        return f"{base_url}: {data['prompt']}"
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = LLMMetrics()
+    monkeypatch.setattr(llm_router, "llm_metrics", metrics)
+    monkeypatch.setattr(local_llm_wrapper, "llm_metrics", metrics)
+    return metrics
+
+
+@pytest.fixture
+def make_router():
+    routers = []
+
+    def make(backends, **kwargs):
+        routers.append(FakeRouter(backends, **kwargs))
+        return routers[-1]
+
+    yield make
+    for router in routers:
+        router.stop()
+
+
+def test_a_failed_request_is_retried_on_another_backend(metrics,
+                                                         make_router):
+    router = make_router(URLS[:2], fail_threshold=3)
+    router.failing.add(URLS[0])
+
+    for i in range(3):
+        assert (router.generate_response(f"question {i}")
+                == f"{URLS[1]}: question {i}")
+    assert router.sends == [URLS[0], URLS[1]] * 3
+
+    # After three failures in a row the first backend is drained.
+    assert router.generate_response("question 3") == f"{URLS[1]}: question 3"
+    assert router.sends[-1:] == [URLS[1]]
+    stats = router.get_backend_stats()
+    assert stats[0]["drained"] and stats[0]["failures"] == 3
+    assert not stats[1]["drained"] and stats[1]["failures"] == 0
+    assert metrics.get()["unlabeled"]["requests"] == 7
+    assert metrics.get()["unlabeled"]["errors"] == 3
+    assert "drained" in router.format_backend_report()
+
+
+def test_a_drained_backend_comes_back_after_its_cooldown(metrics,
+                                                         make_router):
+    router = make_router(URLS[:2], fail_threshold=1, drain_cooldown=0.2)
+    router.failing.add(URLS[0])
+    router.generate_response("question")
+    router.failing.clear()
+    router.generate_response("question", temperature=0.5)
+    assert router.sends == [URLS[0], URLS[1], URLS[1]]
+
+    time.sleep(0.3)
+    assert not router.get_backend_stats()[0]["drained"]
+    assert (router.generate_response("question", temperature=0.5)
+            == f"{URLS[0]}: question")
+
+
+def test_every_backend_failing_gives_the_error_response(metrics, make_router):
+    router = make_router(URLS, fail_threshold=1)
+    router.failing.update(URLS)
+
+    assert router.generate_response("question") == router.ERROR_RESPONSE
+    assert sorted(router.sends) == URLS
+
+    # Now every backend is drained, so no request is sent at all.
+    assert router.generate_response("question") == router.ERROR_RESPONSE
+    assert len(router.sends) == 3
+    assert router.get_last_usage() == {"error": True}
+    assert metrics.get()["unlabeled"]["errors"] == 4
+
+
+def test_requests_spread_within_the_caps(metrics, make_router):
+    router = make_router([{"base_url": URLS[0], "max_concurrency": 2},
+                          URLS[1]])
+    router.release = threading.Event()
+    responses = []
+
+    def ask(i):
+        responses.append(router.generate_response(f"question {i}", 20, 0.7))
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for _ in range(500):
+        if len(router.sends) == 3:
+            break
+        time.sleep(0.01)
+    # Both backends are at their cap, so the other two requests wait.
+    time.sleep(0.05)
+    assert sorted(router.sends) == [URLS[0], URLS[0], URLS[1]]
+    assert [i["outstanding"] for i in router.get_backend_stats()] == [2, 1]
+
+    router.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(responses) == 5 and router.ERROR_RESPONSE not in responses
+    assert router.max_busy == {URLS[0]: 2, URLS[1]: 1, URLS[2]: 0}
+    assert [i["outstanding"] for i in router.get_backend_stats()] == [0, 0]
+
+
+def test_unhealthy_and_drained_backends_are_left_out(metrics, make_router,
+                                                     monkeypatch):
+    class Response:
+        status_code = 200
+
+    def get(url, timeout):
+        if url.startswith(URLS[1]):
+            raise ConnectionError("connection refused")
+        return Response()
+
+    monkeypatch.setattr(llm_router.requests, "get", get)
+    router = make_router(URLS)
+    router.check_health()
+    router.drain(URLS[2] + "/")
+
+    for i in range(3):
+        router.generate_response(f"question {i}", temperature=0.5)
+    assert router.sends == [URLS[0]] * 3
+    report = router.format_backend_report()
+    assert [line.split()[1] for line in report.splitlines()[2:]] == [
+        "up", "down", "drained"]
+
+    router.undrain(URLS[2])
+    router.drain(URLS[0])
+    router.generate_response("question", temperature=0.5)
+    assert router.sends[-1] == URLS[2]
+    with pytest.raises(ValueError):
+        router.drain("http://numa3:11434")
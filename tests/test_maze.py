@@ -0,0 +1,137 @@
+"""
+The vectorized spatial queries of the Maze give what the tile by tile walks
+that they replaced gave.
+"""
+import copy
+import math
+import random
+from operator import itemgetter
+
+import pytest
+
+
+@pytest.fixture
+def ville(maze):
+    """A copy of the Ville that a test may add events to."""
+    return copy.deepcopy(maze)
+
+
+def old_get_nearby_tiles(maze, tile, vision_r):
+    left_end = 0
+    if tile[0] - vision_r > left_end:
+        left_end = tile[0] - vision_r
+    right_end = maze.maze_width - 1
+    if tile[0] + vision_r + 1 < right_end:
+        right_end = tile[0] + vision_r + 1
+    bottom_end = maze.maze_height - 1
+    if tile[1] + vision_r + 1 < bottom_end:
+        bottom_end = tile[1] + vision_r + 1
+    top_end = 0
+    if tile[1] - vision_r > top_end:
+        top_end = tile[1] - vision_r
+
+    nearby_tiles = []
+    for i in range(left_end, right_end):
+        for j in range(top_end, bottom_end):
+            nearby_tiles += [(i, j)]
+    return nearby_tiles
+
+
+def old_perceive_events(maze, curr_tile, vision_r, att_bandwidth):
+    """The event perception of perceive() before the perception kernel."""
+    curr_arena_path = maze.get_tile_path(curr_tile, "arena")
+    percept_events_set = set()
+    percept_events_list = []
+    for tile in old_get_nearby_tiles(maze, curr_tile, vision_r):
+        tile_details = maze.access_tile(tile)
+        if tile_details["events"]:
+            if maze.get_tile_path(tile, "arena") == curr_arena_path:
+                dist = math.dist([tile[0], tile[1]],
+                                 [curr_tile[0], curr_tile[1]])
+                for event in tile_details["events"]:
+                    if event not in percept_events_set:
+                        percept_events_list += [[dist, event]]
+                        percept_events_set.add(event)
+    percept_events_list = sorted(percept_events_list, key=itemgetter(0))
+    return [event for dist, event in percept_events_list[:att_bandwidth]]
+
+
+def random_tile(rng, maze):
+    return (rng.randrange(maze.maze_width), rng.randrange(maze.maze_height))
+
+
+def add_random_events(rng, maze, count):
+    """Adds <count> events to empty tiles, some of them extended across
+    several nearby tiles, as the game objects are. With at most one event per
+    tile, the order of the old perception does not depend on set order."""
+    for i in range(count):
+        x, y = random_tile(rng, maze)
+        event = (f"Persona {i}", "is", f"doing thing {i}", f"thing {i}")
+        for _ in range(rng.choice([1, 1, 2, 4])):
+            tile = (min(max(x + rng.randint(-2, 2), 0), maze.maze_width - 1),
+                    min(max(y + rng.randint(-2, 2), 0), maze.maze_height - 1))
+            if not maze.access_tile(tile)["events"]:
+                maze.add_event_from_tile(event, tile)
+
+
+@pytest.mark.parametrize("vision_r", [0, 1, 4, 8, 200])
+def test_nearby_tiles_equal_the_old_walk(maze, vision_r):
+    rng = random.Random(vision_r)
+    tiles = [(0, 0), (maze.maze_width - 1, maze.maze_height - 1),
+             (0, maze.maze_height - 1)]
+    tiles += [random_tile(rng, maze) for _ in range(50)]
+    for tile in tiles:
+        assert (maze.get_nearby_tiles(tile, vision_r)
+                == old_get_nearby_tiles(maze, tile, vision_r))
+
+
+def test_perception_kernel_equals_the_old_perception(ville):
+    rng = random.Random(26)
+    add_random_events(rng, ville, 1500)
+
+    for _ in range(300):
+        curr_tile = random_tile(rng, ville)
+        vision_r = rng.choice([1, 4, 8, 16])
+        att_bandwidth = rng.choice([1, 3, 8, 1000])
+        assert (ville.get_nearby_arena_events(curr_tile, vision_r,
+                                              att_bandwidth)
+                == old_perceive_events(ville, curr_tile, vision_r,
+                                       att_bandwidth))
+
+
+def build_arena_events(maze):
+    """The spatial event index, built from the events of the tiles."""
+    arena_events = dict()
+    for y, row in enumerate(maze.tiles):
+        for x, tile_details in enumerate(row):
+            for event in tile_details["events"]:
+                arena_id = maze.arena_id_maze[y][x]
+                arena_events.setdefault(arena_id, set()).add(((x, y), event))
+    return arena_events
+
+
+def test_event_index_follows_the_tiles(ville):
+    rng = random.Random(27)
+    subjects = [f"Persona {i}" for i in range(20)]
+    placed = []
+    for _ in range(3000):
+        op = rng.random()
+        if op < 0.4 or not placed:
+            subject = rng.choice(subjects)
+            event = (subject, "is", rng.choice(["eating", "reading"]), "")
+            tile = random_tile(rng, ville)
+            ville.add_event_from_tile(event, tile)
+            placed += [(event, tile)]
+        elif op < 0.6:
+            event, tile = placed.pop(rng.randrange(len(placed)))
+            ville.remove_event_from_tile(event, tile)
+        elif op < 0.8:
+            event, tile = placed.pop(rng.randrange(len(placed)))
+            ville.turn_event_from_tile_idle(event, tile)
+        else:
+            _, tile = rng.choice(placed)
+            ville.remove_subject_events_from_tile(rng.choice(subjects), tile)
+
+    index = {arena_id: set(events)
+             for arena_id, events in ville.arena_events.items() if events}
+    assert index == build_arena_events(ville)
@@ -0,0 +1,102 @@
+"""
+Paging through the MemoryIndex gives the nodes of a type and time range,
+newest first (by descending node count), as filtering and sorting the whole
+nodes.json would.
+"""
+import json
+import os
+import random
+
+import pytest
+
+from translator.memory_index import MemoryIndex
+
+
+def random_nodes(rng, count, in_order=True):
+    """Random nodes; a simulation creates them <in_order> of time."""
+    # Few distinct times, so that some nodes are created at once.
+    times = [(f"2023-02-{rng.randint(13, 15)} "
+              f"{rng.choice(['08', '09', '13'])}:"
+              f"{rng.choice(['00', '30'])}:00") for _ in range(count)]
+    if in_order:
+        times.sort()
+    nodes = dict()
+    for node_count, created in enumerate(times, 1):
+        nodes[f"node_{node_count}"] = {
+            "node_count": node_count,
+            "type": rng.choice(["event", "chat", "thought"]),
+            "created": created,
+            "description": f"memory {node_count}"}
+    return nodes
+
+
+def write_nodes(nodes_file, nodes):
+    with open(nodes_file, "w") as outfile:
+        json.dump(nodes, outfile)
+
+
+def expected_nodes(nodes, node_type, since, until):
+    """The nodes of a type in [since, until], newest first."""
+    type_nodes = [i for i in nodes.values() if i["type"] == node_type
+                  and (not since or i["created"] >= since)
+                  and (not until or i["created"][:len(until)] <= until)]
+    return sorted(type_nodes, key=lambda i: i["node_count"], reverse=True)
+
+
+def read_all_pages(index, node_type, limit, since, until):
+    pages = []
+    cursor = None
+    while True:
+        page, cursor, total = index.get_page(node_type, limit, cursor,
+                                             since, until)
+        assert len(page) <= limit
+        pages += [page]
+        if cursor is None:
+            return pages, total
+
+
+@pytest.mark.parametrize("in_order", [True, False])
+def test_pages_equal_the_filtered_nodes(tmp_path, in_order):
+    rng = random.Random(37)
+    nodes_file = str(tmp_path / "nodes.json")
+    nodes = random_nodes(rng, 300, in_order)
+    write_nodes(nodes_file, nodes)
+    index = MemoryIndex(nodes_file)
+
+    for _ in range(200):
+        node_type = rng.choice(["event", "chat", "thought"])
+        limit = rng.choice([1, 7, 20, 500])
+        since = rng.choice([None, "2023-02-14", "2023-02-13 09:00:00"])
+        until = rng.choice([None, "2023-02-14", "2023-02-15 09:00:00"])
+        pages, total = read_all_pages(index, node_type, limit, since, until)
+
+        expected = expected_nodes(nodes, node_type, since, until)
+        assert [i for page in pages for i in page] == expected
+        assert total == len(expected)
+        assert all(len(page) == limit for page in pages[:-1])
+
+
+def test_a_cursor_survives_new_nodes(tmp_path):
+    rng = random.Random(370)
+    nodes_file = str(tmp_path / "nodes.json")
+    nodes = random_nodes(rng, 100)
+    write_nodes(nodes_file, nodes)
+    index = MemoryIndex(nodes_file)
+    first_page, cursor, _ = index.get_page("thought", 5)
+
+    # The persona remembers more while the inspector is open.
+    for node_count in range(101, 121):
+        nodes[f"node_{node_count}"] = {
+            "node_count": node_count, "type": "thought",
+            "created": "2023-02-16 08:00:00",
+            "description": f"memory {node_count}"}
+    write_nodes(nodes_file, nodes)
+    os.utime(nodes_file, ns=(0, 1))
+
+    rest = []
+    while cursor:
+        page, cursor, total = index.get_page("thought", 5, cursor)
+        rest += page
+    expected = expected_nodes(nodes, "thought", None, None)
+    assert first_page + rest == expected[20:]
+    assert total == len(expected)
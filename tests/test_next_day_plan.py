@@ -0,0 +1,127 @@
+"""
+A plan for the next day that is made in the background during the evening
+is only committed if it is the plan we would have made at midnight.
+"""
+import copy
+import datetime
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from persona.cognitive_modules import plan
+from persona.memory_structures.associative_memory import AssociativeMemory
+from persona.memory_structures.scratch import Scratch
+
+EVENING = datetime.datetime(2023, 2, 13, 22, 0)
+MIDNIGHT = datetime.datetime(2023, 2, 14, 0, 0)
+
+
+def fake_revise_identity(persona):
+    # Like the retrieval of revise_identity, we rank the nodes by when they
+    # were last accessed and mark the ones we retrieve as accessed.
+    nodes = sorted(persona.a_mem.id_to_node.values(),
+                   key=lambda node: (node.last_accessed, node.node_count))
+    retrieved = nodes[-2:]
+    for node in retrieved:
+        node.last_accessed = persona.scratch.curr_time
+    persona.scratch.currently = (f"{persona.name} remembers "
+                                 + "; ".join(i.description for i in retrieved))
+    persona.scratch.daily_plan_req = f"{len(nodes)} memories"
+
+
+def fake_generate_hourly_schedule(persona, wake_up_hour):
+    return [["sleeping", wake_up_hour * 60],
+            [persona.scratch.currently, (24 - wake_up_hour) * 60]]
+
+
+@pytest.fixture
+def persona(tmp_path, monkeypatch):
+    monkeypatch.setattr(plan, "next_day_plan_hour", 22)
+    monkeypatch.setattr(plan, "generate_wake_up_hour", lambda persona: 7)
+    monkeypatch.setattr(plan, "revise_identity", fake_revise_identity)
+    monkeypatch.setattr(plan, "generate_hourly_schedule",
+                        fake_generate_hourly_schedule)
+
+    for file_name, data in [("embeddings.json", {}), ("nodes.json", {}),
+                            ("kw_strength.json", {"kw_strength_event": {},
+                                                  "kw_strength_thought": {}})]:
+        with open(tmp_path / file_name, "w") as f:
+            json.dump(data, f)
+    a_mem = AssociativeMemory(str(tmp_path))
+    scratch = Scratch("")
+    scratch.name = "Isabella Rodriguez"
+    scratch.currently = "Isabella is planning a Valentine's Day party."
+    scratch.daily_req = ["open the cafe at 8am", "close the cafe at 8pm"]
+    persona = SimpleNamespace(name=scratch.name, scratch=scratch, a_mem=a_mem,
+                              next_day_plan=None)
+    for hour in range(8, 21, 3):
+        add_event(persona, datetime.datetime(2023, 2, 13, hour),
+                  f"Isabella Rodriguez is serving coffee ({hour}h)")
+    return persona
+
+
+def add_event(persona, created, description):
+    persona.a_mem.add_event(created, None, persona.name, "is", "busy",
+                            description, {"cafe"}, 3, (description, [0.0]),
+                            None)
+
+
+def run_evening(persona, change):
+    """Runs the persona from the evening to midnight, starting its plan for
+    the next day, and returns (whether the plan was committed, the persona
+    planned at midnight instead)."""
+    persona.scratch.curr_time = EVENING
+    plan._start_next_day_plan(persona)
+    assert persona.next_day_plan is not None
+    change(persona)
+
+    persona.scratch.curr_time = MIDNIGHT
+    midnight_persona = SimpleNamespace(
+        name=persona.name, scratch=copy.deepcopy(persona.scratch),
+        a_mem=copy.deepcopy(persona.a_mem), next_day_plan=None)
+    plan._generate_day_plan(midnight_persona, "New day")
+
+    committed = plan._commit_next_day_plan(persona)
+    if not committed:
+        plan._generate_day_plan(persona, "New day")
+    return committed, midnight_persona
+
+
+def no_change(persona):
+    pass
+
+
+def new_event(persona):
+    add_event(persona, datetime.datetime(2023, 2, 13, 23, 0),
+              "Klaus Mueller is knocking on the door")
+
+
+def retrieval(persona):
+    oldest = persona.a_mem.id_to_node["node_1"]
+    oldest.last_accessed = datetime.datetime(2023, 2, 13, 23, 30)
+
+
+@pytest.mark.parametrize("change, committed", [(no_change, True),
+                                               (new_event, False),
+                                               (retrieval, False)])
+def test_committed_plan_equals_the_midnight_plan(persona, change, committed):
+    was_committed, midnight_persona = run_evening(persona, change)
+
+    assert was_committed == committed
+    for field in ["currently", "daily_plan_req", "daily_req",
+                  "f_daily_schedule", "f_daily_schedule_hourly_org"]:
+        assert (getattr(persona.scratch, field)
+                == getattr(midnight_persona.scratch, field))
+    assert ({i: node.last_accessed
+             for i, node in persona.a_mem.id_to_node.items()}
+            == {i: node.last_accessed
+                for i, node in midnight_persona.a_mem.id_to_node.items()})
+
+
+def test_background_planning_is_off_by_default(persona, monkeypatch):
+    monkeypatch.undo()
+    assert plan.next_day_plan_hour is None
+    persona.scratch.curr_time = EVENING
+    plan._start_next_day_plan(persona)
+    assert persona.next_day_plan is None
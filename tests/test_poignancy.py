@@ -0,0 +1,62 @@
+"""
+The poignancy of new memories is scored with one batched prompt, falling
+back to one prompt per memory for the scores that could not be read.
+"""
+import datetime
+import json
+from types import SimpleNamespace
+
+from persona.cognitive_modules import perceive, reflect
+from persona.memory_structures.scratch import Scratch
+
+MEMORIES = [("event", "the refrigerator is idle"),
+            ("event", "Klaus Mueller is writing his research paper"),
+            ("chat", "conversing about the Valentine's Day party"),
+            ("thought", "Isabella wants to invite everyone to the party")]
+
+
+def make_persona():
+    scratch = Scratch("")
+    scratch.name = "Isabella Rodriguez"
+    scratch.curr_time = datetime.datetime(2023, 2, 13, 14, 30)
+    scratch.act_description = "chatting with Klaus Mueller"
+    return SimpleNamespace(name=scratch.name, scratch=scratch)
+
+
+def reply_scores(batch_scores, single_score):
+    """Returns a reply function that answers the batched prompt (which asks
+    for an array) with <batch_scores>, and the other prompts with
+    <single_score>."""
+    def reply(format):
+        if format is not None and "items" in format["properties"]["output"]:
+            return json.dumps({"output": batch_scores})
+        return json.dumps({"output": str(single_score)})
+    return reply
+
+
+def test_scores_the_memories_in_one_request(fake_llm):
+    llm = fake_llm(reply_scores([4, 7, 2], 6))
+
+    scores = perceive.generate_poig_scores(make_persona(), MEMORIES)
+
+    assert scores == [1, 4, 7, 2]
+    assert len(llm.requests) == 1
+    # The idle memory is not in the prompt, and the max_tokens of the
+    # prompt's gpt_param is passed on.
+    assert "refrigerator" not in llm.requests[0]["prompt"]
+    assert llm.requests[0]["max_tokens"] == 15 + 5 * 3
+    assert llm.requests[0]["temperature"] == 0
+
+
+def test_unreadable_scores_are_asked_for_one_by_one(fake_llm):
+    llm = fake_llm(reply_scores([4, 11, 2], 6))
+
+    scores = perceive.generate_poig_scores(make_persona(), MEMORIES)
+
+    assert scores == [1, 4, 6, 2]
+    assert len(llm.requests) == 2
+    assert "Klaus Mueller" in llm.requests[1]["prompt"]
+
+
+def test_reflect_scores_with_the_same_function():
+    assert reflect.generate_poig_scores is perceive.generate_poig_scores
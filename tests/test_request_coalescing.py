@@ -0,0 +1,113 @@
+"""
+Identical requests that the LocalLLMWrapper has in flight at the same time
+share one generation, unless their responses are sampled.
+"""
+import threading
+import time
+
+import pytest
+
+import local_llm_wrapper
+from llm_metrics import LLMMetrics
+from local_llm_wrapper import LocalLLMWrapper
+
+
+class CountingEvent(threading.Event):
+    """An Event that counts the threads that wait on it."""
+
+    waiting = 0
+    lock = threading.Lock()
+
+    def wait(self, timeout=None):
+        with CountingEvent.lock:
+            CountingEvent.waiting += 1
+        return super().wait(timeout)
+
+
+class CountingFlight(local_llm_wrapper._Flight):
+    def __init__(self):
+        super().__init__()
+        self.done = CountingEvent()
+
+
+class BlockingLLM(LocalLLMWrapper):
+    """Answers with the prompt and a request number once it is released."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.sends = 0
+        self.sends_lock = threading.Lock()
+
+    def _send(self, api_url, data):
+        with self.sends_lock:
+            self.sends += 1
+            send = self.sends
+        self.release.wait(5)
+        self._record_usage({"prompt_tokens": 10, "completion_tokens": 2})
+        return f"{data['prompt']} #{send}"
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = LLMMetrics()
+    monkeypatch.setattr(local_llm_wrapper, "llm_metrics", metrics)
+    monkeypatch.setattr(local_llm_wrapper, "_Flight", CountingFlight)
+    monkeypatch.setattr(CountingEvent, "waiting", 0)
+    return metrics
+
+
+def generate_all(llm, requests):
+    """Runs each request in its own thread and returns the responses and the
+    usage each thread saw."""
+    results = [None] * len(requests)
+
+    def run(i, prompt, temperature):
+        response = llm.generate_response(prompt, 20, temperature)
+        results[i] = (response, llm.get_last_usage())
+
+    threads = [threading.Thread(target=run, args=(i, *request))
+               for i, request in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_identical_requests_share_one_generation(metrics):
+    llm = BlockingLLM()
+    threads, results = generate_all(llm, [("What time is it?", 0)] * 6)
+    # Let the first request through once the others wait on it.
+    for _ in range(500):
+        if CountingEvent.waiting == 5:
+            break
+        time.sleep(0.01)
+    llm.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert llm.sends == 1
+    assert [response for response, usage in results] == [
+        "What time is it? #1"] * 6
+    assert sorted(bool(usage.get("coalesced")) for response, usage
+                  in results) == [False] + [True] * 5
+    assert metrics.get()["unlabeled"]["requests"] == 1
+    assert metrics.get()["unlabeled"]["coalesced"] == 5
+    assert llm.in_flight == dict()
+
+
+def test_sampled_and_different_requests_are_sent_on_their_own(metrics):
+    llm = BlockingLLM()
+    llm.release.set()
+    requests = [("What time is it?", 0.7)] * 3 + [("Where are you?", 0),
+                                                  ("What time is it?", 0)]
+    threads, results = generate_all(llm, requests)
+    for thread in threads:
+        thread.join(5)
+
+    assert llm.sends == 5
+    assert len({response for response, usage in results}) == 5
+    assert metrics.get()["unlabeled"]["coalesced"] == 0
+
+    llm.coalesce_requests = False
+    assert (llm.generate_response("Where are you?", 20, 0)
+            == "Where are you? #6")
@@ -0,0 +1,87 @@
+"""
+The retry budget of safe_generate_response: the prompt types that the stats
+are kept under, the errors that fail an attempt, and the fail safe streaks.
+"""
+import pytest
+
+from persona.prompt_template import gpt_structure
+from persona.prompt_template.gpt_structure import (
+    ChatGPT_safe_generate_response, safe_generate_response)
+
+GPT_PARAM = {"engine": "text-davinci-002", "max_tokens": 20,
+             "temperature": 0, "top_p": 1, "stream": False,
+             "frequency_penalty": 0, "presence_penalty": 0, "stop": None}
+PROMPT_TEMPLATE = "persona/prompt_template/v2/wake_up_hour_v1.txt"
+
+
+def validate_hour(gpt_response, prompt=""):
+    return gpt_response.strip().isdigit()
+
+
+def clean_up_hour(gpt_response, prompt=""):
+    return int(gpt_response.strip())
+
+
+def ask_hour(persona_name):
+    return safe_generate_response("When do you wake up?", GPT_PARAM, 5, 8,
+                                  validate_hour, clean_up_hour,
+                                  prompt_type=PROMPT_TEMPLATE,
+                                  persona_name=persona_name)
+
+
+def test_stats_are_kept_under_the_given_prompt_type(fake_llm):
+    fake_llm("7")
+
+    assert ask_hour("Isabella Rodriguez") == 7
+    ChatGPT_safe_generate_response("Is it late?", "no", "", 3, "error",
+                                   lambda gpt_response, prompt="": True,
+                                   lambda gpt_response, prompt="": gpt_response)
+
+    stats = gpt_structure.get_prompt_stats()
+    assert stats["v2/wake_up_hour_v1.txt"]["validated"] == 1
+    assert stats["unlabeled"]["calls"] == 1
+
+
+def test_unparsable_responses_fail_the_attempt(fake_llm):
+    llm = fake_llm('{"answer": "ye', '{"output": 5}', '{"output": "yes"}')
+
+    output = ChatGPT_safe_generate_response(
+        "Is it late?", "yes", "", 3, "error",
+        lambda gpt_response, prompt="": gpt_response in ["yes", "no"],
+        lambda gpt_response, prompt="": gpt_response,
+        structured_output=gpt_structure.chat_output())
+
+    assert output == "yes"
+    assert len(llm.requests) == 3
+
+
+def test_bugs_in_the_prompt_function_are_raised(fake_llm):
+    fake_llm("7")
+
+    def clean_up(gpt_response, prompt=""):
+        return {"hour": int(gpt_response)}["minute"]
+
+    with pytest.raises(KeyError):
+        safe_generate_response("When do you wake up?", GPT_PARAM, 5, 8,
+                               validate_hour, clean_up,
+                               prompt_type=PROMPT_TEMPLATE)
+
+
+def test_fail_safe_streak_is_kept_per_persona(fake_llm):
+    llm = fake_llm("I am not sure.")
+    for _ in range(gpt_structure.fail_safe_streak):
+        assert ask_hour("Klaus Mueller") == 8
+    assert gpt_structure.prompt_stats.get_streak(
+        "v2/wake_up_hour_v1.txt", "Klaus Mueller") == 3
+
+    # Klaus's calls now get the fail safe right away...
+    requests = len(llm.requests)
+    assert ask_hour("Klaus Mueller") == 8
+    assert len(llm.requests) == requests
+
+    # ... but Isabella's still get their attempts.
+    llm.replies = ["I am not sure.", "7"]
+    assert ask_hour("Isabella Rodriguez") == 7
+    assert len(llm.requests) == requests + 2
+    assert gpt_structure.prompt_stats.get_streak(
+        "v2/wake_up_hour_v1.txt", "Klaus Mueller") == 4
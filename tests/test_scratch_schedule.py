@@ -0,0 +1,68 @@
+"""
+The schedule indexes found by binary search over the kept end times equal
+the ones of the old walk over the schedule.
+"""
+import datetime
+import random
+
+from persona.memory_structures.scratch import Scratch
+
+
+def old_schedule_index(schedule, curr_time, advance):
+    """get_f_daily_schedule_index() before the kept end times."""
+    today_min_elapsed = curr_time.hour * 60 + curr_time.minute + advance
+    curr_index = 0
+    elapsed = 0
+    for task, duration in schedule:
+        elapsed += duration
+        if elapsed > today_min_elapsed:
+            return curr_index
+        curr_index += 1
+    return curr_index
+
+
+def random_schedule(rng):
+    schedule = [[f"task {i}", rng.choice([5, 10, 15, 30, 60, 120])]
+                for i in range(rng.randint(0, 30))]
+    # An over-full day is evened out with a negative "sleeping".
+    if schedule and rng.random() < 0.3:
+        schedule.insert(rng.randrange(len(schedule)),
+                        ["sleeping", -rng.randint(1, 300)])
+    return schedule
+
+
+def check_indexes(rng, scratch):
+    for _ in range(5):
+        scratch.curr_time = datetime.datetime(
+            2023, 2, 13, rng.randrange(24), rng.randrange(60))
+        advance = rng.choice([0, 0, 1, 60, 600])
+        assert (scratch.get_f_daily_schedule_index(advance)
+                == old_schedule_index(scratch.f_daily_schedule,
+                                      scratch.curr_time, advance))
+        assert (scratch.get_f_daily_schedule_hourly_org_index(advance)
+                == old_schedule_index(scratch.f_daily_schedule_hourly_org,
+                                      scratch.curr_time, advance))
+
+
+def test_indexes_equal_the_old_walk_as_the_schedule_changes():
+    rng = random.Random(39)
+    scratch = Scratch("")
+    scratch.f_daily_schedule = random_schedule(rng)
+    scratch.f_daily_schedule_hourly_org = random_schedule(rng)
+
+    for _ in range(500):
+        check_indexes(rng, scratch)
+        op = rng.random()
+        if op < 0.2:
+            scratch.f_daily_schedule = random_schedule(rng)
+        elif op < 0.3:
+            scratch.f_daily_schedule_hourly_org = random_schedule(rng)
+        elif op < 0.8:
+            # An hourly action is decomposed, as plan.py does.
+            start_index = rng.randint(0, len(scratch.f_daily_schedule))
+            end_index = min(start_index + rng.randint(0, 2),
+                            len(scratch.f_daily_schedule))
+            scratch.splice_f_daily_schedule(start_index, end_index,
+                                            random_schedule(rng)[:4])
+        else:
+            scratch.f_daily_schedule += [["task", rng.choice([5, 60])]]
@@ -0,0 +1,54 @@
+"""
+Adding only the newly seen tiles to the spatial memory grows the same tree
+as walking every nearby tile in each step.
+"""
+import copy
+import json
+import random
+
+from persona.memory_structures.spatial_memory import MemoryTree
+
+
+def old_perceive_space(tree, maze, tile, vision_r):
+    """The space perception of perceive() before seen_tiles."""
+    for i in maze.get_nearby_tiles(tile, vision_r):
+        i = maze.access_tile(i)
+        if i["world"]:
+            if (i["world"] not in tree):
+                tree[i["world"]] = {}
+        if i["sector"]:
+            if (i["sector"] not in tree[i["world"]]):
+                tree[i["world"]][i["sector"]] = {}
+        if i["arena"]:
+            if (i["arena"] not in tree[i["world"]][i["sector"]]):
+                tree[i["world"]][i["sector"]][i["arena"]] = []
+        if i["game_object"]:
+            if (i["game_object"] not in tree[i["world"]][i["sector"]]
+                                            [i["arena"]]):
+                tree[i["world"]][i["sector"]][i["arena"]] += [
+                    i["game_object"]]
+
+
+def test_tree_grows_as_with_the_old_walk(maze):
+    rng = random.Random(28)
+    # A persona that starts with what it knows from its saved tree.
+    saved_tree = {"the Ville": {"Hobbs Cafe": {"cafe": ["piano"]}}}
+    s_mem = MemoryTree("")
+    s_mem.tree = copy.deepcopy(saved_tree)
+    old_tree = copy.deepcopy(saved_tree)
+
+    seen = set()
+    x, y = 72, 14
+    for _ in range(400):
+        x = min(max(x + rng.randint(-3, 3), 0), maze.maze_width - 1)
+        y = min(max(y + rng.randint(-3, 3), 0), maze.maze_height - 1)
+        vision_r = rng.choice([4, 8])
+        nearby_tiles = set(maze.get_nearby_tiles((x, y), vision_r))
+
+        new_tiles = s_mem.add_nearby_tiles(maze, (x, y), vision_r)
+        old_perceive_space(old_tree, maze, (x, y), vision_r)
+
+        assert new_tiles == len(nearby_tiles - seen)
+        # The order of the keys and of the game objects matters too.
+        assert json.dumps(s_mem.tree) == json.dumps(old_tree)
+        seen |= nearby_tiles
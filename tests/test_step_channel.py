@@ -0,0 +1,58 @@
+"""
+The backend's step channel hands environments and movements to the
+frontend, and stops accepting connections once it is closed.
+"""
+import json
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+import pytest
+
+import step_channel
+from step_channel import StepChannel
+
+
+@pytest.fixture
+def channel(tmp_path, monkeypatch):
+    monkeypatch.setattr(step_channel, "fs_temp_storage", str(tmp_path))
+    channel = StepChannel("July1_the_ville")
+    yield channel
+    channel.close()
+
+
+def request(channel, data, authkey=None):
+    with open(channel.info_file) as f:
+        channel_info = json.load(f)
+    authkey = authkey or bytes.fromhex(channel_info["authkey"])
+    with Client(tuple(channel_info["address"]), authkey=authkey) as conn:
+        conn.send(dict(data, sim_code="July1_the_ville"))
+        return conn.recv()
+
+
+def test_hands_over_environments_and_movements(channel):
+    movement = {"persona": {"Isabella Rodriguez": {"movement": [72, 14]}}}
+    channel.put_movement(12, movement)
+
+    assert request(channel, {"type": "environment", "step": 13,
+                             "environment": {"x": 1}})
+    assert channel.wait_environment(13, timeout=1) == {"x": 1}
+    assert request(channel, {"type": "movement", "step": 12,
+                             "timeout": 1}) == movement
+    assert request(channel, {"type": "movement", "step": 13,
+                             "timeout": 0}) is None
+
+
+def test_keeps_accepting_after_a_failed_authentication(channel):
+    with pytest.raises(AuthenticationError):
+        request(channel, {"type": "movement", "step": 0}, authkey=b"wrong")
+
+    channel.put_movement(0, {"persona": {}})
+    assert request(channel, {"type": "movement", "step": 0}) == {"persona": {}}
+
+
+def test_stops_accepting_once_closed(channel, tmp_path):
+    channel.close()
+
+    channel.accept_thread.join(timeout=5)
+    assert not channel.accept_thread.is_alive()
+    assert not (tmp_path / "step_channel.json").exists()
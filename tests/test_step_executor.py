@@ -0,0 +1,117 @@
+"""
+The StepExecutor only moves personas concurrently when they cannot affect
+one another in the step.
+"""
+import random
+from types import SimpleNamespace
+
+from step_executor import StepExecutor
+
+
+def make_persona(name, vision_r, chatting_with=None, act_address=None):
+    scratch = SimpleNamespace(vision_r=vision_r, chatting_with=chatting_with,
+                              act_address=act_address, chat=None)
+    return SimpleNamespace(name=name, scratch=scratch)
+
+
+def can_affect(maze, personas, personas_tile, name, other_name):
+    """Whether <name>'s move may read <other_name>'s state, tile by tile."""
+    scratch = personas[name].scratch
+    tile = personas_tile[name]
+    if (personas_tile[other_name]
+            in maze.get_nearby_tiles(tile, scratch.vision_r)
+            and maze.get_tile_path(personas_tile[other_name], "arena")
+            == maze.get_tile_path(tile, "arena")):
+        return True
+    if scratch.chatting_with == other_name:
+        return True
+    return (scratch.act_address is not None
+            and scratch.act_address == f"<persona> {other_name}")
+
+
+def connected_components(maze, personas, personas_tile):
+    names = list(personas)
+    neighbors = {name: set() for name in names}
+    for name in names:
+        for other_name in names:
+            if (other_name != name
+                    and can_affect(maze, personas, personas_tile, name,
+                                   other_name)):
+                neighbors[name].add(other_name)
+                neighbors[other_name].add(name)
+
+    groups = []
+    seen = set()
+    for name in names:
+        if name in seen:
+            continue
+        group = {name}
+        queue = [name]
+        while queue:
+            for other_name in neighbors[queue.pop()]:
+                if other_name not in group:
+                    group.add(other_name)
+                    queue.append(other_name)
+        seen |= group
+        groups.append([i for i in names if i in group])
+    return groups
+
+
+def random_personas(rng, maze, count):
+    names = [f"Persona {i}" for i in range(count)]
+    personas = dict()
+    personas_tile = dict()
+    # The personas crowd around a few spots, so that some of them see each
+    # other.
+    spots = [(rng.randrange(maze.maze_width), rng.randrange(maze.maze_height))
+             for _ in range(3)]
+    for name in names:
+        x, y = rng.choice(spots)
+        personas_tile[name] = (
+            min(max(x + rng.randint(-6, 6), 0), maze.maze_width - 1),
+            min(max(y + rng.randint(-6, 6), 0), maze.maze_height - 1))
+        chatting_with = None
+        act_address = rng.choice([None, "the Ville:Hobbs Cafe:cafe:piano"])
+        if rng.random() < 0.1:
+            chatting_with = rng.choice(names)
+        if rng.random() < 0.1:
+            act_address = f"<persona> {rng.choice(names)}"
+        personas[name] = make_persona(name, rng.choice([0, 2, 4, 8]),
+                                      chatting_with, act_address)
+    return personas, personas_tile
+
+
+def test_groups_equal_the_connected_personas(maze):
+    rng = random.Random(29)
+    executor = StepExecutor(workers=4)
+    for _ in range(200):
+        personas, personas_tile = random_personas(rng, maze,
+                                                  rng.randint(1, 12))
+        assert (executor.group_personas(maze, personas, personas_tile)
+                == connected_components(maze, personas, personas_tile))
+
+
+def test_concurrent_moves_return_the_serial_movements(maze):
+    rng = random.Random(290)
+    personas, personas_tile = random_personas(rng, maze, 12)
+
+    def make_move(name):
+        def move(maze, personas, curr_tile, curr_time):
+            personas[name].scratch.chat = [[name, "Hi"]]
+            return curr_tile, "🙂", f"{name} @ {curr_time}"
+        return move
+    for name, persona in personas.items():
+        persona.move = make_move(name)
+
+    serial = StepExecutor(workers=1).move_personas(maze, personas,
+                                                   personas_tile, "10:00")
+    executor = StepExecutor(workers=4)
+    try:
+        concurrent = executor.move_personas(maze, personas, personas_tile,
+                                            "10:00")
+    finally:
+        executor.shutdown()
+
+    assert len(executor.group_personas(maze, personas, personas_tile)) > 1
+    assert list(concurrent) == list(personas)
+    assert concurrent == serial
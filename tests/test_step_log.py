@@ -0,0 +1,277 @@
+"""
+The StepLog keeps the records of the steps of a simulation in appendable
+segments, and reads any step back through its index.
+"""
+import importlib.util
+import json
+import os
+import random
+import shutil
+import threading
+import time
+from types import SimpleNamespace
+
+from conftest import BACKEND_SERVER
+import step_log
+from step_log import (StepLog, get_last_step, get_step_log, get_steps,
+                      read_manifest, read_step, write_manifest)
+
+
+def random_record(rng, step):
+    return {"persona": {name: {"movement": [rng.randrange(140),
+                                            rng.randrange(100)],
+                               "chat": None}
+                        for name in ["Isabella Rodriguez", "Klaus Mueller"]},
+            "meta": {"step": step, "note": "é" * rng.randrange(5)}}
+
+
+def test_reads_back_what_was_appended(tmp_path):
+    rng = random.Random(33)
+    log_folder = str(tmp_path / "movement_log")
+    writer = StepLog(log_folder, segment_steps=7)
+    reader = StepLog(log_folder)
+    expected = dict()
+    appends = 0
+
+    for step in range(60):
+        expected[step] = random_record(rng, step)
+        writer.append(step, expected[step])
+        appends += 1
+        # Now and then a step is written again; the last record wins.
+        if rng.random() < 0.2:
+            step = rng.randrange(step + 1)
+            expected[step] = random_record(rng, step)
+            writer.append(step, expected[step])
+            appends += 1
+        if rng.random() < 0.3:
+            step = rng.randrange(step + 1)
+            assert reader.read(step) == expected[step]
+    writer.close()
+
+    assert reader.steps() == list(range(60))
+    assert {step: reader.read(step) for step in expected} == expected
+    assert StepLog(log_folder).read(61) is None
+    segments = [i for i in os.listdir(log_folder) if i.startswith("segment_")]
+    assert len(segments) == -(-appends // 7)
+
+
+def test_steps_and_last_step_follow_the_index(tmp_path):
+    rng = random.Random(35)
+    log_folder = str(tmp_path / "keyframe_log")
+    writer = StepLog(log_folder, segment_steps=7)
+    reader = StepLog(log_folder)
+    written = set()
+    assert reader.last_step() is None
+
+    for _ in range(300):
+        # Mostly the next step, sometimes an earlier one, written anew or
+        # for the first time.
+        if rng.random() < 0.8 or not written:
+            step = max(written, default=-1) + rng.randint(1, 3)
+        else:
+            step = rng.randrange(max(written))
+        writer.append(step, {"step": step})
+        written.add(step)
+
+        for log in [writer, reader]:
+            until = rng.randrange(max(written) + 2)
+            assert log.steps() == sorted(written)
+            assert log.last_step() == max(written)
+            assert log.last_step(until) == max(
+                (i for i in written if i <= until), default=None)
+    writer.close()
+
+
+def test_reader_stops_at_the_last_complete_index_line(tmp_path):
+    log_folder = str(tmp_path / "movement_log")
+    writer = StepLog(log_folder)
+    writer.append(0, {"step": 0})
+    with open(f"{log_folder}/index.jsonl", "ab") as index_file:
+        index_file.write(b'[1, "segment_0.jso')
+
+    reader = StepLog(log_folder)
+    assert reader.steps() == [0]
+
+    with open(f"{log_folder}/index.jsonl", "ab") as index_file:
+        index_file.write(b'nl", 12, 12]\n')
+    with open(f"{log_folder}/segment_0.jsonl", "ab") as segment_file:
+        segment_file.write(b'{"step": 1}\n')
+    assert reader.steps() == [0, 1]
+    assert reader.read(1) == {"step": 1}
+
+
+def test_a_new_writer_never_appends_to_old_segments(tmp_path):
+    log_folder = str(tmp_path / "movement_log")
+    writer = StepLog(log_folder)
+    for step in range(3):
+        writer.append(step, {"step": step})
+    writer.close()
+    with open(f"{log_folder}/segment_0.jsonl", "rb") as segment_file:
+        segment = segment_file.read()
+
+    writer = StepLog(log_folder)
+    writer.append(3, {"step": 3})
+    writer.close()
+
+    with open(f"{log_folder}/segment_0.jsonl", "rb") as segment_file:
+        assert segment_file.read() == segment
+    assert os.path.exists(f"{log_folder}/segment_1.jsonl")
+    assert StepLog(log_folder).steps() == [0, 1, 2, 3]
+
+
+def test_reader_notices_a_log_written_anew(tmp_path):
+    log_folder = str(tmp_path / "movement_log")
+    writer = StepLog(log_folder)
+    for step in range(5):
+        writer.append(step, {"step": step})
+    writer.close()
+    reader = StepLog(log_folder)
+    assert reader.steps() == list(range(5))
+
+    shutil.rmtree(log_folder)
+    writer = StepLog(log_folder)
+    writer.append(0, {"step": "new"})
+    writer.close()
+
+    assert reader.steps() == [0]
+    assert reader.read(0) == {"step": "new"}
+
+
+class SlowFile:
+    """A file that lets other threads run before each read."""
+
+    def __init__(self, file):
+        self.file = file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def read(self, *args):
+        time.sleep(0.0001)
+        return self.file.read(*args)
+
+
+def test_threads_share_a_reader_while_the_log_grows(tmp_path, monkeypatch):
+    monkeypatch.setattr(step_log, "step_logs", dict())
+    sim_folder = str(tmp_path / "July1_the_ville")
+    writer = StepLog(f"{sim_folder}/movement_log", segment_steps=50)
+    writer.append(0, {"step": 0})
+    errors = []
+    readers = []
+
+    # Other threads get to run while one is in the middle of a refresh().
+    monkeypatch.setattr(step_log, "open",
+                        lambda *args: SlowFile(open(*args)), raising=False)
+
+    def read():
+        try:
+            reader = get_step_log(sim_folder, "movement")
+            readers.append(reader)
+            for _ in range(100):
+                steps = reader.steps()
+                assert steps == list(range(len(steps)))
+                assert reader.read(steps[-1]) == {"step": steps[-1]}
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    step = 0
+    while any(thread.is_alive() for thread in threads):
+        step += 1
+        writer.append(step, {"step": step})
+    writer.close()
+
+    assert errors == []
+    assert all(reader is readers[0] for reader in readers)
+    assert readers[0].steps() == list(range(step + 1))
+
+
+def test_falls_back_to_the_step_files(tmp_path):
+    sim_folder = str(tmp_path / "July1_the_ville")
+    os.makedirs(f"{sim_folder}/movement")
+    for step in [0, 1, 2]:
+        with open(f"{sim_folder}/movement/{step}.json", "w") as outfile:
+            json.dump({"step": step, "from": "file"}, outfile, indent=2)
+    log = StepLog(f"{sim_folder}/movement_log")
+    log.append(2, {"step": 2, "from": "log"})
+    log.append(3, {"step": 3, "from": "log"})
+    log.close()
+
+    assert read_step(sim_folder, "movement", 1) == {"step": 1, "from": "file"}
+    assert read_step(sim_folder, "movement", 2) == {"step": 2, "from": "log"}
+    assert read_step(sim_folder, "movement", 4) is None
+    assert get_steps(sim_folder, "movement") == [0, 1, 2, 3]
+    assert get_last_step(sim_folder, "movement") == 3
+    assert get_last_step(sim_folder, "environment") is None
+
+
+def load_reverie_server():
+    """Loads reverie/backend_server/reverie.py, which has the same name as the
+    reverie package."""
+    spec = importlib.util.spec_from_file_location(
+        "reverie_server", os.path.join(BACKEND_SERVER, "reverie.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_manifest_follows_the_environment_log(tmp_path, monkeypatch):
+    reverie_server = load_reverie_server()
+    monkeypatch.setattr(reverie_server, "fs_storage", str(tmp_path))
+    sim_folder = str(tmp_path / "July1_the_ville")
+    os.makedirs(f"{sim_folder}/reverie")
+    os.makedirs(f"{sim_folder}/environment")
+    # A simulation from before the log, with its steps in files.
+    for step in range(3):
+        with open(f"{sim_folder}/environment/{step}.json", "w") as outfile:
+            json.dump({"step": step}, outfile)
+
+    rng = random.Random(38)
+    env_steps = get_steps(sim_folder, "environment")
+    server = SimpleNamespace(
+        sim_code="July1_the_ville",
+        personas={"Isabella Rodriguez": None, "Klaus Mueller": None},
+        env_log=StepLog(f"{sim_folder}/environment_log"),
+        env_latest_step=env_steps[-1], env_step_count=len(env_steps))
+    server.update_manifest = (
+        lambda: reverie_server.ReverieServer.update_manifest(server))
+    server.update_manifest()
+
+    step = 3
+    for _ in range(100):
+        # The simulation is now and then resumed from an earlier step.
+        if rng.random() < 0.1:
+            step = rng.randrange(step)
+        reverie_server.ReverieServer.log_environment(server, step,
+                                                     {"step": step})
+        step += 1
+
+        manifest = read_manifest(sim_folder)
+        steps = get_steps(sim_folder, "environment")
+        assert manifest == {"latest_step": steps[-1],
+                            "step_count": len(steps),
+                            "persona_names": ["Isabella Rodriguez",
+                                              "Klaus Mueller"]}
+    assert os.listdir(f"{sim_folder}/reverie") == ["manifest.json"]
+
+
+def test_missing_or_broken_manifest_reads_as_none(tmp_path):
+    sim_folder = str(tmp_path / "July1_the_ville")
+    os.makedirs(f"{sim_folder}/reverie")
+    assert read_manifest(sim_folder) is None
+
+    with open(f"{sim_folder}/reverie/manifest.json", "w") as outfile:
+        outfile.write('{"latest_step": 1')
+    assert read_manifest(sim_folder) is None
+
+    write_manifest(sim_folder, 12, 13, ["Maria Lopez"])
+    assert read_manifest(sim_folder) == {"latest_step": 12, "step_count": 13,
+                                         "persona_names": ["Maria Lopez"]}
@@ -0,0 +1,115 @@
+"""
+The prompts that ask for a StructuredOutput get their full-length JSON
+replies through the validate and clean up functions, and not the fail safe.
+"""
+import datetime
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from persona.memory_structures.scratch import Scratch
+from persona.memory_structures.spatial_memory import MemoryTree
+from persona.prompt_template import gpt_structure
+from persona.prompt_template.run_gpt_prompt import (
+    run_gpt_prompt_action_annotation, run_gpt_prompt_decide_to_talk,
+    run_gpt_prompt_event_triple)
+
+# What a model writes into a free text field of a schema (e.g., a
+# "reasoning" field before the answer).
+FREE_TEXT = ("Klaus Mueller chatted with Isabella Rodriguez about the "
+             "Valentine's Day party an hour ago, and she is busy setting up "
+             "the cafe, so he would not start another conversation now.")
+
+
+def reply_with(values):
+    """Returns a reply function that fills in the requested schema with
+    <values>, and any other field with FREE_TEXT, pretty printed the way the
+    model writes it."""
+    def reply(format):
+        response = {field: values.get(field, FREE_TEXT)
+                    for field in format["properties"]}
+        return json.dumps(response, indent=2, ensure_ascii=False)
+    return reply
+
+
+def make_persona(name):
+    scratch = Scratch("")
+    scratch.name = name
+    scratch.first_name, scratch.last_name = name.split(" ")
+    scratch.curr_time = datetime.datetime(2023, 2, 13, 14, 30)
+    scratch.act_description = "having lunch (eating a sandwich)"
+    scratch.daily_plan_req = "Isabella opens Hobbs Cafe at 8am."
+    scratch.living_area = "the Ville:Isabella Rodriguez's apartment:main room"
+    a_mem = SimpleNamespace(get_last_chat=lambda target_name: None)
+    return SimpleNamespace(name=name, scratch=scratch, a_mem=a_mem)
+
+
+def test_event_triple_fits_a_long_object(fake_llm):
+    llm = fake_llm(reply_with({
+        "predicate": "is having",
+        "object": "a slow breakfast of toast and coffee at the kitchen table"}))
+    persona = make_persona("Isabella Rodriguez")
+
+    output = run_gpt_prompt_event_triple("having breakfast", persona)[0]
+
+    assert output == ("Isabella Rodriguez", "is having", "a slow breakfast of "
+                      "toast and coffee at the kitchen table")
+    assert not gpt_structure.last_response_was_fail_safe()
+    assert llm.requests[0]["max_tokens"] == 60
+
+
+def test_decide_to_talk_gets_its_answer(fake_llm):
+    # The fail safe is "yes", so the answer is "no".
+    llm = fake_llm(reply_with({"answer": "no"}))
+    persona = make_persona("Klaus Mueller")
+    target_persona = make_persona("Isabella Rodriguez")
+    retrieved = {"events": [], "thoughts": []}
+
+    output = run_gpt_prompt_decide_to_talk(persona, target_persona,
+                                           retrieved)[0]
+
+    assert output == "no"
+    assert not gpt_structure.last_response_was_fail_safe()
+    assert len(llm.requests) == 1
+    assert list(llm.requests[0]["format"]["properties"]) == ["answer"]
+
+
+def test_action_annotation_fits_every_field(fake_llm, maze):
+    sector_tiles = [(x, y) for y, row in enumerate(maze.tiles)
+                    for x, tile in enumerate(row)
+                    if tile["sector"] == "Hobbs Cafe" and tile["arena"]]
+    persona = make_persona("Isabella Rodriguez")
+    persona.scratch.curr_tile = sector_tiles[0]
+    persona.s_mem = MemoryTree("")
+    world = maze.access_tile(sector_tiles[0])["world"]
+    persona.s_mem.tree = {world: {
+        "Hobbs Cafe": {"cafe": ["cafe customer seating", "piano",
+                                "behind the cafe counter"]},
+        "Isabella Rodriguez's apartment": {"main room": ["bed", "desk"]}}}
+    annotation = {
+        "sector": "Hobbs Cafe", "arena": "cafe",
+        "game_object": "behind the cafe counter", "pronunciatio": "☕🥐",
+        "predicate": "is preparing",
+        "object": "the pastries and coffee for the morning customers",
+        "object_description": "being used to prepare the morning pastries",
+        "object_pronunciatio": "🥐", "object_predicate": "is",
+        "object_object": "being used by Isabella Rodriguez"}
+    fake_llm(reply_with(annotation))
+
+    output = run_gpt_prompt_action_annotation(
+        "preparing the cafe for the morning customers", persona, maze)[0]
+
+    assert output == annotation
+    assert not gpt_structure.last_response_was_fail_safe()
+
+
+@pytest.mark.parametrize("mode", ["schema", "json"])
+def test_cut_off_reply_falls_back(fake_llm, monkeypatch, mode):
+    monkeypatch.setattr(gpt_structure, "structured_output_mode", mode)
+    fake_llm('{"predicate": "is having", "object": "a slow breakfast of to')
+    persona = make_persona("Isabella Rodriguez")
+
+    run_gpt_prompt_event_triple("having breakfast", persona)
+
+    assert gpt_structure.last_response_was_fail_safe()
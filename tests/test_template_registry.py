@@ -0,0 +1,77 @@
+"""
+generate_prompt() fills the compiled templates of the registry to the same
+prompt as the original generate_prompt(), which read the template file and
+replaced its slots before it cut off the comment block.
+"""
+import os
+import random
+
+import pytest
+
+from conftest import BACKEND_SERVER
+from persona.prompt_template.gpt_structure import generate_prompt
+from persona.prompt_template.template_registry import (input_slot_pattern,
+                                                       template_registry)
+
+TEMPLATE_KEYS = sorted(template_registry.templates)
+
+
+def old_generate_prompt(curr_input, prompt_lib_file):
+    """The generate_prompt() of the original generative agents code."""
+    if type(curr_input) == type("string"):
+        curr_input = [curr_input]
+    curr_input = [str(i) for i in curr_input]
+
+    f = open(prompt_lib_file, "r")
+    prompt = f.read()
+    f.close()
+    for count, i in enumerate(curr_input):
+        prompt = prompt.replace(f"!<INPUT {count}>!", i)
+    marker = "<commentblockmarker>###</commentblockmarker>"
+    if marker in prompt:
+        prompt = prompt.split(marker)[1]
+    return prompt.strip()
+
+
+def random_input(rng):
+    """An input as the prompt functions make them: names, schedules and
+    such, with the characters that a regular expression or a format string
+    would trip over. (None of them holds a slot or the comment block marker,
+    which the old function would have filled or cut in the input too.)"""
+    words = ["Isabella Rodriguez", "the Ville:Hobbs Cafe:cafe", "7am",
+             "\\1", "$0", "{}", "%s", "☕", "é", "", " ", "\n", "\n\n",
+             "(sleeping)", "100%", "[INPUT]", "!<", ">!"]
+    return "".join(rng.choice(words) for _ in range(rng.randint(0, 6)))
+
+
+def test_the_registry_has_every_template():
+    template_folder = os.path.join(BACKEND_SERVER, "persona",
+                                   "prompt_template")
+    template_files = [f"{template_set}/{file_name}"
+                      for template_set in os.listdir(template_folder)
+                      if os.path.isdir(f"{template_folder}/{template_set}")
+                      for file_name in os.listdir(
+                          f"{template_folder}/{template_set}")
+                      if file_name.endswith(".txt")]
+    assert sorted(template_files) == TEMPLATE_KEYS
+
+
+@pytest.mark.parametrize("template_key", TEMPLATE_KEYS)
+def test_prompts_equal_the_old_generate_prompt(template_key):
+    rng = random.Random(template_key)
+    template_file = f"persona/prompt_template/{template_key}"
+    old_template_file = os.path.join(BACKEND_SERVER, template_file)
+    with open(old_template_file) as f:
+        slots = [int(i) for i in input_slot_pattern.findall(f.read())]
+    input_count = max(slots, default=-1) + 1
+
+    # All the inputs, fewer inputs than slots (the rest are left as they
+    # are), a single string, and inputs that are not strings.
+    inputs = [[random_input(rng) for _ in range(input_count)]
+              for _ in range(5)]
+    inputs += [[random_input(rng) for _ in range(input_count // 2)],
+               random_input(rng),
+               [rng.randint(0, 99) for _ in range(input_count)]]
+    for curr_input in inputs:
+        assert (generate_prompt(curr_input, template_file)
+                == old_generate_prompt(curr_input, old_template_file))